@@ -0,0 +1,107 @@
+"""Time-slicing of soldier AI so a tick takes about the same time however many soldiers there are.
+Soldiers far from the fighting search for targets less often, staggered so they don't all search on the same tick, and
+paths are found over several ticks within a fixed time budget per tick"""
+import time
+from collections import deque
+import globals
+from pathfinding import AStarSearch
+
+
+class AIScheduler:
+
+    def __init__(self, target_tick_ms=None, path_budget_ms=None, targeting_intervals=None, max_interval_scale=None,
+                 node_expansions_per_slice=64):
+        if target_tick_ms is None:
+            target_tick_ms = globals.AI_TARGET_TICK_MS
+        if path_budget_ms is None:
+            path_budget_ms = globals.AI_PATH_BUDGET_MS
+        if targeting_intervals is None:
+            targeting_intervals = globals.AI_TARGETING_INTERVALS
+        if max_interval_scale is None:
+            max_interval_scale = globals.AI_MAX_INTERVAL_SCALE
+        if len(targeting_intervals) != 3: raise ValueError("targeting_intervals has to be (near, middle, far) tick intervals")
+        if not isinstance(node_expansions_per_slice, int) or node_expansions_per_slice <= 0: raise ValueError("node_expansions_per_slice has to be a positive int")
+        self.target_tick_ms = target_tick_ms
+        self.path_budget_ms = path_budget_ms
+        self.targeting_intervals = targeting_intervals
+        self.max_interval_scale = max_interval_scale
+        self.node_expansions_per_slice = node_expansions_per_slice
+        # Grows while ticks take longer than target_tick_ms so soldiers away from the fighting search less often
+        self.interval_scale = 1
+        self.path_requests = deque()
+        self.tick = 0
+        self.tick_start = 0
+
+    def begin_tick(self, tick):
+        self.tick = tick
+        self.tick_start = time.perf_counter()
+        self.serve_path_requests()
+
+    def end_tick(self):
+        tick_ms = (time.perf_counter() - self.tick_start) * 1000
+        if tick_ms > self.target_tick_ms:
+            self.interval_scale = min(self.interval_scale + 1, self.max_interval_scale)
+        elif tick_ms < self.target_tick_ms / 2:
+            self.interval_scale = max(self.interval_scale - 1, 1)
+
+    def get_targeting_interval(self, soldier):
+        """Soldiers that are fighting search every tick, the others less often the further they are from an enemy"""
+        if soldier.current_target_enemy is not None or soldier.shield_recharge_delay_active:
+            return 1
+        near_interval, middle_interval, far_interval = self.targeting_intervals
+        if soldier.nearest_enemy_distance is None:
+            interval = far_interval
+        elif soldier.nearest_enemy_distance <= soldier.enemy_engagement_range:
+            interval = near_interval
+        elif soldier.nearest_enemy_distance <= 2 * soldier.enemy_engagement_range:
+            interval = middle_interval
+        else:
+            interval = far_interval
+        return interval * self.interval_scale
+
+    def should_evaluate_targets(self, soldier):
+        # Offsetting by id spreads soldiers with the same interval over different ticks
+        return (self.tick + soldier.id) % self.get_targeting_interval(soldier) == 0
+
+    def request_path(self, soldier, goal):
+        search = AStarSearch(soldier.map, soldier.grid_position, goal, soldier.enable_collisions)
+        search.soldier = soldier
+        self.path_requests.append(search)
+        profiler = globals.profiler
+        if profiler is not None:
+            profiler.count("paths_planned")
+        return search
+
+    def serve_path_requests(self):
+        """Advances the oldest path searches until the budget runs out, a search that isn't done is resumed next tick"""
+        profiler = globals.profiler
+        if profiler is not None:
+            profiler.start_phase("astar")
+        deadline = time.perf_counter() + self.path_budget_ms / 1000
+        nodes_expanded = 0
+        while self.path_requests and time.perf_counter() < deadline:
+            search = self.path_requests[0]
+            # Requests of soldiers that died or asked for another path since are dropped
+            if not search.soldier.alive or search.soldier.path_request is not search:
+                self.path_requests.popleft()
+                continue
+            nodes_expanded_before = search.nodes_expanded
+            if search.step(self.node_expansions_per_slice):
+                self.path_requests.popleft()
+            nodes_expanded += search.nodes_expanded - nodes_expanded_before
+        if profiler is not None:
+            profiler.end_phase("astar")
+            profiler.count("nodes_expanded", nodes_expanded)
+
+
+def enable_ai_scheduler(target_tick_ms=None, path_budget_ms=None):
+    globals.ai_scheduler = AIScheduler(target_tick_ms=target_tick_ms, path_budget_ms=path_budget_ms)
+    return globals.ai_scheduler
+
+
+def disable_ai_scheduler():
+    """Soldiers waiting for a path ask for it again without the scheduler"""
+    if globals.ai_scheduler is not None:
+        for soldier in globals.soldiers_dict.values():
+            soldier.path_request = None
+        globals.ai_scheduler = None
@@ -0,0 +1,89 @@
+"""Soldier archetypes loaded from a config file. Each archetype is compiled once into read-only tables that all of its
+soldiers share, so a soldier only holds a reference to its archetype however many loadouts there are"""
+import json
+from math import gcd
+import globals
+
+
+# Stats every archetype has to define, soldiers read them from their archetype
+ARCHETYPE_STATS = ("maximum_health", "fire_rate", "movement_speed", "enemy_engagement_range", "shield_recharge_delay",
+                   "shield_recharge_rate")
+
+
+class Archetype:
+    """A compiled archetype. Damage falloff ranges are multiples of bucket_width, so the damage at a distance is the entry
+    of damage_by_bucket at distance // bucket_width"""
+    __slots__ = ("id", "name", "projectile_speed", "damage_falloff", "maximum_range", "bucket_width", "damage_by_bucket") + ARCHETYPE_STATS
+
+    def __init__(self, id, name, definition):
+        if not isinstance(id, int): raise TypeError("id has to be an int")
+        if not isinstance(name, str): raise TypeError("name has to be a str")
+        if not isinstance(definition, dict): raise TypeError(f"Archetype {name} has to be a dict")
+        self.id = id
+        self.name = name
+        for stat in ARCHETYPE_STATS:
+            if stat not in definition: raise ValueError(f"Archetype {name} has no {stat}")
+            value = definition[stat]
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0: raise ValueError(f"{stat} of archetype {name} has to be a non-negative number")
+            setattr(self, stat, value)
+        if not isinstance(self.fire_rate, int) or self.fire_rate <= 0: raise ValueError(f"fire_rate of archetype {name} has to be a positive int")
+        # Distance a shot travels per millisecond like movement_speed, None for hit-scan weapons that hit instantly
+        self.projectile_speed = definition.get("projectile_speed")
+        if self.projectile_speed is not None and (not isinstance(self.projectile_speed, (int, float)) or self.projectile_speed <= 0): raise ValueError(f"projectile_speed of archetype {name} has to be a positive number or null")
+        self.compile_damage_falloff(definition.get("damage_falloff"))
+        # Soldiers would pick targets they can't damage
+        if self.enemy_engagement_range > self.maximum_range: raise ValueError(f"enemy_engagement_range of archetype {name} can't be greater than the last max_range in its damage_falloff")
+
+    def compile_damage_falloff(self, damage_falloff):
+        """Falloff is a list of {"max_range", "damage"} in increasing range, each range starting where the previous one ended"""
+        if not isinstance(damage_falloff, list) or not damage_falloff: raise ValueError(f"damage_falloff of archetype {self.name} has to be a non-empty list")
+        # Format: {(minimum range, maximum range): damage}
+        self.damage_falloff = {}
+        minimum_range = 0
+        for falloff_range in damage_falloff:
+            maximum_range = falloff_range.get("max_range")
+            damage = falloff_range.get("damage")
+            if not isinstance(maximum_range, int) or maximum_range <= minimum_range: raise ValueError(f"max_range in damage_falloff of archetype {self.name} has to be an increasing int")
+            if not isinstance(damage, (int, float)) or damage < 0: raise ValueError(f"damage in damage_falloff of archetype {self.name} has to be a non-negative number")
+            self.damage_falloff[(minimum_range, maximum_range)] = damage
+            minimum_range = maximum_range
+        self.maximum_range = minimum_range
+        self.bucket_width = 0
+        for falloff_range in self.damage_falloff:
+            self.bucket_width = gcd(self.bucket_width, falloff_range[1])
+        damage_by_bucket = []
+        for (minimum_range, maximum_range), damage in self.damage_falloff.items():
+            damage_by_bucket.extend([damage] * ((maximum_range - minimum_range) // self.bucket_width))
+        # A shot at exactly the maximum range still does the last range's damage
+        damage_by_bucket.append(damage_by_bucket[-1])
+        self.damage_by_bucket = tuple(damage_by_bucket)
+
+    def get_damage(self, distance):
+        """Damage of a shot at distance, None past the last falloff range"""
+        if distance > self.maximum_range:
+            return None
+        return self.damage_by_bucket[int(distance // self.bucket_width)]
+
+
+def load_archetypes(path=None):
+    """Compiles the archetypes in the config file into globals.archetypes"""
+    if path is None:
+        path = globals.ARCHETYPES_FILE
+    with open(path, "r") as f:
+        definitions = json.load(f)
+    if not isinstance(definitions, dict): raise ValueError("The archetypes file has to map archetype names to definitions")
+    archetypes = {}
+    for name, definition in definitions.items():
+        archetypes[name] = Archetype(len(archetypes), name, definition)
+    for weapon_type in globals.WEAPON_TYPES:
+        if weapon_type not in archetypes: raise ValueError(f"The archetypes file has no {weapon_type} archetype")
+    globals.archetypes = archetypes
+    return archetypes
+
+
+def get_archetype(name):
+    if globals.archetypes is None:
+        load_archetypes()
+    archetype = globals.archetypes.get(name)
+    if archetype is None: raise ValueError(f"weapon type has to be one of {list(globals.archetypes)}")
+    return archetype
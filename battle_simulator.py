@@ -4,6 +4,7 @@ import globals
 from page import *
 from entity import *
 from map import *
+from map_catalog import map_catalog
 import os
 import sys
 import threading
@@ -54,6 +55,8 @@ class TkinterProgram(tkinter.Tk):
     def end_pygame_thread(self):
         globals.pygame_running = False
         pygame.quit()
+        # Fonts can't be used after pygame.quit(), the next pygame thread makes new ones
+        get_font.cache_clear()
         if self.pygame_thread is not None:
             self.pygame_thread.join()
             self.pygame_thread = None
@@ -102,6 +105,7 @@ class StartFrame(tkinter.Frame):
 
     def go_to_level_selector_frame(self):
         self.get_selected_pygame_page()
+        self.controller.frames[LevelSelectorFrame].refresh_map_dropdown()
         self.controller.show_frame(LevelSelectorFrame)
 
     def get_selected_pygame_page(self):
@@ -123,10 +127,9 @@ class LevelSelectorFrame(tkinter.Frame):
         self.map_dropdown_label = tkinter.Label(master=self, text="Load Map: ")
         self.map_dropdown_label.grid(row=0, column=0)
         self.map_dropdown_options = ["Blank", "Randomly Generated"]
-        # Only txt files recognized as saved maps in Maps directory
-        for file in os.listdir("./Maps/"):
-            if file[-4:] == ".txt":
-                self.map_dropdown_options.append(file[:-4])
+        # Saved maps come from the catalog index so map files don't have to be opened to list them
+        map_catalog.refresh()
+        self.map_dropdown_options += map_catalog.find_maps()
         self.map_dropdown_string_holder = tkinter.StringVar()
         self.map_dropdown_string_holder.set("Blank")
         self.map_dropdown = tkinter.OptionMenu(self, self.map_dropdown_string_holder, *self.map_dropdown_options)
@@ -144,6 +147,17 @@ class LevelSelectorFrame(tkinter.Frame):
         self.controller.end_pygame_thread()
         self.controller.show_frame(StartFrame)
 
+    def refresh_map_dropdown(self):
+        """Picks up maps saved since the program started"""
+        map_catalog.refresh()
+        self.map_dropdown_options = ["Blank", "Randomly Generated"] + map_catalog.find_maps()
+        menu = self.map_dropdown["menu"]
+        menu.delete(0, "end")
+        for option in self.map_dropdown_options:
+            menu.add_command(label=option, command=tkinter._setit(self.map_dropdown_string_holder, option))
+        if self.map_dropdown_string_holder.get() not in self.map_dropdown_options:
+            self.map_dropdown_string_holder.set("Blank")
+
     def start_game(self):
         globals.pygame_running = True
         globals.map_name = self.map_dropdown_string_holder.get()
@@ -315,11 +329,12 @@ class MapCreatorOptionsFrame(tkinter.Frame):
         self.controller.show_frame(StartFrame)
 
     def save_map(self):
-        self.info_label["text"] = "Map saved. You will need to restart for it to show up in the list."
+        self.info_label["text"] = "Map saved."
         globals.save_map = True
         globals.save_map_name = self.save_map_entry_string_holder.get()
 
 
-app = TkinterProgram()
-app.mainloop()
+if __name__ == "__main__":
+    app = TkinterProgram()
+    app.mainloop()
 
@@ -0,0 +1,88 @@
+"""Reproducible fixtures for the benchmarks: seeded maps and soldier placements that don't need a display"""
+import os
+import sys
+from random import Random
+
+# The simulation scripts import each other as top level modules, so the repository folder has to be on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pygame import Surface
+import globals
+from map import Map
+from entity import Soldier, CapturePoint
+from simulation import Simulation, reset_simulation_state
+from utility import Point
+
+
+def reset_globals():
+    reset_simulation_state()
+
+
+def make_surface():
+    # A plain Surface is enough for the entities, no window has to be opened
+    return Surface(globals.WIN_SIZE)
+
+
+def make_map(nrows=40, ncols=80, seed=0, p_of_wall=0.2):
+    map_array = globals.generate_random_map(width=ncols, height=nrows, p_of_wall=p_of_wall, seed=seed)
+    return Map(win=make_surface(), map_array=map_array, wall_color=globals.BROWNISH_GREY)
+
+
+def get_random_empty_point(map, rng):
+    while True:
+        row = rng.randrange(0, map.nrows)
+        col = rng.randrange(0, map.ncols)
+        if map.map_array[row][col] == 0:
+            return Point(col * map.grid_width + map.grid_width / 2, row * map.grid_width + map.grid_width / 2)
+
+
+def place_soldier(soldier, coordinates_center):
+    """Puts a soldier on the map alive, the same way Soldier.spawn does at a spawn point"""
+    soldier.coordinates = Point(coordinates_center.x - soldier.width / 2, coordinates_center.y - soldier.width / 2)
+    soldier.coordinates_center = coordinates_center.get_coordinates()
+    soldier.health = soldier.maximum_health
+    soldier.alive = True
+    soldier.color = soldier.original_color
+    soldier.get_grid_coordinates(soldier.map)
+
+
+def place_soldiers(map, number_per_faction, seed=0, factions=("NC", "TR", "VS")):
+    """Registers number_per_faction living soldiers of each faction at seeded random empty squares"""
+    rng = Random(seed)
+    soldiers = []
+    for faction in factions:
+        for i in range(0, number_per_faction):
+            soldier = Soldier(win=map.win, map=map, id=globals.next_soldiers_dict_key, shape="square", width=5,
+                              coordinates=None, faction=faction, weapon_type=rng.choice(globals.WEAPON_TYPES),
+                              aim_factor=min(rng.random() + 0.3, 1))
+            place_soldier(soldier, get_random_empty_point(map, rng))
+            globals.soldiers_dict[globals.next_soldiers_dict_key] = soldier
+            globals.entity_list.append(soldier)
+            globals.next_soldiers_dict_key += 1
+            soldiers.append(soldier)
+    return soldiers
+
+
+def place_capture_point(map, seed=0):
+    rng = Random(seed)
+    capture_point = CapturePoint(win=map.win, map=map, id=globals.next_capture_point_dict_key,
+                                 coordinates=get_random_empty_point(map, rng))
+    globals.capture_point_dict[globals.next_capture_point_dict_key] = capture_point
+    globals.entity_list.append(capture_point)
+    globals.next_capture_point_dict_key += 1
+    return capture_point
+
+
+def make_battle(seed=0, number_per_faction=15, nrows=40, ncols=80, spawn_timer=100, factions=("NC", "TR", "VS")):
+    """A full battle: one Sunderer per faction and a capture point at seeded random places, and soldiers waiting to
+    spawn. The spawn timer is shorter than a real Sunderer's so the fighting starts within a few hundred ticks"""
+    game_map = make_map(nrows=nrows, ncols=ncols, seed=seed)
+    simulation = Simulation(win=game_map.win, map=game_map, seed=seed)
+    rng = Random(seed)
+    for faction in factions:
+        spawn_point = simulation.create_spawn_point(coordinates=get_random_empty_point(game_map, rng), faction=faction)
+        spawn_point.spawn_timer = spawn_timer
+    simulation.create_capture_point(coordinates=get_random_empty_point(game_map, rng))
+    for faction in factions:
+        simulation.add_soldiers(faction=faction, number_of_soldiers=number_per_faction)
+    return simulation
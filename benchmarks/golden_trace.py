@@ -0,0 +1,137 @@
+"""Macro benchmark that runs full seeded battles, hashes the state after every tick into a trace and compares it
+against a stored golden trace. A change that makes the simulation faster but also changes how battles play out
+shows up as a divergence at the first tick that differs.
+
+Usage: python benchmarks/golden_trace.py [--battle NAME] [--ticks N] [--update]"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+
+import fixtures
+import globals
+from profiler import enable_profiler, disable_profiler
+from telemetry import enable_telemetry, disable_telemetry
+from ai_scheduler import enable_ai_scheduler, disable_ai_scheduler
+
+
+GOLDEN_TRACE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+DT = 4
+# Format: {battle name: keyword arguments for fixtures.make_battle}
+BATTLES = {"small": {"seed": 1, "number_per_faction": 10},
+           "medium": {"seed": 5, "number_per_faction": 30, "nrows": 60, "ncols": 120}}
+DEFAULT_TICKS = {"small": 3000, "medium": 1500}
+
+SOLDIER_STATE = struct.Struct("<q?ddd qqq")
+CAPTURE_POINT_STATE = struct.Struct("<q8sq")
+
+
+def hash_simulation_state():
+    """Hash of everything that decides how the battle continues, floats hashed by their exact bits"""
+    state_hash = hashlib.blake2b(digest_size=8)
+    for soldier in globals.soldiers_dict.values():
+        if soldier.coordinates_center is not None:
+            x, y = soldier.coordinates_center.x, soldier.coordinates_center.y
+        else:
+            x, y = -1.0, -1.0
+        target_id = soldier.current_target_enemy.id if soldier.current_target_enemy is not None else -1
+        state_hash.update(SOLDIER_STATE.pack(soldier.id, soldier.alive, soldier.health, x, y,
+                                             soldier.kills, soldier.deaths, target_id))
+    for capture_point in globals.capture_point_dict.values():
+        state_hash.update(CAPTURE_POINT_STATE.pack(capture_point.id, capture_point.current_faction.encode("ascii"),
+                                                   capture_point.time_to_be_flipped_counter))
+    return state_hash.hexdigest()
+
+
+def run_battle(battle_name, number_of_ticks, profile_path=None, telemetry_directory=None, schedule_ai=False):
+    simulation = fixtures.make_battle(**BATTLES[battle_name])
+    if profile_path is not None:
+        enable_profiler(output_path=profile_path)
+    if telemetry_directory is not None:
+        enable_telemetry(output_directory=telemetry_directory)
+    if schedule_ai:
+        enable_ai_scheduler()
+    trace = []
+    start = time.perf_counter()
+    for i in range(0, number_of_ticks):
+        simulation.step(DT)
+        trace.append(hash_simulation_state())
+    disable_telemetry()
+    disable_ai_scheduler()
+    elapsed = time.perf_counter() - start
+    disable_profiler()
+    summary = {"kills": sum(soldier.kills for soldier in globals.soldiers_dict.values()),
+               "capture_points": {capture_point.id: capture_point.current_faction for capture_point in globals.capture_point_dict.values()}}
+    fixtures.reset_globals()
+    return trace, elapsed, summary
+
+
+def find_divergence(trace, golden_trace):
+    """Returns the first tick (1 based) where the traces differ, or None if they match"""
+    for tick, (state_hash, golden_state_hash) in enumerate(zip(trace, golden_trace), start=1):
+        if state_hash != golden_state_hash:
+            return tick
+    if len(trace) != len(golden_trace):
+        return min(len(trace), len(golden_trace)) + 1
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run seeded battles, report ticks per second and divergence from the golden traces")
+    parser.add_argument("--battle", choices=sorted(BATTLES.keys()), action="append", help="battle to run, can be repeated (default: all)")
+    parser.add_argument("--ticks", type=int, default=None, help="number of ticks to run (default: the golden trace's length)")
+    parser.add_argument("--update", action="store_true", help="store the traces of this run as the new golden traces")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--profile", default=None, help="write per-tick phase timings to this CSV (or .jsonl) file, named per battle")
+    parser.add_argument("--telemetry", default=None, help="record battle telemetry into a subdirectory per battle of this directory")
+    parser.add_argument("--ai-scheduler", action="store_true", help="time-slice soldier AI, the battles then differ from the golden traces so they aren't compared")
+    args = parser.parse_args()
+    if args.update and args.ai_scheduler:
+        parser.error("the golden traces are recorded without the AI scheduler")
+
+    report = {}
+    diverged = False
+    for battle_name in args.battle or sorted(BATTLES.keys()):
+        golden_trace_path = os.path.join(GOLDEN_TRACE_DIRECTORY, f"{battle_name}.json")
+        golden = None
+        if os.path.exists(golden_trace_path) and not args.update:
+            with open(golden_trace_path, "r") as f:
+                golden = json.load(f)
+        number_of_ticks = args.ticks
+        if number_of_ticks is None:
+            number_of_ticks = len(golden["trace"]) if golden is not None else DEFAULT_TICKS[battle_name]
+        profile_path = None
+        if args.profile is not None:
+            profile_path_root, profile_path_extension = os.path.splitext(args.profile)
+            profile_path = f"{profile_path_root}_{battle_name}{profile_path_extension}"
+        telemetry_directory = None
+        if args.telemetry is not None:
+            telemetry_directory = os.path.join(args.telemetry, battle_name)
+        trace, elapsed, summary = run_battle(battle_name, number_of_ticks, profile_path, telemetry_directory, args.ai_scheduler)
+        result = {"ticks": number_of_ticks, "seconds": elapsed, "ticks_per_second": number_of_ticks / elapsed, "summary": summary}
+        if golden is not None and not args.ai_scheduler:
+            divergence_tick = find_divergence(trace, golden["trace"][:number_of_ticks])
+            result["divergence_tick"] = divergence_tick
+            if divergence_tick is not None:
+                diverged = True
+                print(f"DIVERGENCE {battle_name}: first differs from the golden trace at tick {divergence_tick}", file=sys.stderr)
+        if args.update:
+            os.makedirs(GOLDEN_TRACE_DIRECTORY, exist_ok=True)
+            with open(golden_trace_path, "w") as f:
+                json.dump({"battle": BATTLES[battle_name], "dt": DT, "trace": trace}, f, indent=0)
+        print(f"{battle_name:<10} {result['ticks_per_second']:>10.1f} ticks/s", file=sys.stderr)
+        report[battle_name] = result
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    if diverged:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
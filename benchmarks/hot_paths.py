@@ -0,0 +1,213 @@
+"""Microbenchmarks for the simulation hot paths.
+Runs headless, writes the results as JSON and compares them against a stored baseline.
+
+Usage: python benchmarks/hot_paths.py [--filter NAME] [--output FILE] [--baseline FILE] [--threshold 0.1] [--update-baseline]"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from random import Random
+from statistics import median
+
+import fixtures
+import globals
+from utility import Point, Ray, find_equation_of_line, find_angle_of_line
+
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "hot_paths.json")
+POPULATION_SIZES = (10, 50, 200)
+MAP_SIZES = ((40, 80), (100, 200), (200, 400))
+
+
+def bench_find_enemy_target(number_per_faction):
+    game_map = fixtures.make_map(seed=1)
+    soldiers = fixtures.place_soldiers(game_map, number_per_faction, seed=2)
+    def run():
+        for soldier in soldiers:
+            soldier.current_target_enemy = None
+            soldier.find_enemy_target(globals.soldiers_dict.values())
+    return run, len(soldiers)
+
+
+def bench_get_collision_point_of_ray(number_per_faction):
+    game_map = fixtures.make_map(seed=1)
+    soldiers = fixtures.place_soldiers(game_map, number_per_faction, seed=2)
+    rng = Random(3)
+    rays = []
+    for soldier in soldiers:
+        target = fixtures.get_random_empty_point(game_map, rng)
+        ray_line = find_equation_of_line(soldier.coordinates_center, target)
+        rays.append((soldier, Ray(angle=find_angle_of_line(soldier.coordinates_center, target), slope=ray_line[1],
+                                  intercept=ray_line[2], is_vertical=ray_line[0], x_value=ray_line[3])))
+    def run():
+        for soldier, ray in rays:
+            soldier.get_collision_point_of_ray(ray)
+    return run, len(rays)
+
+
+def bench_move_astar(map_size):
+    game_map = fixtures.make_map(nrows=map_size[0], ncols=map_size[1], seed=1)
+    soldiers = fixtures.place_soldiers(game_map, 5, seed=2, factions=("NC",))
+    destination = fixtures.get_random_empty_point(game_map, Random(3))
+    def run():
+        for soldier in soldiers:
+            soldier.cancel_all_queued_moves()
+            soldier.move_astar(dt=0, destination=destination)
+    return run, len(soldiers)
+
+
+def bench_soldier_move(number_per_faction):
+    game_map = fixtures.make_map(seed=1)
+    soldiers = fixtures.place_soldiers(game_map, number_per_faction, seed=2)
+    rng = Random(3)
+    destinations = [fixtures.get_random_empty_point(game_map, rng) for soldier in soldiers]
+    starts = [soldier.coordinates_center.get_coordinates() for soldier in soldiers]
+    def run():
+        for soldier, start, destination in zip(soldiers, starts, destinations):
+            # Every call starts from the same place so each repeat does the same work
+            fixtures.place_soldier(soldier, start)
+            soldier.cancel_all_queued_moves()
+            soldier.move(dt=4, destination=destination)
+    return run, len(soldiers)
+
+
+def bench_capture_point_update(number_per_faction):
+    game_map = fixtures.make_map(seed=1)
+    fixtures.place_soldiers(game_map, number_per_faction, seed=2)
+    capture_point = fixtures.place_capture_point(game_map, seed=3)
+    def run():
+        capture_point.update_at_start_of_frame()
+    return run, 1
+
+
+def bench_get_grid_position_of_point(map_size):
+    game_map = fixtures.make_map(nrows=map_size[0], ncols=map_size[1], seed=1)
+    rng = Random(2)
+    points = [Point(rng.random() * game_map.world_width, rng.random() * game_map.world_height) for i in range(0, 1000)]
+    def run():
+        for point in points:
+            game_map.get_grid_position_of_point(point)
+    return run, len(points)
+
+
+def bench_generate_random_map(map_size):
+    seeds = iter(range(0, 10 ** 9))
+    def run():
+        globals.generate_random_map(width=map_size[1], height=map_size[0], seed=next(seeds))
+    return run, 1
+
+
+BENCHMARKS = [("find_enemy_target", bench_find_enemy_target, POPULATION_SIZES),
+              ("get_collision_point_of_ray", bench_get_collision_point_of_ray, POPULATION_SIZES),
+              ("move_astar", bench_move_astar, MAP_SIZES),
+              ("Soldier.move", bench_soldier_move, POPULATION_SIZES),
+              ("CapturePoint.update_at_start_of_frame", bench_capture_point_update, POPULATION_SIZES),
+              ("Map.get_grid_position_of_point", bench_get_grid_position_of_point, MAP_SIZES),
+              ("generate_random_map", bench_generate_random_map, MAP_SIZES)]
+
+
+def get_benchmark_id(name, parameter):
+    if isinstance(parameter, tuple):
+        parameter = "x".join(str(i) for i in parameter)
+    return f"{name}[{parameter}]"
+
+
+def time_benchmark(run, repeat, min_time):
+    """Calls run in loops long enough to be timed reliably and returns the per call time of every loop"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(0, number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 10 ** 6:
+            break
+        number *= 2
+    timings = [elapsed / number]
+    for i in range(1, repeat):
+        start = time.perf_counter()
+        for j in range(0, number):
+            run()
+        timings.append((time.perf_counter() - start) / number)
+    return timings, number
+
+
+def run_benchmarks(name_filter=None, repeat=5, min_time=0.05):
+    results = {}
+    for name, benchmark, parameters in BENCHMARKS:
+        for parameter in parameters:
+            benchmark_id = get_benchmark_id(name, parameter)
+            if name_filter is not None and name_filter not in benchmark_id:
+                continue
+            fixtures.reset_globals()
+            run, operations_per_call = benchmark(parameter)
+            timings, number = time_benchmark(run, repeat, min_time)
+            results[benchmark_id] = {"median_s": median(timings),
+                                     "min_s": min(timings),
+                                     "per_operation_s": median(timings) / operations_per_call,
+                                     "loops": number,
+                                     "repeat": repeat}
+            print(f"{benchmark_id:<55} {median(timings) * 1e6:>12.1f} us/call", file=sys.stderr)
+    fixtures.reset_globals()
+    return results
+
+
+def compare_to_baseline(results, baseline_results, threshold):
+    """Returns the benchmarks whose median got slower than the baseline by more than threshold (0.1 = 10%)"""
+    regressions = {}
+    for benchmark_id, result in results.items():
+        baseline_result = baseline_results.get(benchmark_id)
+        if baseline_result is None:
+            continue
+        ratio = result["median_s"] / baseline_result["median_s"]
+        if ratio > 1 + threshold:
+            regressions[benchmark_id] = ratio
+    return regressions
+
+
+def get_metadata():
+    return {"python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation hot paths")
+    parser.add_argument("--filter", default=None, help="only run benchmarks whose id contains this text")
+    parser.add_argument("--output", default=None, help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown before a benchmark counts as a regression")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05, help="minimum seconds per timed loop")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    report = {"metadata": get_metadata(), "results": run_benchmarks(args.filter, args.repeat, args.min_time)}
+    regressions = {}
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report["results"], baseline["results"], args.threshold)
+        report["baseline"] = {"path": args.baseline, "threshold": args.threshold,
+                              "regressions": regressions}
+        for benchmark_id, ratio in regressions.items():
+            print(f"REGRESSION {benchmark_id}: {ratio:.2f}x the baseline median", file=sys.stderr)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
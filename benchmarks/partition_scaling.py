@@ -0,0 +1,73 @@
+"""Macro benchmark for partitioned_simulation: runs the same seeded battle with different numbers of partitions and
+reports ticks per second and the speedup over the first partition count for each. Every partition count has to give the same battle,
+so the state hashes of the runs are compared as well. It also reports the share of a tick spent in the partitioned
+targeting pass with one partition, which caps the speedup at 1 / (1 - share), and the ticks per second of a plain
+Simulation for reference (a plain Simulation plays a different battle, see partitioned_simulation).
+
+Usage: python benchmarks/partition_scaling.py [--partitions 1 2 4 8] [--ticks N] [--battle NAME]"""
+import argparse
+import json
+import sys
+import time
+
+import fixtures
+from golden_trace import BATTLES, DT, hash_simulation_state, find_divergence, run_battle
+from partitioned_simulation import PartitionedSimulation
+
+
+def run_partitioned_battle(battle_name, number_of_partitions, number_of_ticks):
+    partitioned_simulation = PartitionedSimulation(fixtures.make_battle(**BATTLES[battle_name]), number_of_partitions)
+    trace = []
+    start = time.perf_counter()
+    try:
+        for i in range(0, number_of_ticks):
+            partitioned_simulation.step(DT)
+            trace.append(hash_simulation_state())
+    finally:
+        partitioned_simulation.close()
+    elapsed = time.perf_counter() - start
+    parallel_share = partitioned_simulation.targeting_seconds / partitioned_simulation.step_seconds
+    fixtures.reset_globals()
+    return trace, elapsed, parallel_share
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report how partitioned simulation scales with the number of worker processes")
+    parser.add_argument("--partitions", type=int, nargs="+", default=[1, 2, 4, 8], help="partition counts to run")
+    parser.add_argument("--ticks", type=int, default=1000, help="number of ticks to run")
+    parser.add_argument("--battle", choices=sorted(BATTLES.keys()), default="medium", help="battle to run")
+    args = parser.parse_args()
+
+    trace, elapsed, summary = run_battle(args.battle, args.ticks)
+    report = {"simulation": {"seconds": elapsed, "ticks_per_second": args.ticks / elapsed}, "partitions": {}}
+    print(f"simulation     {args.ticks / elapsed:>10.1f} ticks/s", file=sys.stderr)
+    first_trace = None
+    first_elapsed = None
+    diverged = False
+    for number_of_partitions in args.partitions:
+        trace, elapsed, parallel_share = run_partitioned_battle(args.battle, number_of_partitions, args.ticks)
+        result = {"seconds": elapsed, "ticks_per_second": args.ticks / elapsed, "parallel_share": parallel_share}
+        if number_of_partitions == 1:
+            # Measured without workers, so it's the share of a tick that the partitions split between them
+            report["speedup_cap"] = 1 / (1 - parallel_share)
+        if first_trace is None:
+            first_trace = trace
+            first_elapsed = elapsed
+        else:
+            result["speedup"] = first_elapsed / elapsed
+            result["divergence_tick"] = find_divergence(trace, first_trace)
+            if result["divergence_tick"] is not None:
+                diverged = True
+                print(f"DIVERGENCE {number_of_partitions} partitions: first differs at tick {result['divergence_tick']}", file=sys.stderr)
+        print(f"{number_of_partitions:>3} partitions {result['ticks_per_second']:>10.1f} ticks/s "
+              f"{result.get('speedup', 1):>6.2f}x", file=sys.stderr)
+        report["partitions"][number_of_partitions] = result
+    if "speedup_cap" in report:
+        print(f"speedup cap    {report['speedup_cap']:>10.2f}x", file=sys.stderr)
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if diverged:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
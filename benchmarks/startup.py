@@ -0,0 +1,117 @@
+"""Startup benchmark for headless runs: how long a fresh interpreter takes to import the simulator, build a scenario's
+battle and run its first tick, and whether pygame or tkinter got imported on the way.
+Every run is a new process so nothing is already imported or cached.
+
+Usage: python benchmarks/startup.py [--scenario FILE] [--runs 10] [--output FILE] [--baseline FILE] [--threshold 0.1] [--update-baseline]"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from statistics import median
+
+from hot_paths import get_metadata
+
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "startup.json")
+DEFAULT_SCENARIO_PATH = os.path.join(REPOSITORY_DIRECTORY, "Scenarios", "example.json")
+GUI_MODULES = ("pygame", "tkinter")
+STAGES = ("import_s", "build_s", "first_tick_s", "total_s")
+
+# Runs in the fresh interpreter, the times are measured from when it starts running code
+CHILD_CODE = """
+import time
+start = time.perf_counter()
+import json
+import sys
+sys.path.insert(0, sys.argv[1])
+from scenario import Scenario
+imported = time.perf_counter()
+scenario = Scenario.from_file(sys.argv[2])
+simulation = scenario.build_simulation()
+built = time.perf_counter()
+simulation.step(scenario.dt)
+first_tick = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "build_s": built - imported, "first_tick_s": first_tick - built,
+                  "modules": {name: name in sys.modules for name in sys.argv[3:]}}))
+"""
+
+
+def run_once(scenario_path):
+    """Returns the stage times of one fresh interpreter, total_s includes starting the interpreter itself"""
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", CHILD_CODE, REPOSITORY_DIRECTORY, scenario_path, *GUI_MODULES],
+                               capture_output=True, text=True, cwd=REPOSITORY_DIRECTORY)
+    total = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"Startup run failed:\n{completed.stderr}")
+    result = json.loads(completed.stdout.splitlines()[-1])
+    result["total_s"] = total
+    return result
+
+
+def run_benchmark(scenario_path, runs):
+    samples = [run_once(scenario_path) for i in range(0, runs)]
+    results = {}
+    for stage in STAGES:
+        timings = [sample[stage] for sample in samples]
+        results[stage] = {"median_s": median(timings), "min_s": min(timings), "runs": runs}
+        print(f"{stage:<15} {median(timings) * 1e3:>10.1f} ms", file=sys.stderr)
+    # A module counts as imported if any run imported it
+    gui_modules = {name: any(sample["modules"][name] for sample in samples) for name in GUI_MODULES}
+    return results, gui_modules
+
+
+def compare_to_baseline(results, baseline_results, threshold):
+    """Returns the stages whose median got slower than the baseline by more than threshold (0.1 = 10%)"""
+    regressions = {}
+    for stage, result in results.items():
+        baseline_result = baseline_results.get(stage)
+        if baseline_result is None:
+            continue
+        ratio = result["median_s"] / baseline_result["median_s"]
+        if ratio > 1 + threshold:
+            regressions[stage] = ratio
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup of headless scenario runs")
+    parser.add_argument("--scenario", default=DEFAULT_SCENARIO_PATH, help="scenario file to build and run a tick of")
+    parser.add_argument("--runs", type=int, default=10, help="number of fresh interpreters to time")
+    parser.add_argument("--output", default=None, help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown before a stage counts as a regression")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    results, gui_modules = run_benchmark(os.path.abspath(args.scenario), args.runs)
+    report = {"metadata": get_metadata(), "scenario": args.scenario, "results": results, "gui_modules_imported": gui_modules}
+    regressions = {}
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report["results"], baseline["results"], args.threshold)
+        report["baseline"] = {"path": args.baseline, "threshold": args.threshold, "regressions": regressions}
+        for stage, ratio in regressions.items():
+            print(f"REGRESSION {stage}: {ratio:.2f}x the baseline median", file=sys.stderr)
+    for name, imported in gui_modules.items():
+        if imported:
+            print(f"REGRESSION {name} was imported by a headless run", file=sys.stderr)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    if regressions or any(gui_modules.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""What-if branching of a running battle: fork a battle into variants that each change one thing and run them side by side.
+Worker processes are forked from the parent so they start from its battle state copy-on-write instead of having it
+serialized and sent to them"""
+import os
+import multiprocessing
+import globals
+from simulation import Simulation
+from checkpoint import serialize_simulation, deserialize_simulation
+
+
+class Variant:
+
+    def __init__(self, name, modify=None):
+        """modify is called with the variant's copy of the simulation before it is advanced, None keeps the battle as is"""
+        if not isinstance(name, str): raise TypeError("name has to be a string")
+        if modify is not None and not callable(modify): raise TypeError("modify has to be callable or None")
+        self.name = name
+        self.modify = modify
+
+
+# Modifications
+def add_soldiers_at_spawn_point(faction, number_of_soldiers, spawn_point_id=None):
+    """Soldiers appear at the spawn point right away instead of waiting for its spawn timer"""
+    def modify(simulation):
+        spawn_points = [spawn_point for spawn_point in globals.spawn_point_dict.values() if spawn_point.faction == faction]
+        if spawn_point_id is not None:
+            spawn_points = [spawn_point for spawn_point in spawn_points if spawn_point.id == spawn_point_id]
+        if not spawn_points: raise ValueError(f"There is no {faction} spawn point to add soldiers at")
+        for i in range(0, number_of_soldiers):
+            soldier = simulation.create_soldier(faction=faction, weapon_type=simulation.rng.choice(globals.WEAPON_TYPES),
+                                                aim_factor=min(simulation.rng.random() + 0.3, 1))
+            soldier.spawn_timer_counter = spawn_points[0].spawn_timer
+            soldier.spawn(spawn_points[0])
+    return modify
+
+
+def remove_spawn_point(spawn_point_id):
+    def modify(simulation):
+        simulation.remove_spawn_point(spawn_point_id)
+    return modify
+
+
+def set_aim_factors(faction, minimum_aim_factor, maximum_aim_factor):
+    """Redraws the aim of every soldier of the faction uniformly between the two bounds"""
+    if not 0 <= minimum_aim_factor <= maximum_aim_factor <= 1: raise ValueError("aim factors have to be between 0 and 1 with the minimum first")
+    def modify(simulation):
+        for soldier in globals.soldiers_dict.values():
+            if soldier.faction == faction:
+                soldier.aim_factor = simulation.rng.uniform(minimum_aim_factor, maximum_aim_factor)
+    return modify
+
+
+def summarize_simulation(simulation):
+    summary = {"tick": simulation.tick, "kills": {}, "deaths": {}, "alive": {}, "capture_points": {}}
+    for faction in globals.FACTION_LIST:
+        soldiers = [soldier for soldier in globals.soldiers_dict.values() if soldier.faction == faction]
+        summary["kills"][faction] = sum(soldier.kills for soldier in soldiers)
+        summary["deaths"][faction] = sum(soldier.deaths for soldier in soldiers)
+        summary["alive"][faction] = sum(1 for soldier in soldiers if soldier.alive)
+    for capture_point in globals.capture_point_dict.values():
+        summary["capture_points"][capture_point.id] = capture_point.current_faction
+    return summary
+
+
+# State the forked workers inherit from the parent, set only while branch_simulation runs
+_parent_simulation = None
+_variants = None
+_number_of_ticks = None
+_dt = None
+
+
+def run_variant(variant_index):
+    """Runs in a forked worker, which has its own copy of the parent's simulation and globals"""
+    # The parent's profiler and telemetry files must not be written to from the workers
+    globals.profiler = None
+    globals.telemetry = None
+    return advance_variant(_parent_simulation, _variants[variant_index], _number_of_ticks, _dt)
+
+
+def advance_variant(simulation, variant, number_of_ticks, dt):
+    if variant.modify is not None:
+        variant.modify(simulation)
+    simulation.run(number_of_ticks, dt)
+    return summarize_simulation(simulation)
+
+
+def branch_simulation(simulation, variants, number_of_ticks, dt=None, processes=None):
+    """Advances every variant number_of_ticks ticks from the current state of the simulation and returns their summaries.
+    The variants keep the parent's RNG state, so apart from their modification they draw the same random numbers.
+    The parent simulation is left as it was"""
+    global _parent_simulation, _variants, _number_of_ticks, _dt
+    if not isinstance(simulation, Simulation): raise TypeError("simulation has to be a Simulation object")
+    for variant in variants:
+        if not isinstance(variant, Variant): raise TypeError("variants have to be Variant objects")
+    if dt is None:
+        dt = globals.dt
+    if "fork" not in multiprocessing.get_all_start_methods():
+        # Without fork every variant is restored from a checkpoint of the parent and run one after the other,
+        # then the parent is restored too, which replaces its entities and map with equal copies
+        checkpoint = serialize_simulation(simulation)
+        results = []
+        for variant in variants:
+            results.append(advance_variant(deserialize_simulation(checkpoint, simulation.win), variant, number_of_ticks, dt))
+        simulation.__dict__.update(deserialize_simulation(checkpoint, simulation.win).__dict__)
+        return dict(zip([variant.name for variant in variants], results))
+    if processes is None:
+        processes = min(len(variants), os.cpu_count() or 1)
+    _parent_simulation, _variants, _number_of_ticks, _dt = simulation, variants, number_of_ticks, dt
+    try:
+        # Running a variant changes the worker's copy of the battle, so every variant gets a freshly forked worker
+        with multiprocessing.get_context("fork").Pool(processes=processes, maxtasksperchild=1) as pool:
+            results = pool.map(run_variant, range(0, len(variants)), chunksize=1)
+    finally:
+        _parent_simulation, _variants, _number_of_ticks, _dt = None, None, None, None
+    return dict(zip([variant.name for variant in variants], results))
+
+
+def format_variant_results(results):
+    """Lays the variant summaries out as a table with one column per variant"""
+    names = list(results.keys())
+    rows = [["", *names]]
+    for faction in globals.FACTION_LIST:
+        rows.append([f"{faction} kills", *[str(results[name]["kills"][faction]) for name in names]])
+    for faction in globals.FACTION_LIST:
+        rows.append([f"{faction} alive", *[str(results[name]["alive"][faction]) for name in names]])
+    capture_point_ids = sorted({id for name in names for id in results[name]["capture_points"]})
+    for capture_point_id in capture_point_ids:
+        rows.append([f"capture point {capture_point_id}", *[results[name]["capture_points"].get(capture_point_id, "-") for name in names]])
+    column_widths = [max(len(row[i]) for row in rows) for i in range(0, len(rows[0]))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, column_widths)) for row in rows)
+
+
+if __name__ == "__main__":
+    import argparse
+    from checkpoint import load_checkpoint
+    parser = argparse.ArgumentParser(description="Branch a checkpointed battle into what-if variants and compare them")
+    parser.add_argument("checkpoint", help="checkpoint file saved with F5 or checkpoint.save_checkpoint")
+    parser.add_argument("--ticks", type=int, default=2000, help="number of ticks to advance every variant")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes (default: one per variant)")
+    args = parser.parse_args()
+    parent_simulation = load_checkpoint(args.checkpoint, None)
+    example_variants = [Variant("as is"),
+                        Variant("+20 TR", add_soldiers_at_spawn_point("TR", 20)),
+                        Variant("TR aim 0.3-0.6", set_aim_factors("TR", 0.3, 0.6))]
+    if globals.spawn_point_dict:
+        first_spawn_point = min(globals.spawn_point_dict.values(), key=lambda spawn_point: spawn_point.id)
+        example_variants.append(Variant(f"no {first_spawn_point.faction} spawn {first_spawn_point.id}", remove_spawn_point(first_spawn_point.id)))
+    print(format_variant_results(branch_simulation(parent_simulation, example_variants, args.ticks, processes=args.processes)))
@@ -0,0 +1,111 @@
+"""Camera that maps world coordinates onto the pygame window, with panning, zooming and visibility checks for culling"""
+import pygame
+import globals
+from utility import *
+
+
+class Camera:
+
+    def __init__(self, view_width, view_height, map):
+        if not isinstance(view_width, int) or not isinstance(view_height, int): raise TypeError("view size has to be ints")
+        self.view_width = view_width
+        self.view_height = view_height
+        self.world_width = map.world_width
+        self.world_height = map.world_height
+        # World coordinates of the top left corner of the window
+        self.x = 0
+        self.y = 0
+        self.zoom = 1
+        # Zooming out stops once the whole world fits in the window, or once grid squares get so small that the number
+        # of squares in view (and so the draw cost) would keep growing with the size of the world
+        zoom_to_fit_world = min(view_width / self.world_width, view_height / self.world_height)
+        zoom_at_min_grid_square_size = globals.CAMERA_MIN_GRID_SQUARE_SIZE / map.grid_width
+        self.min_zoom = min(1, max(zoom_to_fit_world, zoom_at_min_grid_square_size))
+        self.max_zoom = globals.CAMERA_MAX_ZOOM
+        self.pan_speed = globals.CAMERA_PAN_SPEED
+        self.zoom_step = globals.CAMERA_ZOOM_STEP
+        self.clamp()
+
+    def world_to_screen(self, x, y):
+        return (x - self.x) * self.zoom, (y - self.y) * self.zoom
+
+    def screen_to_world(self, point):
+        if not isinstance(point, Point): raise ValueError("point has to be a Point object")
+        return Point(point.x / self.zoom + self.x, point.y / self.zoom + self.y)
+
+    def scale(self, length):
+        return length * self.zoom
+
+    def get_visible_world_rect(self):
+        """Returns (left, top, right, bottom) of the part of the world inside the window"""
+        return self.x, self.y, self.x + self.view_width / self.zoom, self.y + self.view_height / self.zoom
+
+    def is_rect_visible(self, x, y, width, height):
+        left, top, right, bottom = self.get_visible_world_rect()
+        return x + width >= left and x <= right and y + height >= top and y <= bottom
+
+    def is_point_visible(self, x, y, margin=0):
+        left, top, right, bottom = self.get_visible_world_rect()
+        return left - margin <= x <= right + margin and top - margin <= y <= bottom + margin
+
+    def get_visible_grid_range(self, map):
+        """Returns (first_row, last_row, first_col, last_col) of the grid squares in view, last ones exclusive"""
+        left, top, right, bottom = self.get_visible_world_rect()
+        first_row = max(int(top // map.grid_width), 0)
+        last_row = min(int(bottom // map.grid_width) + 1, map.nrows)
+        first_col = max(int(left // map.grid_width), 0)
+        last_col = min(int(right // map.grid_width) + 1, map.ncols)
+        return first_row, last_row, first_col, last_col
+
+    def clamp(self):
+        visible_width = self.view_width / self.zoom
+        visible_height = self.view_height / self.zoom
+        # Center the world when it is smaller than the window in a direction
+        if visible_width >= self.world_width:
+            self.x = (self.world_width - visible_width) / 2
+        else:
+            self.x = min(max(self.x, 0), self.world_width - visible_width)
+        if visible_height >= self.world_height:
+            self.y = (self.world_height - visible_height) / 2
+        else:
+            self.y = min(max(self.y, 0), self.world_height - visible_height)
+
+    def pan(self, screen_dx, screen_dy):
+        self.x += screen_dx / self.zoom
+        self.y += screen_dy / self.zoom
+        self.clamp()
+
+    def zoom_at(self, screen_point, factor):
+        """Zooms while keeping the world point under screen_point in the same place on screen"""
+        world_point = self.screen_to_world(screen_point)
+        self.zoom = min(max(self.zoom * factor, self.min_zoom), self.max_zoom)
+        self.x = world_point.x - screen_point.x / self.zoom
+        self.y = world_point.y - screen_point.y / self.zoom
+        self.clamp()
+
+    def center_on(self, world_point):
+        self.x = world_point.x - self.view_width / self.zoom / 2
+        self.y = world_point.y - self.view_height / self.zoom / 2
+        self.clamp()
+
+    def handle_event(self, event):
+        if event.type == pygame.MOUSEWHEEL:
+            mouse_pos = pygame.mouse.get_pos()
+            self.zoom_at(Point(mouse_pos[0], mouse_pos[1]), self.zoom_step ** event.y)
+
+    def update(self, dt):
+        """Pans with the arrow keys, distance scaled by dt so panning speed doesn't depend on frame rate"""
+        keys_pressed = pygame.key.get_pressed()
+        distance = self.pan_speed * dt
+        screen_dx = 0
+        screen_dy = 0
+        if keys_pressed[pygame.K_LEFT]:
+            screen_dx -= distance
+        if keys_pressed[pygame.K_RIGHT]:
+            screen_dx += distance
+        if keys_pressed[pygame.K_UP]:
+            screen_dy -= distance
+        if keys_pressed[pygame.K_DOWN]:
+            screen_dy += distance
+        if screen_dx != 0 or screen_dy != 0:
+            self.pan(screen_dx, screen_dy)
@@ -0,0 +1,280 @@
+"""Snapshots of a whole battle in a compact binary layout so a battle can be saved at any tick and resumed later.
+Entities hold pygame Surfaces and references to each other, so instead of pickling them only their state is written
+and the objects are rebuilt around it on restore"""
+import os
+import struct
+from collections import deque
+import globals
+from utility import *
+from map import Map
+from entity import Soldier, CapturePoint, Sunderer
+from shot_buffer import PROJECTILE
+from simulation import Simulation
+
+
+CHECKPOINT_MAGIC = b"PSCP"
+CHECKPOINT_VERSION = 3
+# Format: magic, version, tick, dt, next soldier key, next spawn key, next capture point key, has seed, seed
+HEADER = struct.Struct("<4sHqdiii?q")
+# Format: cell size, wall color, map kind (inline cells or a tiled file), nrows, ncols
+MAP_HEADER = struct.Struct("<H3BBII")
+MAP_INLINE = 0
+MAP_TILED_FILE = 1
+# Format: Mersenne Twister state words, has gauss_next, gauss_next
+RNG_STATE = struct.Struct("<625I?d")
+COUNT = struct.Struct("<I")
+POINT = struct.Struct("<dd")
+# Entities are written in the order of globals.entity_list since that order decides who moves and shoots first
+ENTITY_KIND = struct.Struct("<B")
+SOLDIER = 0
+CAPTURE_POINT = 1
+SUNDERER = 2
+# Format: id, grid row, grid col, has coordinates, coordinates x, y, center x, y
+ENTITY_STATE = struct.Struct("<iii?dddd")
+# Format: faction, aim, health, alive, movement and shield state, counters, color, target id and distance.
+# It is followed by the archetype name, the soldier's stats come from the archetype
+SOLDIER_STATE = struct.Struct("<Bdd???????iiiiiiB??i?d")
+CAPTURE_POINT_STATE = struct.Struct("<Bidi?iiii")
+SUNDERER_STATE = struct.Struct("<Bi")
+# Format: fire tick, arrival tick, shooter id, target id, faction, hit, damage, distance, visible, color, origin, end
+PROJECTILE_STATE = struct.Struct("<qqiib?dd?3Bdddd")
+PROJECTILE_FIELDS = ("tick", "arrival_tick", "shooter_id", "target_id", "faction", "hit", "damage", "distance", "visible")
+FACTIONS = ("Neutral", "TR", "NC", "VS")
+# Soldier.color is always one of these, stored by index
+SOLDIER_COLORS = ("original_color", "dead_color", "shield_recharge_delay_active_color")
+
+
+def serialize_simulation(simulation):
+    """Returns the whole battle state of a Simulation as bytes"""
+    if not isinstance(simulation, Simulation): raise TypeError("simulation has to be a Simulation object")
+    parts = []
+    seed = simulation.seed if isinstance(simulation.seed, int) else 0
+    parts.append(HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, simulation.tick, globals.dt, globals.next_soldiers_dict_key,
+                             globals.next_spawn_dict_key, globals.next_capture_point_dict_key, isinstance(simulation.seed, int), seed))
+    parts.append(serialize_map(simulation.map))
+    rng_version, rng_words, gauss_next = simulation.rng.getstate()
+    parts.append(RNG_STATE.pack(*rng_words, gauss_next is not None, gauss_next if gauss_next is not None else 0.0))
+    parts.append(COUNT.pack(len(globals.entity_list)))
+    for entity in globals.entity_list:
+        if isinstance(entity, Soldier):
+            parts.append(ENTITY_KIND.pack(SOLDIER))
+            parts.append(serialize_entity(entity))
+            parts.append(serialize_soldier(entity))
+        elif isinstance(entity, CapturePoint):
+            parts.append(ENTITY_KIND.pack(CAPTURE_POINT))
+            parts.append(serialize_entity(entity))
+            parts.append(CAPTURE_POINT_STATE.pack(FACTIONS.index(entity.current_faction), entity.time_to_be_flipped_counter,
+                                                  entity.capture_radius, entity.time_to_be_flipped, entity.draw_radius,
+                                                  entity.faction_counter["TR"], entity.faction_counter["NC"],
+                                                  entity.faction_counter["VS"], entity.faction_counter["Contested"]))
+        elif isinstance(entity, Sunderer):
+            parts.append(ENTITY_KIND.pack(SUNDERER))
+            parts.append(serialize_entity(entity))
+            parts.append(SUNDERER_STATE.pack(FACTIONS.index(entity.faction), entity.spawn_timer))
+        else:
+            raise TypeError(f"Can't checkpoint entities of type {type(entity).__name__}")
+    # Projectiles still in flight land after the battle is restored
+    in_flight_event_numbers = globals.shot_buffer.get_in_flight_event_numbers()
+    parts.append(COUNT.pack(len(in_flight_event_numbers)))
+    for event_number in in_flight_event_numbers:
+        event = globals.shot_buffer.get_event(event_number)
+        parts.append(PROJECTILE_STATE.pack(*[event[field].item() for field in PROJECTILE_FIELDS], *event["color"].tolist(),
+                                           event["x0"], event["y0"], event["x1"], event["y1"]))
+    return b"".join(parts)
+
+
+def serialize_map(map):
+    if map.is_chunked:
+        # Tiled maps stay in their file, which may be far bigger than the battle state, so only the path is stored
+        map.map_array.storage.flush()
+        path = os.path.abspath(map.map_array.storage.path).encode("utf-8")
+        return MAP_HEADER.pack(map.grid_width, *map.wall_color, MAP_TILED_FILE, map.nrows, map.ncols) + COUNT.pack(len(path)) + path
+    cells = bytearray()
+    for map_row in map.map_array:
+        cells.extend(map_row)
+    return MAP_HEADER.pack(map.grid_width, *map.wall_color, MAP_INLINE, map.nrows, map.ncols) + bytes(cells)
+
+
+def serialize_entity(entity):
+    if entity.coordinates is not None:
+        return ENTITY_STATE.pack(entity.id, entity.grid_position[0], entity.grid_position[1], True, entity.coordinates.x,
+                                 entity.coordinates.y, entity.coordinates_center.x, entity.coordinates_center.y)
+    return ENTITY_STATE.pack(entity.id, entity.grid_position[0], entity.grid_position[1], False, 0.0, 0.0, 0.0, 0.0)
+
+
+def serialize_soldier(soldier):
+    color_index = 0
+    for i, color_attribute in enumerate(SOLDIER_COLORS):
+        if soldier.color == getattr(soldier, color_attribute):
+            color_index = i
+            break
+    archetype_name = soldier.archetype.name.encode("utf-8")
+    parts = [SOLDIER_STATE.pack(FACTIONS.index(soldier.faction), soldier.aim_factor, soldier.health, soldier.alive,
+                                soldier.is_moving, soldier.moving_to_point, soldier.shooting,
+                                soldier.enable_collisions, soldier.shield_recharge_delay_active, soldier.shield_is_recharging,
+                                soldier.fire_rate_counter, soldier.shield_recharge_delay_counter,
+                                soldier.shield_recharge_delay_blinking_effect_counter, soldier.spawn_timer_counter,
+                                soldier.kills, soldier.deaths, color_index,
+                                getattr(soldier, "getting_shot_at", False), soldier.show_rays,
+                                soldier.current_target_enemy.id if soldier.current_target_enemy is not None else -1,
+                                soldier.current_target_enemy_distance is not None,
+                                soldier.current_target_enemy_distance if soldier.current_target_enemy_distance is not None else 0.0),
+             COUNT.pack(len(archetype_name)), archetype_name]
+    parts.append(serialize_point(soldier.destination))
+    parts.append(COUNT.pack(len(soldier.destination_queue)))
+    for destination in soldier.destination_queue:
+        parts.append(POINT.pack(destination.x, destination.y))
+    return b"".join(parts)
+
+
+def serialize_point(point):
+    """Optional points are written as a flag followed by the point"""
+    if point is None:
+        return struct.pack("<?", False)
+    return struct.pack("<?", True) + POINT.pack(point.x, point.y)
+
+
+class CheckpointReader:
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, layout):
+        values = layout.unpack_from(self.data, self.offset)
+        self.offset += layout.size
+        return values
+
+    def read_bytes(self, size):
+        data = bytes(self.data[self.offset:self.offset + size])
+        self.offset += size
+        return data
+
+    def read_point(self):
+        has_point = struct.unpack_from("<?", self.data, self.offset)[0]
+        self.offset += 1
+        if not has_point:
+            return None
+        return Point(*self.unpack(POINT))
+
+
+def deserialize_simulation(data, win):
+    """Rebuilds a Simulation and the shared entity state in globals from serialize_simulation bytes"""
+    reader = CheckpointReader(data)
+    magic, version, tick, dt, next_soldiers_dict_key, next_spawn_dict_key, next_capture_point_dict_key, has_seed, seed = reader.unpack(HEADER)
+    if magic != CHECKPOINT_MAGIC: raise ValueError("data is not a simulation checkpoint")
+    if version != CHECKPOINT_VERSION: raise ValueError(f"Unsupported checkpoint version {version}")
+    map = deserialize_map(reader, win)
+    simulation = Simulation(win=win, map=map, seed=seed if has_seed else None)
+    simulation.tick = tick
+    globals.dt = dt
+    rng_state = reader.unpack(RNG_STATE)
+    simulation.rng.setstate((3, tuple(rng_state[:625]), rng_state[626] if rng_state[625] else None))
+    # Targets can only be linked once every soldier exists
+    target_ids = {}
+    number_of_entities = reader.unpack(COUNT)[0]
+    for i in range(0, number_of_entities):
+        kind = reader.unpack(ENTITY_KIND)[0]
+        id, grid_row, grid_col, has_coordinates, x, y, center_x, center_y = reader.unpack(ENTITY_STATE)
+        if kind == SOLDIER:
+            entity = deserialize_soldier(reader, simulation, id, target_ids)
+            globals.soldiers_dict[id] = entity
+        elif kind == CAPTURE_POINT:
+            faction, time_to_be_flipped_counter, capture_radius, time_to_be_flipped, draw_radius, tr, nc, vs, contested = reader.unpack(CAPTURE_POINT_STATE)
+            entity = CapturePoint(win=win, map=map, id=id, coordinates=Point(x, y), faction=FACTIONS[faction], rng=simulation.rng)
+            entity.time_to_be_flipped_counter = time_to_be_flipped_counter
+            entity.capture_radius = capture_radius
+            entity.time_to_be_flipped = time_to_be_flipped
+            entity.draw_radius = draw_radius
+            entity.faction_counter = {"TR": tr, "NC": nc, "VS": vs, "Contested": contested}
+            globals.capture_point_dict[id] = entity
+        elif kind == SUNDERER:
+            faction, spawn_timer = reader.unpack(SUNDERER_STATE)
+            entity = Sunderer(win=win, map=map, id=id, coordinates=Point(x, y), faction=FACTIONS[faction], rng=simulation.rng)
+            entity.spawn_timer = spawn_timer
+            globals.spawn_point_dict[id] = entity
+        else:
+            raise ValueError(f"Unknown entity kind {kind} in checkpoint")
+        if has_coordinates:
+            entity.coordinates = Point(x, y)
+            entity.coordinates_center = Point(center_x, center_y)
+        else:
+            entity.coordinates = None
+            entity.coordinates_center = None
+        entity.grid_position = (grid_row, grid_col)
+        entity.adjacent_grid_positions = map.get_neighboring_grid_positions(entity.grid_position)
+        globals.entity_list.append(entity)
+    for soldier_id, target_id in target_ids.items():
+        globals.soldiers_dict[soldier_id].current_target_enemy = globals.soldiers_dict[target_id]
+    globals.shot_buffer.begin_tick(tick)
+    for i in range(0, reader.unpack(COUNT)[0]):
+        values = reader.unpack(PROJECTILE_STATE)
+        event = dict(zip(PROJECTILE_FIELDS, values))
+        event.update(kind=PROJECTILE, killed=False, color=values[9:12], x0=values[12], y0=values[13], x1=values[14], y1=values[15])
+        globals.shot_buffer.restore_projectile(event)
+    globals.next_soldiers_dict_key = next_soldiers_dict_key
+    globals.next_spawn_dict_key = next_spawn_dict_key
+    globals.next_capture_point_dict_key = next_capture_point_dict_key
+    return simulation
+
+
+def deserialize_map(reader, win):
+    cell_size, red, green, blue, map_kind, nrows, ncols = reader.unpack(MAP_HEADER)
+    if map_kind == MAP_TILED_FILE:
+        path = reader.read_bytes(reader.unpack(COUNT)[0]).decode("utf-8")
+        return Map.from_tiled_file(win=win, path=path, wall_color=(red, green, blue), cell_size=cell_size)
+    cells = reader.read_bytes(nrows * ncols)
+    map_array = [list(cells[row * ncols:(row + 1) * ncols]) for row in range(0, nrows)]
+    return Map(win=win, map_array=map_array, wall_color=(red, green, blue), cell_size=cell_size)
+
+
+def deserialize_soldier(reader, simulation, id, target_ids):
+    (faction, aim_factor, health, alive, is_moving, moving_to_point, shooting, enable_collisions, shield_recharge_delay_active,
+     shield_is_recharging, fire_rate_counter, shield_recharge_delay_counter, shield_recharge_delay_blinking_effect_counter,
+     spawn_timer_counter, kills, deaths, color_index, getting_shot_at, show_rays, target_id, has_target_distance,
+     target_distance) = reader.unpack(SOLDIER_STATE)
+    weapon_type = reader.read_bytes(reader.unpack(COUNT)[0]).decode("utf-8")
+    soldier = Soldier(win=simulation.win, map=simulation.map, id=id, shape="square", width=5, coordinates=None,
+                      faction=FACTIONS[faction], weapon_type=weapon_type, aim_factor=aim_factor, rng=simulation.rng)
+    # Whole numbers are restored as ints so arithmetic on them continues exactly as before the checkpoint
+    soldier.health = int(health) if health.is_integer() else health
+    soldier.alive = alive
+    soldier.is_moving = is_moving
+    soldier.moving_to_point = moving_to_point
+    soldier.shooting = shooting
+    soldier.enable_collisions = enable_collisions
+    soldier.shield_recharge_delay_active = shield_recharge_delay_active
+    soldier.shield_is_recharging = shield_is_recharging
+    soldier.fire_rate_counter = fire_rate_counter
+    soldier.shield_recharge_delay_counter = shield_recharge_delay_counter
+    soldier.shield_recharge_delay_blinking_effect_counter = shield_recharge_delay_blinking_effect_counter
+    soldier.spawn_timer_counter = spawn_timer_counter
+    soldier.kills = kills
+    soldier.deaths = deaths
+    soldier.color = getattr(soldier, SOLDIER_COLORS[color_index])
+    soldier.getting_shot_at = getting_shot_at
+    soldier.show_rays = show_rays
+    soldier.current_target_enemy_distance = target_distance if has_target_distance else None
+    if target_id != -1:
+        target_ids[id] = target_id
+    soldier.destination = reader.read_point()
+    number_of_destinations = reader.unpack(COUNT)[0]
+    soldier.destination_queue = deque(Point(*reader.unpack(POINT)) for i in range(0, number_of_destinations))
+    return soldier
+
+
+def save_checkpoint(simulation, path):
+    """Writes the checkpoint to a temporary file first so a crash can't leave half a checkpoint behind"""
+    data = serialize_simulation(simulation)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(data)
+    os.replace(temporary_path, path)
+
+
+def load_checkpoint(path, win):
+    with open(path, "rb") as f:
+        return deserialize_simulation(f.read(), win)
@@ -0,0 +1,237 @@
+"""Chunked map storage for maps too big to keep in memory as nested lists.
+The map lives in a tiled file of fixed-size square chunks that are loaded on demand and kept in an LRU cache.
+Chunks with living soldiers or capture points in them can be pinned so they are never evicted"""
+import os
+import struct
+from collections import OrderedDict
+import globals
+
+
+TILED_MAP_MAGIC = b"PSTM"
+TILED_MAP_VERSION = 1
+# Format: magic, version, nrows, ncols, chunk_size
+TILED_MAP_HEADER = struct.Struct("<4sHIIH")
+
+
+def write_tiled_map(path, map_array, chunk_size=None):
+    """Writes any 2D indexable map (nested lists, NumPy array, ChunkedMapArray) as a tiled file.
+    Edge chunks are padded with walls so every chunk has the same size and offset arithmetic stays trivial"""
+    if chunk_size is None:
+        chunk_size = globals.MAP_CHUNK_SIZE
+    nrows = len(map_array)
+    ncols = len(map_array[0])
+    nchunk_rows = -(-nrows // chunk_size)
+    nchunk_cols = -(-ncols // chunk_size)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(TILED_MAP_HEADER.pack(TILED_MAP_MAGIC, TILED_MAP_VERSION, nrows, ncols, chunk_size))
+        for chunk_row in range(0, nchunk_rows):
+            for chunk_col in range(0, nchunk_cols):
+                chunk = bytearray(b"\x01" * (chunk_size * chunk_size))
+                for row_in_chunk in range(0, chunk_size):
+                    row = chunk_row * chunk_size + row_in_chunk
+                    if row >= nrows:
+                        break
+                    first_col = chunk_col * chunk_size
+                    last_col = min(first_col + chunk_size, ncols)
+                    map_row = map_array[row]
+                    values = [map_row[col] for col in range(first_col, last_col)]
+                    for value in values:
+                        if value not in (0, 1):
+                            raise ValueError("Each value in the map array must be in (0, 1)")
+                    chunk[row_in_chunk * chunk_size:row_in_chunk * chunk_size + len(values)] = bytes(values)
+                f.write(chunk)
+    os.replace(temporary_path, path)
+
+
+def read_tiled_map_header(path):
+    with open(path, "rb") as f:
+        magic, version, nrows, ncols, chunk_size = TILED_MAP_HEADER.unpack(f.read(TILED_MAP_HEADER.size))
+    if magic != TILED_MAP_MAGIC: raise ValueError(f"{path} is not a tiled map file")
+    if version != TILED_MAP_VERSION: raise ValueError(f"{path} has unsupported tiled map version {version}")
+    return nrows, ncols, chunk_size
+
+
+class ChunkedMapStorage:
+
+    def __init__(self, path, max_resident_chunks=None):
+        if max_resident_chunks is None:
+            max_resident_chunks = globals.MAP_MAX_RESIDENT_CHUNKS
+        if not isinstance(max_resident_chunks, int) or max_resident_chunks <= 0: raise ValueError("max_resident_chunks has to be a positive int")
+        self.path = path
+        self.nrows, self.ncols, self.chunk_size = read_tiled_map_header(path)
+        self.nchunk_rows = -(-self.nrows // self.chunk_size)
+        self.nchunk_cols = -(-self.ncols // self.chunk_size)
+        self.chunk_byte_size = self.chunk_size * self.chunk_size
+        self.max_resident_chunks = max_resident_chunks
+        # Format: {(chunk_row, chunk_col): bytearray}, least recently used first
+        self.resident_chunks = OrderedDict()
+        self.pinned_chunks = set()
+        self.dirty_chunks = set()
+        self.file = open(path, "r+b")
+        self.chunks_loaded = 0
+        self.chunks_evicted = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def get_chunk_key(self, row, col):
+        return row // self.chunk_size, col // self.chunk_size
+
+    def get_chunk(self, chunk_key):
+        chunk = self.resident_chunks.get(chunk_key)
+        if chunk is not None:
+            self.resident_chunks.move_to_end(chunk_key)
+            return chunk
+        chunk = bytearray(self.read_chunk_from_file(chunk_key))
+        self.chunks_loaded += 1
+        self.resident_chunks[chunk_key] = chunk
+        # The caller is about to use the chunk, so it stays resident even if only pinned chunks are left to evict
+        self.evict_chunks(keep_chunk_key=chunk_key)
+        return chunk
+
+    def read_chunk_from_file(self, chunk_key):
+        chunk_index = chunk_key[0] * self.nchunk_cols + chunk_key[1]
+        self.file.seek(TILED_MAP_HEADER.size + chunk_index * self.chunk_byte_size)
+        return self.file.read(self.chunk_byte_size)
+
+    def read_chunk_bytes(self, chunk_key):
+        """Returns a copy of the chunk's bytes without loading it into the LRU, so scanning the whole map doesn't evict
+        the chunks in use"""
+        chunk = self.resident_chunks.get(chunk_key)
+        if chunk is not None:
+            return bytes(chunk)
+        return self.read_chunk_from_file(chunk_key)
+
+    def evict_chunks(self, keep_chunk_key=None):
+        """Drops least recently used chunks over the limit, pinned chunks and keep_chunk_key are skipped so they can't be evicted"""
+        if len(self.resident_chunks) <= self.max_resident_chunks:
+            return
+        for chunk_key in list(self.resident_chunks.keys()):
+            if len(self.resident_chunks) <= self.max_resident_chunks:
+                break
+            if chunk_key in self.pinned_chunks or chunk_key == keep_chunk_key:
+                continue
+            chunk = self.resident_chunks.pop(chunk_key)
+            if chunk_key in self.dirty_chunks:
+                self.write_chunk(chunk_key, chunk)
+            self.chunks_evicted += 1
+
+    def write_chunk(self, chunk_key, chunk):
+        chunk_index = chunk_key[0] * self.nchunk_cols + chunk_key[1]
+        self.file.seek(TILED_MAP_HEADER.size + chunk_index * self.chunk_byte_size)
+        self.file.write(chunk)
+        self.dirty_chunks.discard(chunk_key)
+
+    def flush(self):
+        for chunk_key in list(self.dirty_chunks):
+            self.write_chunk(chunk_key, self.resident_chunks[chunk_key])
+        self.file.flush()
+
+    def get_cell(self, row, col):
+        chunk = self.get_chunk((row // self.chunk_size, col // self.chunk_size))
+        return chunk[(row % self.chunk_size) * self.chunk_size + col % self.chunk_size]
+
+    def set_cell(self, row, col, value):
+        if value not in (0, 1): raise ValueError("Each value in the map array must be in (0, 1)")
+        chunk_key = (row // self.chunk_size, col // self.chunk_size)
+        chunk = self.get_chunk(chunk_key)
+        chunk[(row % self.chunk_size) * self.chunk_size + col % self.chunk_size] = value
+        self.dirty_chunks.add(chunk_key)
+
+    def set_pinned_grid_positions(self, grid_positions):
+        """Replaces the pinned chunks with the ones containing the given (row, col) grid positions"""
+        self.pinned_chunks = set()
+        for grid_position in grid_positions:
+            self.pinned_chunks.add((grid_position[0] // self.chunk_size, grid_position[1] // self.chunk_size))
+        # More chunks than the limit can be pinned, so the cache may only shrink back once they are unpinned
+        self.evict_chunks()
+
+    def save_as(self, path):
+        if os.path.abspath(path) == os.path.abspath(self.path):
+            self.flush()
+        else:
+            write_tiled_map(path, ChunkedMapArray(self), self.chunk_size)
+
+
+class ChunkedMapArray:
+    """Reads and writes through a ChunkedMapStorage with the same map_array[row][col] indexing as nested lists,
+    so code that walks the map (pathfinding, ray casting, collisions, drawing) doesn't need to know about chunks"""
+
+    def __init__(self, storage):
+        if not isinstance(storage, ChunkedMapStorage): raise TypeError("storage has to be a ChunkedMapStorage object")
+        self.storage = storage
+        self.rows = [ChunkedMapRow(storage, row) for row in range(0, storage.nrows)]
+
+    def __len__(self):
+        return self.storage.nrows
+
+    def __getitem__(self, row):
+        return self.rows[row]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class ChunkedMapRow:
+
+    def __init__(self, storage, row):
+        self.storage = storage
+        self.row = row
+        self.chunk_row = row // storage.chunk_size
+        self.offset_in_chunk = (row % storage.chunk_size) * storage.chunk_size
+
+    def __len__(self):
+        return self.storage.ncols
+
+    def __getitem__(self, col):
+        if isinstance(col, slice):
+            return [self[i] for i in range(*col.indices(self.storage.ncols))]
+        if col < 0:
+            col += self.storage.ncols
+        if not 0 <= col < self.storage.ncols:
+            raise IndexError("map column index out of range")
+        chunk_size = self.storage.chunk_size
+        chunk = self.storage.get_chunk((self.chunk_row, col // chunk_size))
+        return chunk[self.offset_in_chunk + col % chunk_size]
+
+    def __setitem__(self, col, value):
+        self.storage.set_cell(self.row, col, value)
+
+    def __iter__(self):
+        for col in range(0, self.storage.ncols):
+            yield self[col]
+
+
+class GridCoordinates:
+    """Computes the top left world coordinates of grid squares on access instead of storing one tuple per square"""
+
+    def __init__(self, nrows, grid_width):
+        self.rows = [GridCoordinatesRow(row * grid_width, grid_width) for row in range(0, nrows)]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, row):
+        return self.rows[row]
+
+
+class GridCoordinatesRow:
+
+    def __init__(self, y, grid_width):
+        self.y = y
+        self.grid_width = grid_width
+
+    def __getitem__(self, col):
+        return col * self.grid_width, self.y
+
+
+if __name__ == "__main__":
+    import sys
+    import _pickle
+    # Converts a pickled map from the Maps directory into a tiled map next to it
+    map_name = sys.argv[1]
+    with open(f"{globals.MAPS_DIRECTORY}{map_name}.txt", "rb") as f:
+        map_array = _pickle.load(f)
+    write_tiled_map(f"{globals.MAPS_DIRECTORY}{map_name}.{globals.TILED_MAP_EXTENSION}", map_array)
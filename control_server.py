@@ -0,0 +1,263 @@
+"""Local control API for steering a running battle without the GUI. An asyncio server takes one JSON command per line over
+a TCP or Unix socket and answers every command with one JSON line. Commands are queued and applied between two ticks, at
+most a budget of them between any two ticks, so a flood of commands can't stall the battle.
+
+    {"type": "add_soldiers", "faction", "number"}                   -> {"type": "ok", "soldiers": [ids]}
+    {"type": "place_spawn_point", "faction", "position": [x, y] or "square": [row, col], "spawn_timer" (optional)}
+                                                                    -> {"type": "ok", "spawn_point": id}
+    {"type": "remove_spawn_point", "spawn_point": id}               -> {"type": "ok"}
+    {"type": "place_capture_point", "faction" (default Neutral), "position" or "square"} -> {"type": "ok", "capture_point": id}
+    {"type": "remove_capture_point", "capture_point": id}           -> {"type": "ok"}
+    {"type": "pause"} or {"type": "resume"}                         -> {"type": "ok", "tick"}
+    {"type": "step", "ticks" (default 1)}                           -> {"type": "ok", "tick"} once the ticks have run
+    {"type": "snapshot", "entities" (default false)}                -> {"type": "snapshot", "tick", "paused", "kills", "deaths",
+                                                                        "alive", "capture_points", and "soldiers",
+                                                                        "spawn_points" and "capture_point_entities" with entities}
+An "id" sent with a command is sent back with its reply, and invalid commands are answered with {"type": "error", "message"}.
+Commands from one connection are applied in order and each is answered before the next is read, so clients steering
+several things at once open several connections. distributed.Connection works as a blocking client.
+
+Battle state lives in globals, so every process runs one battle. Many battles are steered by starting a server for each,
+with port 0 each one picks a free port and prints the address it listens on"""
+import os
+import sys
+import json
+import socket
+import asyncio
+import globals
+from simulation import Simulation
+from scenario import Scenario
+from branching import summarize_simulation
+from distributed import parse_address
+
+
+class ControlServer:
+
+    def __init__(self, simulation, dt=None, address=None, command_budget=None, queue_size=None, ticks_per_second=None, paused=False):
+        """ticks_per_second None runs the battle as fast as it goes"""
+        if not isinstance(simulation, Simulation): raise TypeError("simulation has to be a Simulation object")
+        if dt is None:
+            dt = 1000 / globals.FPS
+        if address is None:
+            address = f"127.0.0.1:{globals.CONTROL_PORT}"
+        if command_budget is None:
+            command_budget = globals.CONTROL_COMMAND_BUDGET
+        if queue_size is None:
+            queue_size = globals.CONTROL_QUEUE_SIZE
+        if not isinstance(command_budget, int) or command_budget < 1: raise ValueError("command_budget has to be a positive int")
+        if not isinstance(queue_size, int) or queue_size < 1: raise ValueError("queue_size has to be a positive int")
+        if ticks_per_second is not None and ticks_per_second <= 0: raise ValueError("ticks_per_second has to be positive or None")
+        self.simulation = simulation
+        self.dt = dt
+        self.address = address
+        self.command_budget = command_budget
+        self.queue_size = queue_size
+        self.ticks_per_second = ticks_per_second
+        self.paused = paused
+        # Paused battles still run ticks until this one for step commands
+        self.step_until = simulation.tick
+        # Format: [(tick, future resolved once the battle reaches the tick)]
+        self.step_waiters = []
+        # Made in serve, asyncio objects belong to the event loop that's running
+        self.commands = None
+        self.handlers = {"add_soldiers": self.add_soldiers, "place_spawn_point": self.place_spawn_point,
+                         "remove_spawn_point": self.remove_spawn_point, "place_capture_point": self.place_capture_point,
+                         "remove_capture_point": self.remove_capture_point, "pause": self.pause, "resume": self.resume,
+                         "step": self.step, "snapshot": self.snapshot}
+
+    # Commands
+    def add_soldiers(self, command):
+        """Soldiers appear once a spawn point of their faction is ready, like soldiers added in the GUI"""
+        faction, number = command["faction"], command["number"]
+        if faction not in globals.FACTION_LIST: raise ValueError(f"faction has to be one of {globals.FACTION_LIST}")
+        if not isinstance(number, int) or number < 1: raise ValueError("number has to be a positive int")
+        first_id = globals.next_soldiers_dict_key
+        self.simulation.add_soldiers(faction=faction, number_of_soldiers=number)
+        return {"type": "ok", "soldiers": list(range(first_id, globals.next_soldiers_dict_key))}
+
+    def get_placement_coordinates(self, command):
+        if "position" not in command and "square" not in command: raise ValueError("a position or a square has to be given")
+        return Scenario.get_placement_coordinates(self.simulation.map, command)
+
+    def place_spawn_point(self, command):
+        if command["faction"] not in globals.FACTION_LIST: raise ValueError(f"faction has to be one of {globals.FACTION_LIST}")
+        spawn_type = command.get("spawn_type", "Sunderer")
+        if spawn_type not in globals.SPAWN_TYPES: raise ValueError(f"spawn_type has to be one of {globals.SPAWN_TYPES}")
+        spawn_timer = command.get("spawn_timer")
+        if spawn_timer is not None and (not isinstance(spawn_timer, int) or spawn_timer < 0): raise ValueError("spawn_timer has to be a non-negative int")
+        spawn_point = self.simulation.create_spawn_point(coordinates=self.get_placement_coordinates(command), faction=command["faction"],
+                                                         spawn_type=spawn_type)
+        if spawn_timer is not None:
+            spawn_point.spawn_timer = spawn_timer
+        return {"type": "ok", "spawn_point": spawn_point.id}
+
+    def remove_spawn_point(self, command):
+        if command["spawn_point"] not in globals.spawn_point_dict: raise ValueError(f"There is no spawn point {command['spawn_point']}")
+        self.simulation.remove_spawn_point(command["spawn_point"])
+        return {"type": "ok"}
+
+    def place_capture_point(self, command):
+        faction = command.get("faction", "Neutral")
+        if faction not in globals.FACTION_LIST and faction != "Neutral": raise ValueError(f"faction has to be Neutral or one of {globals.FACTION_LIST}")
+        capture_point = self.simulation.create_capture_point(coordinates=self.get_placement_coordinates(command), faction=faction)
+        return {"type": "ok", "capture_point": capture_point.id}
+
+    def remove_capture_point(self, command):
+        if command["capture_point"] not in globals.capture_point_dict: raise ValueError(f"There is no capture point {command['capture_point']}")
+        self.simulation.remove_capture_point(command["capture_point"])
+        return {"type": "ok"}
+
+    def pause(self, command):
+        self.paused = True
+        return {"type": "ok", "tick": self.simulation.tick}
+
+    def resume(self, command):
+        self.paused = False
+        return {"type": "ok", "tick": self.simulation.tick}
+
+    def step(self, command):
+        """Runs ticks whether the battle is paused or not, the reply is a future resolved once they have run"""
+        ticks = command.get("ticks", 1)
+        if not isinstance(ticks, int) or ticks < 1: raise ValueError("ticks has to be a positive int")
+        # Steps asked for while earlier ones are still running come after them
+        self.step_until = max(self.step_until, self.simulation.tick) + ticks
+        waiter = asyncio.get_running_loop().create_future()
+        self.step_waiters.append((self.step_until, waiter))
+        return waiter
+
+    def snapshot(self, command):
+        snapshot = dict(summarize_simulation(self.simulation), type="snapshot", paused=self.paused)
+        if command.get("entities", False):
+            snapshot["soldiers"] = [get_entity_state(soldier, faction=soldier.faction, alive=soldier.alive, health=soldier.health,
+                                                     kills=soldier.kills, deaths=soldier.deaths)
+                                    for soldier in globals.soldiers_dict.values()]
+            snapshot["spawn_points"] = [get_entity_state(spawn_point, faction=spawn_point.faction, spawn_timer=spawn_point.spawn_timer)
+                                        for spawn_point in globals.spawn_point_dict.values()]
+            snapshot["capture_point_entities"] = [get_entity_state(capture_point, faction=capture_point.current_faction)
+                                                  for capture_point in globals.capture_point_dict.values()]
+        return snapshot
+
+    def apply(self, command):
+        """Returns the reply to the command, or a future of the reply for commands that finish on a later tick"""
+        handler = self.handlers.get(command.get("type"))
+        if handler is None: raise ValueError(f"Unknown command type {command.get('type')}, it has to be one of {list(self.handlers)}")
+        return handler(command)
+
+    def apply_queued_command(self, command, reply):
+        try:
+            result = self.apply(command)
+        except (TypeError, ValueError, KeyError) as error:
+            result = {"type": "error", "message": str(error) if not isinstance(error, KeyError) else f"{error} has to be given"}
+        reply.set_result(result)
+
+    # Battle and connections
+    def is_waiting(self):
+        return self.paused and self.simulation.tick >= self.step_until
+
+    async def run_battle(self):
+        loop = asyncio.get_running_loop()
+        next_tick_time = loop.time()
+        while True:
+            applied = 0
+            if self.is_waiting():
+                # A paused battle sleeps until a command arrives
+                self.apply_queued_command(*await self.commands.get())
+                applied += 1
+                next_tick_time = loop.time()
+            while applied < self.command_budget and not self.commands.empty():
+                self.apply_queued_command(*self.commands.get_nowait())
+                applied += 1
+            if self.is_waiting():
+                continue
+            self.simulation.step(self.dt)
+            while self.step_waiters and self.step_waiters[0][0] <= self.simulation.tick:
+                waiter = self.step_waiters.pop(0)[1]
+                if not waiter.done():
+                    waiter.set_result({"type": "ok", "tick": self.simulation.tick})
+            if self.ticks_per_second is None:
+                # Lets connections read and queue commands between ticks
+                await asyncio.sleep(0)
+            else:
+                # A battle that fell behind carries on from now instead of running the missed ticks back to back
+                next_tick_time = max(next_tick_time + 1 / self.ticks_per_second, loop.time() - 1 / self.ticks_per_second)
+                await asyncio.sleep(max(next_tick_time - loop.time(), 0))
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    command = json.loads(line)
+                    if not isinstance(command, dict): raise ValueError("a command has to be a JSON object")
+                except ValueError as error:
+                    command = {}
+                    reply = {"type": "error", "message": str(error)}
+                else:
+                    reply_future = asyncio.get_running_loop().create_future()
+                    await self.commands.put((command, reply_future))
+                    reply = await reply_future
+                    if isinstance(reply, asyncio.Future):
+                        reply = await reply
+                if "id" in command:
+                    reply = dict(reply, id=command["id"])
+                writer.write((json.dumps(reply) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start_server(self):
+        self.commands = asyncio.Queue(maxsize=self.queue_size)
+        family, socket_address = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(socket_address):
+                os.remove(socket_address)
+            return await asyncio.start_unix_server(self.handle_connection, path=socket_address)
+        return await asyncio.start_server(self.handle_connection, host=socket_address[0], port=socket_address[1])
+
+    async def serve(self, on_listening=None):
+        """Runs the battle and answers commands until cancelled. on_listening is called with the address the server
+        listens on, which has the port picked for port 0"""
+        server = await self.start_server()
+        family, socket_address = parse_address(self.address)
+        if family != socket.AF_UNIX:
+            self.address = f"{socket_address[0]}:{server.sockets[0].getsockname()[1]}"
+        if on_listening is not None:
+            on_listening(self.address)
+        async with server:
+            await self.run_battle()
+
+
+def get_entity_state(entity, **state):
+    if entity.coordinates_center is None:
+        return dict(id=entity.id, position=None, **state)
+    return dict(id=entity.id, position=[entity.coordinates_center.x, entity.coordinates_center.y], **state)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a scenario's battle and steer it with JSON commands over a local socket")
+    parser.add_argument("scenario", help="scenario file (.json or .toml)")
+    parser.add_argument("--address", default=f"127.0.0.1:{globals.CONTROL_PORT}", help="host:port or unix:path to listen on, port 0 picks a free port")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the battle (default: the scenario's seed)")
+    parser.add_argument("--paused", action="store_true", help="start paused and only run ticks for step commands")
+    parser.add_argument("--ticks-per-second", type=float, default=None, help="run at this rate (default: as fast as possible)")
+    parser.add_argument("--command-budget", type=int, default=None, help="most commands applied between two ticks")
+    args = parser.parse_args()
+    try:
+        scenario = Scenario.from_file(args.scenario)
+        if args.seed is not None:
+            scenario.seed = args.seed
+        simulation = scenario.build_simulation()
+    except (TypeError, ValueError, KeyError, OSError) as error:
+        print(f"Invalid scenario {args.scenario}: {error}", file=sys.stderr)
+        sys.exit(1)
+    control_server = ControlServer(simulation, dt=scenario.dt, address=args.address, command_budget=args.command_budget,
+                                   ticks_per_second=args.ticks_per_second, paused=args.paused)
+    try:
+        asyncio.run(control_server.serve(on_listening=lambda address: print(json.dumps({"address": address}), flush=True)))
+    except KeyboardInterrupt:
+        pass
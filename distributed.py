@@ -0,0 +1,397 @@
+"""Sweeps spread over worker processes on any number of machines. A coordinator splits every combination of scenario and
+seed into chunks and leases them to the workers that connect to it. Workers keep their lease alive with heartbeats and
+upload each outcome as soon as its battle is finished, and a chunk whose worker stops sending heartbeats is leased again.
+
+The protocol is one JSON message per line over a TCP or Unix socket, every message from a worker gets one reply:
+    {"type": "lease", "worker": name}                  -> {"type": "chunk", "lease_id", "simulator_version", "configurations": [[scenario, seed], ...]}
+                                                          or {"type": "wait", "retry_after": seconds} or {"type": "done"}
+    {"type": "heartbeat", "lease_id"}                  -> {"type": "ok"} or {"type": "lost"} if the chunk was leased again
+    {"type": "result", "lease_id", "simulator_version", "scenario", "seed", "outcome"} -> {"type": "ok"} or {"type": "error"}
+    {"type": "complete", "lease_id"}                   -> {"type": "ok"}
+    {"type": "refuse", "lease_id", "reason"}           -> {"type": "ok"}
+Scenario definitions are sent with every chunk so workers don't need the scenario files, only map files they refer to.
+Every chunk carries the coordinator's simulator version and the hash of every map file, and a worker whose simulator or
+maps differ refuses the chunk and stops instead of running battles that would play out differently. Results of another
+simulator version are rejected"""
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import socketserver
+from collections import deque
+import globals
+from scenario import Scenario
+from result_cache import ResultCache, get_simulator_version, get_map_hash
+from run_scenario import run_battle, get_outcome
+from sweep import load_scenario
+
+
+def parse_address(address):
+    """"host:port" for TCP or "unix:path" for a Unix socket"""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, port = address.rsplit(":", 1)
+    return socket.AF_INET, (host, int(port))
+
+
+class Connection:
+    """A worker's socket to the coordinator, heartbeats and uploads come from different threads so requests are locked"""
+
+    def __init__(self, address, timeout=None):
+        family, socket_address = parse_address(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(socket_address)
+        self.file = self.socket.makefile("rw", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def request(self, message):
+        with self.lock:
+            self.file.write(json.dumps(message) + "\n")
+            self.file.flush()
+            reply = self.file.readline()
+        if not reply:
+            raise ConnectionError("The coordinator closed the connection")
+        return json.loads(reply)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+class Chunk:
+
+    def __init__(self, id, configurations):
+        self.id = id
+        # Format: [(scenario path, seed)]
+        self.configurations = configurations
+        self.lease_id = None
+        self.worker = None
+        self.lease_expires_at = None
+
+
+class Coordinator:
+
+    def __init__(self, scenario_paths, seeds, address=None, ticks=None, chunk_size=None, lease_timeout=None, cache=None, on_result=None):
+        """Configurations that already have a result in the cache are not leased. on_result is called with
+        (scenario path, seed, outcome) for every result, cached ones included"""
+        if address is None:
+            address = f"0.0.0.0:{globals.DISTRIBUTED_PORT}"
+        if chunk_size is None:
+            chunk_size = globals.DISTRIBUTED_CHUNK_SIZE
+        if lease_timeout is None:
+            lease_timeout = globals.DISTRIBUTED_LEASE_TIMEOUT
+        if not isinstance(chunk_size, int) or chunk_size <= 0: raise ValueError("chunk_size has to be a positive int")
+        if lease_timeout <= 0: raise ValueError("lease_timeout has to be positive")
+        self.address = address
+        self.ticks = ticks
+        self.lease_timeout = lease_timeout
+        # Seconds a worker waits before asking again when every chunk is leased
+        self.retry_after = min(lease_timeout / 4, 1)
+        self.cache = cache
+        self.on_result = on_result
+        self.simulator_version = get_simulator_version()
+        # Format: {scenario path: definition}, the scenario files are only read here
+        self.scenarios = {}
+        self.directories = {}
+        self.map_hashes = {}
+        for scenario_path in scenario_paths:
+            scenario = Scenario.from_file(scenario_path)
+            self.scenarios[scenario_path] = scenario.definition
+            self.directories[scenario_path] = scenario.directory
+            self.map_hashes[scenario_path] = get_map_hash(scenario)
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        # Format: {(scenario path, seed): outcome}
+        self.results = {}
+        self.number_of_configurations = 0
+        remaining_configurations = []
+        for scenario_path in scenario_paths:
+            for seed in seeds:
+                self.number_of_configurations += 1
+                outcome = self.get_cached_outcome(scenario_path, seed)
+                if outcome is not None:
+                    self.add_result(scenario_path, seed, outcome, cached=True)
+                else:
+                    remaining_configurations.append((scenario_path, seed))
+        self.pending_chunks = deque(Chunk(id, remaining_configurations[i:i + chunk_size])
+                                    for id, i in enumerate(range(0, len(remaining_configurations), chunk_size)))
+        # Format: {lease id: Chunk}
+        self.leases = {}
+        self.next_lease_id = 0
+        self.leases_lost = 0
+        self.chunks_refused = 0
+        self.results_rejected = 0
+        if len(self.results) == self.number_of_configurations:
+            self.done.set()
+
+    def get_cached_outcome(self, scenario_path, seed):
+        if self.cache is None:
+            return None
+        return self.cache.get(self.cache.get_key(load_scenario(scenario_path, seed), self.ticks))
+
+    def add_result(self, scenario_path, seed, outcome, cached=False):
+        """A chunk leased again can have its outcomes uploaded twice, only the first is kept"""
+        if (scenario_path, seed) in self.results:
+            return
+        self.results[(scenario_path, seed)] = outcome
+        if self.cache is not None and not cached:
+            self.cache.put(self.cache.get_key(load_scenario(scenario_path, seed), self.ticks), outcome)
+        if self.on_result is not None:
+            self.on_result(scenario_path, seed, outcome)
+        if len(self.results) == self.number_of_configurations:
+            self.done.set()
+
+    def reclaim_expired_leases(self):
+        now = time.monotonic()
+        for lease_id, chunk in list(self.leases.items()):
+            if chunk.lease_expires_at < now:
+                del self.leases[lease_id]
+                self.leases_lost += 1
+                self.requeue_unfinished(chunk)
+
+    def requeue_unfinished(self, chunk):
+        configurations = [configuration for configuration in chunk.configurations if configuration not in self.results]
+        if configurations:
+            chunk.configurations = configurations
+            chunk.lease_id = None
+            chunk.worker = None
+            self.pending_chunks.appendleft(chunk)
+
+    def handle(self, message):
+        """Returns the reply to a worker's message"""
+        with self.lock:
+            self.reclaim_expired_leases()
+            message_type = message.get("type")
+            if message_type == "lease":
+                if self.done.is_set():
+                    return {"type": "done"}
+                if not self.pending_chunks:
+                    # Every chunk is leased, but one can still be lost and leased again
+                    return {"type": "wait", "retry_after": self.retry_after}
+                chunk = self.pending_chunks.popleft()
+                chunk.lease_id = self.next_lease_id
+                chunk.worker = message.get("worker")
+                chunk.lease_expires_at = time.monotonic() + self.lease_timeout
+                self.leases[chunk.lease_id] = chunk
+                self.next_lease_id += 1
+                scenario_paths = {scenario_path for scenario_path, seed in chunk.configurations}
+                return {"type": "chunk", "lease_id": chunk.lease_id, "ticks": self.ticks, "lease_timeout": self.lease_timeout,
+                        "simulator_version": self.simulator_version, "configurations": chunk.configurations,
+                        "scenarios": {scenario_path: {"definition": self.scenarios[scenario_path], "directory": self.directories[scenario_path],
+                                                      "map_hash": self.map_hashes[scenario_path]}
+                                      for scenario_path in scenario_paths}}
+            chunk = self.leases.get(message.get("lease_id"))
+            if message_type == "heartbeat":
+                if chunk is None:
+                    return {"type": "lost"}
+                chunk.lease_expires_at = time.monotonic() + self.lease_timeout
+                return {"type": "ok"}
+            if message_type == "result":
+                if message.get("simulator_version") != self.simulator_version:
+                    self.results_rejected += 1
+                    return {"type": "error", "error": "The result was run with another simulator version"}
+                # Outcomes of a lost lease are still kept if the chunk's new worker hasn't uploaded them yet
+                self.add_result(message["scenario"], message["seed"], message["outcome"])
+                if chunk is not None:
+                    chunk.lease_expires_at = time.monotonic() + self.lease_timeout
+                return {"type": "ok"}
+            if message_type == "complete":
+                if chunk is not None:
+                    del self.leases[chunk.lease_id]
+                    self.requeue_unfinished(chunk)
+                return {"type": "ok"}
+            if message_type == "refuse":
+                # The chunk goes back to the queue for a worker whose simulator and maps match
+                if chunk is not None:
+                    del self.leases[chunk.lease_id]
+                    self.chunks_refused += 1
+                    self.requeue_unfinished(chunk)
+                print(f"Worker {message.get('worker')} refused a chunk: {message.get('reason')}", file=sys.stderr)
+                return {"type": "ok"}
+            return {"type": "error", "error": f"Unknown message type {message_type}"}
+
+    def get_progress(self):
+        with self.lock:
+            return {"results": len(self.results), "configurations": self.number_of_configurations,
+                    "leased_chunks": len(self.leases), "pending_chunks": len(self.pending_chunks), "leases_lost": self.leases_lost,
+                    "chunks_refused": self.chunks_refused, "results_rejected": self.results_rejected}
+
+    def make_server(self):
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                for line in self.rfile:
+                    reply = coordinator.handle(json.loads(line))
+                    self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+        family, socket_address = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(socket_address):
+                os.remove(socket_address)
+            server_class = socketserver.ThreadingUnixStreamServer
+        else:
+            server_class = socketserver.ThreadingTCPServer
+        server_class.allow_reuse_address = True
+        server_class.daemon_threads = True
+        return server_class(socket_address, Handler)
+
+    def serve(self, server=None, timeout=None):
+        """Leases chunks until every configuration has an outcome and returns {(scenario path, seed): outcome}.
+        Workers waiting for more work are given a moment to be told they are done before the server stops"""
+        if server is None:
+            server = self.make_server()
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        try:
+            if not self.done.wait(timeout):
+                raise TimeoutError(f"Only {len(self.results)} of {self.number_of_configurations} outcomes arrived in time")
+            time.sleep(self.retry_after)
+        finally:
+            server.shutdown()
+            server.server_close()
+            if server.address_family == socket.AF_UNIX:
+                os.remove(server.server_address)
+        return self.results
+
+
+def run_worker(address, name=None, connect_attempts=10):
+    """Leases chunks from the coordinator and runs them until it says the sweep is done. Returns the number of battles run"""
+    if name is None:
+        name = f"{socket.gethostname()}-{os.getpid()}"
+    for attempt in range(0, connect_attempts):
+        try:
+            connection = Connection(address)
+            break
+        except (ConnectionError, FileNotFoundError):
+            # The coordinator may not be listening yet
+            if attempt == connect_attempts - 1:
+                raise
+            time.sleep(0.5)
+    battles_run = 0
+    try:
+        while True:
+            try:
+                reply = connection.request({"type": "lease", "worker": name})
+            except ConnectionError:
+                # The coordinator stops once every outcome is in
+                return battles_run
+            if reply["type"] == "done":
+                return battles_run
+            if reply["type"] == "wait":
+                time.sleep(reply["retry_after"])
+                continue
+            reason = get_refusal_reason(reply)
+            if reason is not None:
+                connection.request({"type": "refuse", "lease_id": reply["lease_id"], "worker": name, "reason": reason})
+                raise RuntimeError(f"Refusing to run the coordinator's chunks: {reason}")
+            battles_run += run_chunk(connection, reply)
+    finally:
+        connection.close()
+
+
+def get_refusal_reason(chunk):
+    """Why this worker can't run the chunk like the coordinator would, None if its simulator and map files match"""
+    simulator_version = get_simulator_version()
+    if chunk.get("simulator_version") != simulator_version:
+        return f"the coordinator's simulator version is {chunk.get('simulator_version')} and this worker's is {simulator_version}"
+    for scenario_path, scenario in chunk["scenarios"].items():
+        try:
+            map_hash = get_map_hash(Scenario(scenario["definition"], directory=scenario["directory"]))
+        except FileNotFoundError as error:
+            return f"the map of {scenario_path} is missing: {error.filename}"
+        if map_hash != scenario["map_hash"]:
+            return f"the map of {scenario_path} differs from the coordinator's"
+    return None
+
+
+def run_chunk(connection, chunk):
+    lease_id = chunk["lease_id"]
+    lost = threading.Event()
+    finished = threading.Event()
+
+    def send_heartbeats():
+        heartbeat_interval = chunk["lease_timeout"] / 4
+        while not finished.wait(heartbeat_interval):
+            try:
+                if connection.request({"type": "heartbeat", "lease_id": lease_id})["type"] == "lost":
+                    lost.set()
+                    return
+            except (ConnectionError, OSError):
+                return
+
+    heartbeat_thread = threading.Thread(target=send_heartbeats, daemon=True)
+    heartbeat_thread.start()
+    battles_run = 0
+    try:
+        for scenario_path, seed in chunk["configurations"]:
+            # The chunk was given to another worker, so the rest of it is left to them
+            if lost.is_set():
+                break
+            scenario = Scenario(chunk["scenarios"][scenario_path]["definition"], directory=chunk["scenarios"][scenario_path]["directory"])
+            scenario.seed = seed
+            outcome = get_outcome(*run_battle(scenario, chunk["ticks"]))
+            battles_run += 1
+            connection.request({"type": "result", "lease_id": lease_id, "simulator_version": chunk["simulator_version"],
+                                "scenario": scenario_path, "seed": seed, "outcome": outcome})
+    finally:
+        finished.set()
+        heartbeat_thread.join()
+    if not lost.is_set():
+        connection.request({"type": "complete", "lease_id": lease_id})
+    return battles_run
+
+
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+    from sweep import parse_seeds
+    parser = argparse.ArgumentParser(description="Run a sweep over workers on this and other machines")
+    subparsers = parser.add_subparsers(dest="role", required=True)
+    coordinator_parser = subparsers.add_parser("coordinator", help="lease the sweep's configurations to workers and collect the outcomes")
+    coordinator_parser.add_argument("scenarios", nargs="+", help="scenario files (.json or .toml)")
+    coordinator_parser.add_argument("--seeds", default="0-9", help="seeds to run every scenario with, like 0-99,200 (default: 0-9)")
+    coordinator_parser.add_argument("--ticks", type=int, default=None, help="number of ticks to run (default: every scenario's ticks)")
+    coordinator_parser.add_argument("--address", default=f"0.0.0.0:{globals.DISTRIBUTED_PORT}", help="host:port or unix:path to listen on")
+    coordinator_parser.add_argument("--chunk-size", type=int, default=None, help="configurations leased at a time")
+    coordinator_parser.add_argument("--lease-timeout", type=float, default=None, help="seconds without a heartbeat before a chunk is leased again")
+    coordinator_parser.add_argument("--local-workers", type=int, default=0, help="number of workers to start on this machine")
+    coordinator_parser.add_argument("--cache", default=globals.RESULT_CACHE_DIRECTORY, help="result cache directory")
+    coordinator_parser.add_argument("--output", default=None, help="append one JSON line per outcome to this file instead of stdout")
+    worker_parser = subparsers.add_parser("worker", help="run chunks leased from a coordinator")
+    worker_parser.add_argument("address", help="coordinator's host:port or unix:path")
+    args = parser.parse_args()
+
+    if args.role == "worker":
+        try:
+            run_worker(args.address)
+        except RuntimeError as error:
+            sys.exit(str(error))
+        sys.exit(0)
+    output = open(args.output, "a") if args.output is not None else sys.stdout
+
+    def write_outcome(scenario_path, seed, outcome):
+        output.write(json.dumps(dict(outcome, path=scenario_path, seed=seed)) + "\n")
+        output.flush()
+
+    coordinator = Coordinator(args.scenarios, parse_seeds(args.seeds), address=args.address, ticks=args.ticks, chunk_size=args.chunk_size,
+                              lease_timeout=args.lease_timeout, cache=ResultCache(args.cache), on_result=write_outcome)
+    server = coordinator.make_server()
+    # Local workers connect to the coordinator on this machine whatever interface it listens on
+    family, socket_address = parse_address(args.address)
+    local_address = args.address if family == socket.AF_UNIX else f"127.0.0.1:{server.server_address[1]}"
+    workers = [multiprocessing.Process(target=run_worker, args=(local_address,), daemon=True) for i in range(0, args.local_workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        coordinator.serve(server)
+    finally:
+        for worker in workers:
+            worker.join(timeout=coordinator.lease_timeout)
+        if output is not sys.stdout:
+            output.close()
+    print(json.dumps(coordinator.get_progress()), file=sys.stderr)
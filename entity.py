@@ -1,15 +1,18 @@
-from pygame import Surface, draw
 import globals
 from utility import *
 from map import Map
-from random import random, choice, randint
-from math import sin, cos, sqrt
+from pathfinding import AStarSearch, smooth_path
+from archetypes import get_archetype
+from shot_buffer import HITSCAN, PROJECTILE, RAY
+from math import sin, cos, sqrt, ceil
+from collections import deque
 
 
 class Entity:
 
-    def __init__(self, win, map, id, shape, width, color, coordinates):
-        if not isinstance(win, Surface): raise TypeError("win has to be a Surface object")
+    def __init__(self, win, map, id, shape, width, color, coordinates, rng=None):
+        # Headless battles have no Surface to draw on, checked by duck typing so that pygame is only imported to draw
+        if win is not None and not hasattr(win, "blit"): raise TypeError("win has to be a Surface object or None")
         if not isinstance(map, Map): raise ValueError("map has to be a Map object")
         if not isinstance(id, int): raise TypeError("id has to be an int")
         if shape not in ("square", "circle"): raise TypeError("shape has to be square, or circle")
@@ -34,6 +37,8 @@ class Entity:
         self.grid_position = (0, 0)
         self.adjacent_grid_positions = None
         self.get_grid_coordinates(self.map)
+        # Random number generator of the simulation the entity belongs to, so a seeded simulation is reproducible
+        self.rng = rng if rng is not None else globals.rng
 
     def update_at_start_of_frame(self):
         if self.coordinates is not None:
@@ -45,14 +50,24 @@ class Entity:
                 self.coordinates_center.y = self.coordinates.y
             self.get_grid_coordinates(self.map)
 
-    def draw(self):
+    def update_color(self):
+        """Entities whose color depends on their state update it here, before they are drawn"""
+        pass
+
+    def draw(self, camera):
+        from pygame import draw
         if self.coordinates is not None:
             if self.shape == "square":
+                if not camera.is_rect_visible(self.coordinates.x, self.coordinates.y, self.width, self.height):
+                    return
                 color = self.color
-                draw.rect(self.win, color, (self.coordinates.x, self.coordinates.y, self.width, self.height))
+                screen_x, screen_y = camera.world_to_screen(self.coordinates.x, self.coordinates.y)
+                draw.rect(self.win, color, (screen_x, screen_y, max(camera.scale(self.width), 1), max(camera.scale(self.height), 1)))
             elif self.shape == "circle":
+                if not camera.is_point_visible(self.coordinates.x, self.coordinates.y, margin=self.radius):
+                    return
                 color = self.color
-                draw.circle(self.win, color, (self.coordinates.x, self.coordinates.y), self.radius)
+                draw.circle(self.win, color, camera.world_to_screen(self.coordinates.x, self.coordinates.y), max(camera.scale(self.radius), 1))
 
     def get_grid_coordinates(self, map):
         if not isinstance(map, Map): raise ValueError("map has to be a Map object")
@@ -61,54 +76,51 @@ class Entity:
             self.adjacent_grid_positions = self.map.get_neighboring_grid_positions(self.grid_position)
 
 
+# Soldiers of a faction share these colors instead of each deriving its own
+FACTION_DEAD_COLORS = {faction_color.name: [max(i - 150, 0) for i in faction_color.value] for faction_color in globals.FactionColor}
+FACTION_SHIELD_RECHARGE_DELAY_ACTIVE_COLORS = {faction_color.name: [min(i + 200, 255) for i in faction_color.value]
+                                               for faction_color in globals.FactionColor}
+
+
 class Soldier(Entity):
 
-    def __init__(self, win, map, id, shape, width, coordinates, faction, weapon_type, aim_factor):
+    def __init__(self, win, map, id, shape, width, coordinates, faction, weapon_type, aim_factor, rng=None):
         if faction not in ("TR", "NC", "VS"): raise ValueError("faction has to be either TR, NC, or VS")
         if not isinstance(map, Map): raise ValueError("map has to be a Map object")
-        if weapon_type not in ("short range", "med range", "long range"): raise ValueError("weapon type not valid.")
         if faction == "TR":
             color = globals.FactionColor.TR.value
         elif faction == "NC":
             color = globals.FactionColor.NC.value
         elif faction == "VS":
             color = globals.FactionColor.VS.value
-        super().__init__(win, map, id, shape, width, color, coordinates)
+        super().__init__(win, map, id, shape, width, color, coordinates, rng)
+        # Health, weapon and movement stats are read from the archetype shared by every soldier with this weapon type
+        self.archetype = get_archetype(weapon_type)
 
-        self.movement_speed = 0.05
         self.destination = None
-        self.destination_queue = []
+        self.destination_queue = deque()
         self.is_moving = False
         self.moving_to_point = False
         self.enable_collisions = True
 
-        # Ray list format: ((end_x, end_y), (R, G, B))
-        self.ray_list = []
+        # Whether the shots and rays this soldier records into globals.shot_buffer are drawn
         self.show_rays = True
         self.show_destination_queue = False
         self.faction = faction
-        self.dead_color = [max(i - 150, 0) for i in self.color]
-        self.shield_recharge_delay_active_color = [min(i + 200, 255) for i in self.color]
+        self.dead_color = FACTION_DEAD_COLORS[faction]
+        self.shield_recharge_delay_active_color = FACTION_SHIELD_RECHARGE_DELAY_ACTIVE_COLORS[faction]
 
-        self.maximum_health = 200
         self.health = self.maximum_health
-        self.weapon_type = weapon_type
-        self.fire_rate = 10
         self.fire_rate_counter = self.fire_rate
-        self.damage_falloff = {}
-        self.determine_damage_falloff()
         self.aim_factor = aim_factor
-        self.enemy_engagement_range = 1000
         self.shooting = False
         self.current_target_enemy = None
         self.current_target_enemy_distance = None
-        self.shield_recharge_delay = 1000
         self.shield_recharge_delay_active = False
         self.shield_recharge_delay_counter = 0
         self.shield_recharge_delay_blinking_effect_rate = 50
         self.shield_recharge_delay_blinking_effect_counter = 0
         self.shield_is_recharging = False
-        self.shield_recharge_rate = 10
         self.getting_shot_at_by_list = []
 
         self.kills = 0
@@ -116,11 +128,13 @@ class Soldier(Entity):
         self.alive = False
         self.spawn_timer_counter = 0
         self.revivable = False
+        # Path being found by globals.ai_scheduler, a pathfinding.AStarSearch
+        self.path_request = None
+        # Distance to the closest living enemy at the last full target search, None if there was none
+        self.nearest_enemy_distance = None
 
     def update_at_start_of_frame(self):
         super().update_at_start_of_frame()
-        if self.ray_list:
-            self.ray_list = []
         if self.coordinates is None:
             self.alive = False
             self.color = self.dead_color
@@ -150,46 +164,78 @@ class Soldier(Entity):
             self.fire_rate_counter = min(self.fire_rate_counter + 1, self.fire_rate)
             if self.current_target_enemy is not None:
                 self.current_target_enemy_distance = euclidean_distance(self.coordinates_center, self.current_target_enemy.coordinates_center)
-            self.enemy_engagement_artificial_intelligence(globals.soldiers_dict.values())
-            self.movement_ai(globals.dt, self.find_best_capture_point())
-
-    def determine_damage_falloff(self):
-        if self.weapon_type == "short range":
-            self.damage_falloff[(0, 200)] = 7
-            self.damage_falloff[(200, 500)] = 5
-            self.damage_falloff[(500, 3000)] = 3
-        elif self.weapon_type == "med range":
-            self.damage_falloff[(0, 200)] = 6
-            self.damage_falloff[(200, 500)] = 6
-            self.damage_falloff[(500, 3000)] = 3
-        elif self.weapon_type == "long range":
-            self.damage_falloff[(0, 200)] = 5
-            self.damage_falloff[(200, 500)] = 5
-            self.damage_falloff[(500, 3000)] = 5
-
-    def draw(self):
-        if self.show_rays:
-            self.draw_rays()
+            profiler = globals.profiler
+            # With the AI scheduler, soldiers away from the fighting don't search for targets every tick
+            evaluate_targets = globals.ai_scheduler is None or globals.ai_scheduler.should_evaluate_targets(self)
+            if profiler is None:
+                if evaluate_targets:
+                    self.enemy_engagement_artificial_intelligence(globals.soldiers_dict.values())
+                self.movement_ai(globals.dt, self.find_best_capture_point())
+            else:
+                if evaluate_targets:
+                    profiler.start_phase("targeting")
+                    self.enemy_engagement_artificial_intelligence(globals.soldiers_dict.values())
+                    profiler.end_phase("targeting")
+                profiler.start_phase("movement")
+                self.movement_ai(globals.dt, self.find_best_capture_point())
+                profiler.end_phase("movement")
+            # Soldiers that didn't walk this tick still step aside when others are too close
+            if globals.neighbor_grid is not None and (self.destination is None or self.shooting):
+                self.keep_apart_from_soldiers(globals.dt)
+
+    @property
+    def weapon_type(self):
+        return self.archetype.name
+
+    @property
+    def maximum_health(self):
+        return self.archetype.maximum_health
+
+    @property
+    def fire_rate(self):
+        return self.archetype.fire_rate
+
+    @property
+    def movement_speed(self):
+        return self.archetype.movement_speed
+
+    @property
+    def enemy_engagement_range(self):
+        return self.archetype.enemy_engagement_range
+
+    @property
+    def shield_recharge_delay(self):
+        return self.archetype.shield_recharge_delay
+
+    @property
+    def shield_recharge_rate(self):
+        return self.archetype.shield_recharge_rate
+
+    @property
+    def damage_falloff(self):
+        return self.archetype.damage_falloff
+
+    def draw(self, camera):
+        from pygame import draw
         if self.show_destination_queue:
             for destination in self.destination_queue:
-                draw.circle(self.win, globals.GREEN, (destination.x, destination.y), 7)
+                if camera.is_point_visible(destination.x, destination.y, margin=7):
+                    draw.circle(self.win, globals.GREEN, camera.world_to_screen(destination.x, destination.y), max(camera.scale(7), 1))
+        self.update_color()
+        super().draw(camera)
+
+    def update_color(self):
+        """Makes the soldier blink while its shield recharge is delayed"""
         if self.alive:
             if self.shield_recharge_delay_active:
                 if self.shield_recharge_delay_blinking_effect_counter % self.shield_recharge_delay_blinking_effect_rate == 0 and self.color == self.original_color:
                     self.color = self.shield_recharge_delay_active_color
                 elif self.shield_recharge_delay_blinking_effect_counter % self.shield_recharge_delay_blinking_effect_rate == 0 and self.color == self.shield_recharge_delay_active_color:
                     self.color = self.original_color
-        super().draw()
-
-    def draw_rays(self):
-        for ray in self.ray_list:
-            ray_end_coordinate = ray[0]
-            ray_color = ray[1]
-            draw.line(self.win, ray_color, (self.coordinates_center.x, self.coordinates_center.y), (ray_end_coordinate.x, ray_end_coordinate.y), width=1)
 
     def add_to_destination_queue(self, destination):
         if not isinstance(destination, Point): raise ValueError("destination has to be a Point object")
-        self.destination_queue.insert(0, destination)
+        self.destination_queue.appendleft(destination)
 
     def get_next_destination_from_queue(self):
         return self.destination_queue.pop()
@@ -201,7 +247,8 @@ class Soldier(Entity):
     def cancel_all_queued_moves(self):
         self.destination = None
         self.is_moving = False
-        self.destination_queue = []
+        self.destination_queue = deque()
+        self.path_request = None
 
     def move(self, dt, destination=None):
         if not isinstance(destination, Point) and destination is not None: raise TypeError("destination has to be a Point object")
@@ -224,60 +271,131 @@ class Soldier(Entity):
         component_distances = calculate_component_distances(distance_moved=distance, start_x=self.coordinates_center.x,
                                                             start_y=self.coordinates_center.y, end_x=self.destination.x,
                                                             end_y=self.destination.y)
-        new_coordinates_center = Point(self.coordinates_center.x + component_distances.x, self.coordinates_center.y + component_distances.y)
+        step_x = component_distances.x
+        step_y = component_distances.y
+        if globals.neighbor_grid is not None:
+            push_x, push_y, speed_factor = self.get_separation(step_x, step_y)
+            if (push_x != 0 or push_y != 0) and euclidean_distance(self.coordinates_center, self.destination) <= globals.SOLDIER_SEPARATION_RADIUS / 2:
+                # Soldiers crowding a waypoint would push each other around it forever, so in a crowd one close by counts
+                # as reached as long as the soldier can walk straight on to the next one
+                if not self.destination_queue:
+                    self.cancel_move()
+                    return
+                if self.map.has_line_of_sight(self.coordinates_center, self.destination_queue[-1]):
+                    self.cancel_move()
+                    self.move(dt)
+                    return
+            steered_step_x = step_x * speed_factor + push_x * distance
+            steered_step_y = step_y * speed_factor + push_y * distance
+            # Soldiers aren't pushed into walls, next to one they keep to their path
+            if not self.enable_collisions or not self.collides_with_wall(Point(self.coordinates_center.x + steered_step_x, self.coordinates_center.y + steered_step_y)):
+                step_x = steered_step_x
+                step_y = steered_step_y
         # Check for collisions with nearby walls
-        if self.enable_collisions:
-            for adjacent_grid_position in self.adjacent_grid_positions:
-                adjacent_grid_position_row = adjacent_grid_position[0]
-                adjacent_grid_position_col = adjacent_grid_position[1]
-                square_coordinates = Point(0, 0)
-                cancel_move_flag = False
-                if adjacent_grid_position_col < 0:
-                    cancel_move_flag = True
-                    square_coordinates.x = 0 - self.map.grid_width
-                    square_coordinates.y = self.coordinates_center.y
-                elif adjacent_grid_position_col == self.map.ncols:
-                    cancel_move_flag = True
-                    square_coordinates.x = globals.WIN_WIDTH
-                    square_coordinates.y = self.coordinates_center.y
-                elif adjacent_grid_position_row < 0:
-                    cancel_move_flag = True
-                    square_coordinates.x = self.coordinates_center.x
-                    square_coordinates.y = 0 - self.map.grid_width
-                elif adjacent_grid_position_row == self.map.nrows:
-                    cancel_move_flag = True
-                    square_coordinates.x = self.coordinates_center.x
-                    square_coordinates.y = globals.WIN_HEIGHT
-                if not cancel_move_flag:
-                    if self.map.map_array[adjacent_grid_position_row][adjacent_grid_position_col] == 1:
-                        cancel_move_flag = True
-                        square_coordinates = self.map.grid_coordinates[adjacent_grid_position_row][adjacent_grid_position_col]
-                        square_coordinates = Point(square_coordinates[0], square_coordinates[1])
-                if cancel_move_flag:
-                    if point_overlaps_with_rect(new_coordinates_center, square_coordinates, self.map.grid_width, self.map.grid_width):
-                        self.cancel_move()
-                        return
+        if self.enable_collisions and self.collides_with_wall(Point(self.coordinates_center.x + step_x, self.coordinates_center.y + step_y)):
+            self.cancel_move()
+            return
         if euclidean_distance(self.coordinates_center, self.destination) <= distance:
             self.coordinates_center = self.destination.get_coordinates()
             self.coordinates.x = self.coordinates_center.x - self.width / 2
             self.coordinates.y = self.coordinates_center.y - self.width / 2
             self.cancel_move()
         else:
-            component_distances = calculate_component_distances(distance_moved=distance, start_x=self.coordinates_center.x,
-                                                                start_y=self.coordinates_center.y, end_x=self.destination.x,
-                                                                end_y=self.destination.y)
-            self.coordinates_center.x += component_distances.x
-            self.coordinates_center.y += component_distances.y
-            self.coordinates.x += component_distances.x
-            self.coordinates.y += component_distances.y
+            self.coordinates_center.x += step_x
+            self.coordinates_center.y += step_y
+            self.coordinates.x += step_x
+            self.coordinates.y += step_y
+
+    def collides_with_wall(self, new_coordinates_center):
+        """Whether the center would be inside a wall or outside the map, only the squares around the soldier are checked"""
+        for adjacent_grid_position in self.adjacent_grid_positions:
+            adjacent_grid_position_row = adjacent_grid_position[0]
+            adjacent_grid_position_col = adjacent_grid_position[1]
+            square_coordinates = Point(0, 0)
+            cancel_move_flag = False
+            if adjacent_grid_position_col < 0:
+                cancel_move_flag = True
+                square_coordinates.x = 0 - self.map.grid_width
+                square_coordinates.y = self.coordinates_center.y
+            elif adjacent_grid_position_col == self.map.ncols:
+                cancel_move_flag = True
+                square_coordinates.x = self.map.world_width
+                square_coordinates.y = self.coordinates_center.y
+            elif adjacent_grid_position_row < 0:
+                cancel_move_flag = True
+                square_coordinates.x = self.coordinates_center.x
+                square_coordinates.y = 0 - self.map.grid_width
+            elif adjacent_grid_position_row == self.map.nrows:
+                cancel_move_flag = True
+                square_coordinates.x = self.coordinates_center.x
+                square_coordinates.y = self.map.world_height
+            if not cancel_move_flag:
+                if self.map.map_array[adjacent_grid_position_row][adjacent_grid_position_col] == 1:
+                    cancel_move_flag = True
+                    square_coordinates = self.map.grid_coordinates[adjacent_grid_position_row][adjacent_grid_position_col]
+                    square_coordinates = Point(square_coordinates[0], square_coordinates[1])
+            if cancel_move_flag:
+                if point_overlaps_with_rect(new_coordinates_center, square_coordinates, self.map.grid_width, self.map.grid_width):
+                    return True
+        return False
+
+    def keep_apart_from_soldiers(self, dt):
+        """Soldiers standing still step aside when others are too close to them"""
+        if globals.neighbor_grid is None:
+            return
+        push_x, push_y, speed_factor = self.get_separation(0, 0)
+        if push_x == 0 and push_y == 0:
+            return
+        distance = self.movement_speed * dt
+        new_coordinates_center = Point(self.coordinates_center.x + push_x * distance, self.coordinates_center.y + push_y * distance)
+        if self.enable_collisions and self.collides_with_wall(new_coordinates_center):
+            return
+        self.coordinates_center = new_coordinates_center
+        self.coordinates.x = self.coordinates_center.x - self.width / 2
+        self.coordinates.y = self.coordinates_center.y - self.width / 2
+
+    def get_separation(self, step_x, step_y):
+        """Returns (push x, push y, speed factor). The push points away from soldiers that are too close, as a fraction of
+        a step, and the speed factor slows the soldier down behind soldiers walking the same way so soldiers following the
+        same path queue up instead of collapsing onto the same pixels"""
+        separation_radius = globals.SOLDIER_SEPARATION_RADIUS
+        push_x = 0
+        push_y = 0
+        speed_factor = 1
+        for neighbor in globals.neighbor_grid.get_soldiers_near(self.coordinates_center):
+            if neighbor is self or not neighbor.alive:
+                continue
+            offset_x = self.coordinates_center.x - neighbor.coordinates_center.x
+            offset_y = self.coordinates_center.y - neighbor.coordinates_center.y
+            neighbor_distance = sqrt(offset_x ** 2 + offset_y ** 2)
+            if neighbor_distance >= separation_radius:
+                continue
+            if neighbor_distance == 0:
+                # Soldiers on the same spot split up in the order of their ids
+                offset_x = 1 if self.id > neighbor.id else -1
+                neighbor_distance = 1
+            weight = (separation_radius - neighbor_distance) / separation_radius
+            push_x += offset_x / neighbor_distance * weight
+            push_y += offset_y / neighbor_distance * weight
+            # Only a neighbor ahead going the same way is queued behind, soldiers meeting head on pass each other
+            if neighbor.is_moving and neighbor.destination is not None and offset_x * step_x + offset_y * step_y < 0:
+                if (neighbor.destination.x - neighbor.coordinates_center.x) * step_x + (neighbor.destination.y - neighbor.coordinates_center.y) * step_y > 0:
+                    speed_factor = min(speed_factor, neighbor_distance / separation_radius)
+        speed_factor = max(speed_factor, globals.SOLDIER_MINIMUM_QUEUE_SPEED_FACTOR)
+        push_length = sqrt(push_x ** 2 + push_y ** 2)
+        if push_length > 1:
+            push_x /= push_length
+            push_y /= push_length
+        separation_strength = globals.SOLDIER_SEPARATION_STRENGTH
+        return push_x * separation_strength, push_y * separation_strength, speed_factor
 
     def move_random(self, dt, probability_of_changing_destination):
         if self.alive:
-            random_number = random()
+            random_number = self.rng.random()
             if random_number <= probability_of_changing_destination or self.destination is None:
                 if not self.destination_queue:
-                    random_destination_x = random() * globals.WIN_WIDTH
-                    random_destination_y = random() * globals.WIN_HEIGHT
+                    random_destination_x = self.rng.random() * self.map.world_width
+                    random_destination_y = self.rng.random() * self.map.world_height
                     self.add_to_destination_queue(Point(random_destination_x, random_destination_y))
         self.move(dt)
 
@@ -290,97 +408,36 @@ class Soldier(Entity):
         # Determine grid position of destination
         if destination_grid_position == self.grid_position:
             return
-        def reconstruct_path(came_from, current_node):
-            total_path = []
-            current_node_coordinates_center = self.map.grid_coordinates[current_node[0]][current_node[1]]
-            total_path.append(Point(current_node_coordinates_center[0] + self.map.grid_width / 2,
-                                    current_node_coordinates_center[1] + self.map.grid_width / 2))
-            while current_node in came_from.keys():
-                current_node = came_from[current_node]
-                current_node_coordinates_center = self.map.grid_coordinates[current_node[0]][current_node[1]]
-                total_path.append(Point(current_node_coordinates_center[0] + self.map.grid_width / 2,
-                                        current_node_coordinates_center[1] + self.map.grid_width / 2))
-            return total_path
-        def heuristic_function(grid_position):
-            """Calculates euclidean distance"""
-            grid_position_coordinates_center = self.map.grid_coordinates[grid_position[0]][grid_position[1]]
-            destination_grid_position_coordinates_center = self.map.grid_coordinates[destination_grid_position[0]][destination_grid_position[1]]
-            return int(euclidean_distance(Point(grid_position_coordinates_center[0] + self.map.grid_width / 2, grid_position_coordinates_center[1] + self.map.grid_width / 2),
-                                          Point(destination_grid_position_coordinates_center[0] + self.map.grid_width / 2, destination_grid_position_coordinates_center[1] + self.map.grid_width / 2)))
-        open_set = [self.grid_position]
-        came_from = {}
-        g_scores = {self.grid_position: 0}
-        f_scores = {self.grid_position: heuristic_function(self.grid_position)}
-        current_node = None
-        distance_to_corner_neighbor = sqrt(2 * (abs(self.map.grid_width) ** 2))
-        while open_set:
-            # Determine lowest f-score node
-            lowest_f_score_node = None
-            for node in open_set:
-                if lowest_f_score_node is None:
-                    lowest_f_score_node = node
-                elif f_scores[node] < f_scores[lowest_f_score_node]:
-                    lowest_f_score_node = node
-            current_node = lowest_f_score_node
-            if current_node == destination_grid_position:
-                total_path = reconstruct_path(came_from, current_node)
-                for i in range(0, len(total_path)):
-                    next_node = total_path.pop()
-                    self.add_to_destination_queue(next_node)
-                self.move(dt)
+        if globals.goal_fields is not None:
+            # Soldiers heading to the same goal share one distance field, so a path is only a walk down the field
+            total_path = globals.goal_fields.get_field(destination_grid_position, self.enable_collisions).get_path_points(self.grid_position)
+            if globals.profiler is not None:
+                globals.profiler.count("paths_planned")
+        elif globals.ai_scheduler is not None:
+            # The path is found over the next ticks within the scheduler's budget, the soldier waits for it until then
+            if self.path_request is None or self.path_request.goal != destination_grid_position:
+                self.path_request = globals.ai_scheduler.request_path(self, destination_grid_position)
+            if not self.path_request.done:
                 return
-            open_set.remove(current_node)
-            corner_neighbors = self.map.get_neighboring_corner_grid_positions(current_node)
-            edge_neighbors = self.map.get_neighboring_edge_grid_positions(current_node)
-            for corner_neighbor in corner_neighbors:
-                if corner_neighbor[1] < 0 or corner_neighbor[1] > self.map.ncols - 1:
-                    continue
-                if corner_neighbor[0] < 0 or corner_neighbor[0] > self.map.nrows - 1:
-                    continue
-                if self.enable_collisions:
-                    if self.map.map_array[corner_neighbor[0]][corner_neighbor[1]] == 1:
-                        continue
-                    # This is to prevent movement diagonally through two touching wall's corners
-                    corner_neighbor_row = corner_neighbor[0]
-                    corner_neighbor_col = corner_neighbor[1]
-                    current_node_row = current_node[0]
-                    current_node_col = current_node[1]
-                    relative_row_position_to_current_node = corner_neighbor_row - current_node_row
-                    relative_col_position_to_current_node = corner_neighbor_col - current_node_col
-                    if self.map.map_array[current_node_row][current_node_col + relative_col_position_to_current_node] == 1 and self.map.map_array[current_node_row + relative_row_position_to_current_node][current_node_col] == 1:
-                        continue
-                tentative_g_score = g_scores[current_node] + distance_to_corner_neighbor
-                better_path = False
-                if g_scores.setdefault(corner_neighbor, None) is None:
-                    better_path = True
-                elif tentative_g_score < g_scores[corner_neighbor]:
-                    better_path = True
-                if better_path:
-                    came_from[corner_neighbor] = current_node
-                    g_scores[corner_neighbor] = tentative_g_score
-                    f_scores[corner_neighbor] = tentative_g_score + heuristic_function(corner_neighbor)
-                    if corner_neighbor not in open_set:
-                        open_set.append(corner_neighbor)
-            for edge_neighbor in edge_neighbors:
-                if edge_neighbor[1] < 0 or edge_neighbor[1] > self.map.ncols - 1:
-                    continue
-                if edge_neighbor[0] < 0 or edge_neighbor[0] > self.map.nrows - 1:
-                    continue
-                if self.map.map_array[edge_neighbor[0]][edge_neighbor[1]] == 1 and self.enable_collisions:
-                    continue
-                tentative_g_score = g_scores[current_node] + self.map.grid_width
-                better_path = False
-                if g_scores.setdefault(edge_neighbor, None) is None:
-                    better_path = True
-                elif tentative_g_score < g_scores[edge_neighbor]:
-                    better_path = True
-                if better_path:
-                    came_from[edge_neighbor] = current_node
-                    g_scores[edge_neighbor] = tentative_g_score
-                    f_scores[edge_neighbor] = tentative_g_score + heuristic_function(edge_neighbor)
-                    if edge_neighbor not in open_set:
-                        open_set.append(edge_neighbor)
-        return
+            total_path = self.path_request.get_path_points()
+            self.path_request = None
+        else:
+            profiler = globals.profiler
+            if profiler is not None:
+                profiler.start_phase("astar")
+                profiler.count("paths_planned")
+            search = AStarSearch(self.map, self.grid_position, destination_grid_position, self.enable_collisions)
+            search.step()
+            if profiler is not None:
+                profiler.end_phase("astar")
+                profiler.count("nodes_expanded", search.nodes_expanded)
+            total_path = search.get_path_points()
+        if total_path is None:
+            return
+        # Only the corners of the path are queued, the soldier walks straight between them
+        for next_node in reversed(smooth_path(self.map, total_path)):
+            self.add_to_destination_queue(next_node)
+        self.move(dt)
 
     def movement_ai(self, dt, capture_point):
         if self.alive:
@@ -389,7 +446,7 @@ class Soldier(Entity):
                 return
             if not self.moving_to_point:
                 probability_of_deciding_to_move_to_point = 0.003
-                if random() <= probability_of_deciding_to_move_to_point:
+                if self.rng.random() <= probability_of_deciding_to_move_to_point:
                     if capture_point.current_faction != self.faction:
                         distance_to_point = euclidean_distance(self.coordinates_center, capture_point.coordinates_center)
                         if distance_to_point > capture_point.capture_radius:
@@ -412,7 +469,7 @@ class Soldier(Entity):
                     self.moving_to_point = False
             elif self.moving_to_point:
                 probability_of_deciding_not_to_move_to_point_anymore = 0.001
-                if random() <= probability_of_deciding_not_to_move_to_point_anymore:
+                if self.rng.random() <= probability_of_deciding_not_to_move_to_point_anymore:
                     self.cancel_all_queued_moves()
                     self.moving_to_point = False
                 self.move_astar(dt=dt, destination=capture_point.coordinates_center)
@@ -425,7 +482,7 @@ class Soldier(Entity):
         point_on_large_circle = Point((unit_circle_coordinates.x * large_circle_outside_view_radius + self.coordinates_center.x),
                                       (unit_circle_coordinates.y * -large_circle_outside_view_radius) + self.coordinates_center.y)
         if not collide:
-            self.ray_list.append((point_on_large_circle, WHITE))
+            self.record_ray(point_on_large_circle)
         else:
             if angle in (0, 180):
                 is_vertical = True
@@ -441,181 +498,27 @@ class Soldier(Entity):
             ray = Ray(angle=angle, slope=slope, intercept=intercept, is_vertical=is_vertical, x_value=x_value)
             end_point_of_ray = self.get_collision_point_of_ray(ray)
             if end_point_of_ray is not None:
-                self.ray_list.append((end_point_of_ray, WHITE))
+                self.record_ray(end_point_of_ray)
             else:
-                self.ray_list.append((point_on_large_circle, WHITE))
+                self.record_ray(point_on_large_circle)
+
+    def record_ray(self, end_point):
+        if globals.shot_buffer is not None:
+            globals.shot_buffer.record(RAY, self, self.coordinates_center, end_point, WHITE)
 
     def get_collision_point_of_ray(self, ray):
-        if not isinstance(ray, Ray): raise ValueError("ray has to be a Ray object")
-        current_grid_row_index = self.grid_position[0]
-        current_grid_col_index = self.grid_position[1]
-        if self.map.grid_coordinates[current_grid_row_index][current_grid_col_index] == 1:
-            return self.coordinates_center.get_coordinates()
-        # If line goes straight up then search grid squares straight above for walls and collide with first one encountered on its bottom line
-        if ray.angle == 0:
-            if current_grid_row_index == 0:
-                return None
-            for row_index in range(current_grid_row_index - 1, -1, -1):
-                if self.map.map_array[row_index][current_grid_col_index] == 1:
-                    return Point(self.coordinates_center.x, self.map.grid_coordinates[row_index][current_grid_col_index][1] + self.map.grid_width)
-            return None
-        elif ray.angle == 180:
-            if current_grid_row_index == self.map.nrows - 1:
-                return None
-            for row_index in range(current_grid_row_index + 1, self.map.nrows):
-                if self.map.map_array[row_index][current_grid_col_index] == 1:
-                    return Point(self.coordinates_center.x, self.map.grid_coordinates[row_index][current_grid_col_index][1])
-            return None
-        elif ray.angle == 90:
-            if current_grid_col_index == self.map.ncols - 1:
-                return None
-            for col_index in range(current_grid_col_index + 1, self.map.ncols):
-                if self.map.map_array[current_grid_row_index][col_index] == 1:
-                    return Point(self.map.grid_coordinates[current_grid_row_index][col_index][0], self.coordinates_center.y)
-            return None
-        elif ray.angle == 270:
-            if current_grid_col_index == 0:
-                return None
-            for col_index in range(current_grid_col_index - 1, -1, -1):
-                if self.map.map_array[current_grid_row_index][col_index] == 1:
-                    return Point(self.map.grid_coordinates[current_grid_row_index][col_index][0] + self.map.grid_width, self.coordinates_center.y)
-            return None
-        elif 0 < ray.angle < 90:
-            while current_grid_row_index != -1 and current_grid_col_index != self.map.ncols:
-                if current_grid_row_index == 0 and current_grid_col_index == self.map.ncols - 1:
-                    return None
-                elif current_grid_col_index != self.map.ncols - 1:
-                    grid_square_to_the_right_coordinates = self.map.grid_coordinates[current_grid_row_index][current_grid_col_index + 1]
-                    y_value_of_ray_at_x_value_of_grid_square_to_the_right = ray.slope * grid_square_to_the_right_coordinates[0] + ray.intercept
-                    # If it intersects
-                    if grid_square_to_the_right_coordinates[1] <= y_value_of_ray_at_x_value_of_grid_square_to_the_right <= grid_square_to_the_right_coordinates[1] + self.map.grid_width:
-                        current_grid_col_index += 1
-                        if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                            left_edge_of_grid_square_line = Line(slope=0, intercept=0, is_vertical=True, x_value=grid_square_to_the_right_coordinates[0])
-                            return get_intersection_point_of_lines(ray, left_edge_of_grid_square_line)
-                    # Else it must mean that it intersects with the bottom edge of the grid square above
-                    else:
-                        if current_grid_row_index == 0:
-                            return None
-                        else:
-                            grid_square_above_coordinates = self.map.grid_coordinates[current_grid_row_index - 1][current_grid_col_index]
-                            current_grid_row_index -= 1
-                            if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                                bottom_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_above_coordinates[1] + self.map.grid_width, is_vertical=False)
-                                return get_intersection_point_of_lines(ray, bottom_edge_of_grid_square_line)
-                else:
-                    grid_square_above_coordinates = self.map.grid_coordinates[current_grid_row_index - 1][current_grid_col_index]
-                    x_value_of_ray_at_y_value_of_grid_square_above = (grid_square_above_coordinates[1] + self.map.grid_width - ray.intercept) / ray.slope
-                    # If it intersects
-                    if grid_square_above_coordinates[0] <= x_value_of_ray_at_y_value_of_grid_square_above <= grid_square_above_coordinates[0] + self.map.grid_width:
-                        current_grid_row_index -= 1
-                        if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                            bottom_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_above_coordinates[1] + self.map.grid_width, is_vertical=False)
-                            return get_intersection_point_of_lines(ray, bottom_edge_of_grid_square_line)
-                    else:
-                        return None
-        elif 90 < ray.angle < 180:
-            while current_grid_row_index != self.map.nrows and current_grid_col_index != self.map.ncols:
-                if current_grid_row_index == self.map.nrows - 1 and current_grid_col_index == self.map.ncols - 1:
-                    return None
-                elif current_grid_col_index != self.map.ncols - 1:
-                    grid_square_to_the_right_coordinates = self.map.grid_coordinates[current_grid_row_index][current_grid_col_index + 1]
-                    y_value_of_ray_at_x_value_of_grid_square_to_the_right = ray.slope * grid_square_to_the_right_coordinates[0] + ray.intercept
-                    # If it intersects
-                    if grid_square_to_the_right_coordinates[1] <= y_value_of_ray_at_x_value_of_grid_square_to_the_right <= grid_square_to_the_right_coordinates[1] + self.map.grid_width:
-                        current_grid_col_index += 1
-                        if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                            left_edge_of_grid_square_line = Line(slope=0, intercept=0, is_vertical=True, x_value=grid_square_to_the_right_coordinates[0])
-                            return get_intersection_point_of_lines(ray, left_edge_of_grid_square_line)
-                    # Else it must mean that it intersects with the top edge of the grid square below
-                    else:
-                        if current_grid_row_index == self.map.nrows - 1:
-                            return None
-                        else:
-                            grid_square_below_coordinates = self.map.grid_coordinates[current_grid_row_index + 1][current_grid_col_index]
-                            current_grid_row_index += 1
-                            if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                                top_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_below_coordinates[1], is_vertical=False)
-                                return get_intersection_point_of_lines(ray, top_edge_of_grid_square_line)
-                else:
-                    grid_square_below_coordinates = self.map.grid_coordinates[current_grid_row_index + 1][current_grid_col_index]
-                    x_value_of_ray_at_y_value_of_grid_square_below = (grid_square_below_coordinates[1] - ray.intercept) / ray.slope
-                    # If it intersects
-                    if grid_square_below_coordinates[0] <= x_value_of_ray_at_y_value_of_grid_square_below <= grid_square_below_coordinates[0] + self.map.grid_width:
-                        current_grid_row_index += 1
-                        if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                            top_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_below_coordinates[1], is_vertical=False)
-                            return get_intersection_point_of_lines(ray, top_edge_of_grid_square_line)
-                    else:
-                        return None
-        elif 180 < ray.angle < 270:
-            while current_grid_row_index != self.map.nrows and current_grid_col_index != -1:
-                if current_grid_row_index == self.map.nrows - 1 and current_grid_col_index == 0:
-                    return None
-                elif current_grid_col_index != 0:
-                    grid_square_to_the_left_coordinates = self.map.grid_coordinates[current_grid_row_index][current_grid_col_index - 1]
-                    y_value_of_ray_at_x_value_of_grid_square_to_the_left = ray.slope * (grid_square_to_the_left_coordinates[0] + self.map.grid_width) + ray.intercept
-                    # If it intersects
-                    if grid_square_to_the_left_coordinates[1] <= y_value_of_ray_at_x_value_of_grid_square_to_the_left <= grid_square_to_the_left_coordinates[1] + self.map.grid_width:
-                        current_grid_col_index -= 1
-                        if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                            right_edge_of_grid_square_line = Line(slope=0, intercept=0, is_vertical=True, x_value=grid_square_to_the_left_coordinates[0] + self.map.grid_width)
-                            return get_intersection_point_of_lines(ray, right_edge_of_grid_square_line)
-                    # Else it must mean that it intersects with the top edge of the grid square below
-                    else:
-                        if current_grid_row_index == self.map.nrows - 1:
-                            return None
-                        else:
-                            grid_square_below_coordinates = self.map.grid_coordinates[current_grid_row_index + 1][current_grid_col_index]
-                            current_grid_row_index += 1
-                            if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                                top_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_below_coordinates[1], is_vertical=False)
-                                return get_intersection_point_of_lines(ray, top_edge_of_grid_square_line)
-                else:
-                    grid_square_below_coordinates = self.map.grid_coordinates[current_grid_row_index + 1][current_grid_col_index]
-                    x_value_of_ray_at_y_value_of_grid_square_below = (grid_square_below_coordinates[1] - ray.intercept) / ray.slope
-                    # If it intersects
-                    if grid_square_below_coordinates[0] <= x_value_of_ray_at_y_value_of_grid_square_below <= grid_square_below_coordinates[0] + self.map.grid_width:
-                        current_grid_row_index += 1
-                        if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                            top_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_below_coordinates[1], is_vertical=False)
-                            return get_intersection_point_of_lines(ray, top_edge_of_grid_square_line)
-                    else:
-                        return None
-        elif ray.angle > 270:
-            while current_grid_row_index != -1 and current_grid_col_index != -1:
-                if current_grid_row_index == 0 and current_grid_col_index == 0:
-                    return None
-                elif current_grid_col_index != 0:
-                    grid_square_to_the_left_coordinates = self.map.grid_coordinates[current_grid_row_index][current_grid_col_index - 1]
-                    y_value_of_ray_at_x_value_of_grid_square_to_the_left = ray.slope * (grid_square_to_the_left_coordinates[0] + self.map.grid_width) + ray.intercept
-                    # If it intersects
-                    if grid_square_to_the_left_coordinates[1] <= y_value_of_ray_at_x_value_of_grid_square_to_the_left <= grid_square_to_the_left_coordinates[1] + self.map.grid_width:
-                        current_grid_col_index -= 1
-                        if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                            right_edge_of_grid_square_line = Line(slope=0, intercept=0, is_vertical=True, x_value=grid_square_to_the_left_coordinates[0] + self.map.grid_width)
-                            return get_intersection_point_of_lines(ray, right_edge_of_grid_square_line)
-                    # Else it must mean that it intersects with the bottom edge of the grid square above
-                    else:
-                        if current_grid_row_index == 0:
-                            return None
-                        else:
-                            grid_square_above_coordinates = self.map.grid_coordinates[current_grid_row_index - 1][current_grid_col_index]
-                            current_grid_row_index -= 1
-                            if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                                bottom_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_above_coordinates[1] + self.map.grid_width, is_vertical=False)
-                                return get_intersection_point_of_lines(ray, bottom_edge_of_grid_square_line)
-                else:
-                    grid_square_above_coordinates = self.map.grid_coordinates[current_grid_row_index - 1][current_grid_col_index]
-                    x_value_of_ray_at_y_value_of_grid_square_above = (grid_square_above_coordinates[1] + self.map.grid_width - ray.intercept) / ray.slope
-                    # If it intersects
-                    if grid_square_above_coordinates[0] <= x_value_of_ray_at_y_value_of_grid_square_above <= grid_square_above_coordinates[0] + self.map.grid_width:
-                        current_grid_row_index -= 1
-                        if self.map.map_array[current_grid_row_index][current_grid_col_index] == 1:
-                            bottom_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_above_coordinates[1] + self.map.grid_width, is_vertical=False)
-                            return get_intersection_point_of_lines(ray, bottom_edge_of_grid_square_line)
-                    else:
-                        return None
+        profiler = globals.profiler
+        if profiler is None:
+            return self.trace_ray_through_grid(ray)
+        profiler.start_phase("los_rays")
+        collision_point = self.trace_ray_through_grid(ray)
+        profiler.end_phase("los_rays")
+        profiler.count("rays_cast")
+        return collision_point
+
+    def trace_ray_through_grid(self, ray):
+        """Returns where the ray from the soldier first hits a wall"""
+        return self.map.trace_ray(self.coordinates_center, self.grid_position, ray)
 
     def find_enemy_target(self, list_of_enemies):
         if self.current_target_enemy is not None:
@@ -630,13 +533,17 @@ class Soldier(Entity):
                     return self.current_target_enemy, self.current_target_enemy_distance
         best_enemy = None
         best_enemy_distance = None
+        self.nearest_enemy_distance = None
+        enemy_engagement_range = self.archetype.enemy_engagement_range
         for enemy in list_of_enemies:
             if enemy.faction == self.faction:
                 continue
             if not enemy.alive:
                 continue
             distance_to_enemy = euclidean_distance(self.coordinates_center, enemy.coordinates_center)
-            if best_enemy is None and distance_to_enemy <= self.enemy_engagement_range:
+            if self.nearest_enemy_distance is None or distance_to_enemy < self.nearest_enemy_distance:
+                self.nearest_enemy_distance = distance_to_enemy
+            if best_enemy is None and distance_to_enemy <= enemy_engagement_range:
                 ray_line = find_equation_of_line(self.coordinates_center, enemy.coordinates_center)
                 ray = Ray(angle=find_angle_of_line(self.coordinates_center, enemy.coordinates_center),
                           slope=ray_line[1], intercept=ray_line[2], is_vertical=ray_line[0], x_value=ray_line[3])
@@ -646,7 +553,7 @@ class Soldier(Entity):
                         continue
                 best_enemy = enemy
                 best_enemy_distance = distance_to_enemy
-            elif distance_to_enemy <= self.enemy_engagement_range and distance_to_enemy < best_enemy_distance:
+            elif distance_to_enemy <= enemy_engagement_range and distance_to_enemy < best_enemy_distance:
                 ray_line = find_equation_of_line(self.coordinates_center, enemy.coordinates_center)
                 ray = Ray(angle=find_angle_of_line(self.coordinates_center, enemy.coordinates_center),
                           slope=ray_line[1], intercept=ray_line[2], is_vertical=ray_line[0], x_value=ray_line[3])
@@ -662,24 +569,44 @@ class Soldier(Entity):
         if self.fire_rate_counter == self.fire_rate:
             self.shooting = True
             self.fire_rate_counter = 0
-            damage_dealt = None
-            for damage_falloff_range, damage in self.damage_falloff.items():
-                if damage_falloff_range[0] <= self.current_target_enemy_distance <= damage_falloff_range[1]:
-                    damage_dealt = damage
-            if random() <= self.aim_factor:
-                enemy.health -= damage_dealt
-                enemy.shield_recharge_delay_active = True
-                enemy.shield_recharge_delay_counter = 0
-                if enemy.health <= 0:
-                    self.kills += 1
-                    self.shooting = False
-                    self.current_target_enemy = None
-                    self.current_target_enemy_distance = None
-            self.ray_list.append((Point(enemy.coordinates_center.x, enemy.coordinates_center.y), self.original_color))
+            damage_dealt = self.archetype.get_damage(self.current_target_enemy_distance)
+            distance = self.current_target_enemy_distance
+            hit = self.rng.random() <= self.aim_factor
+            shot_buffer = globals.shot_buffer
+            projectile_speed = self.archetype.projectile_speed
+            if projectile_speed is not None and shot_buffer is not None:
+                # The projectile lands where the enemy was when it was fired, Simulation.resolve_projectiles applies the hit
+                travel_ticks = max(ceil(distance / (projectile_speed * globals.dt)), 1)
+                shot_buffer.record(PROJECTILE, self, self.coordinates_center, enemy.coordinates_center, self.original_color,
+                                   target=enemy, hit=hit, damage=damage_dealt if hit else 0, distance=distance, travel_ticks=travel_ticks)
+                return
+            killed = False
+            if hit:
+                killed = self.hit_enemy(enemy, damage_dealt)
+            if shot_buffer is not None:
+                shot_buffer.record(HITSCAN, self, self.coordinates_center, enemy.coordinates_center, self.original_color,
+                                   target=enemy, hit=hit, damage=damage_dealt if hit else 0, distance=distance, killed=killed)
+
+    def hit_enemy(self, enemy, damage):
+        """Returns whether the hit killed the enemy"""
+        enemy.health -= damage
+        enemy.shield_recharge_delay_active = True
+        enemy.shield_recharge_delay_counter = 0
+        if enemy.health <= 0:
+            self.kills += 1
+            if self.current_target_enemy is enemy:
+                self.shooting = False
+                self.current_target_enemy = None
+                self.current_target_enemy_distance = None
+            return True
+        return False
 
     def enemy_engagement_artificial_intelligence(self, enemy_list):
         if self.alive:
-            enemy_target_info = self.find_enemy_target(enemy_list)
+            if globals.precomputed_targets is not None and self.id in globals.precomputed_targets:
+                enemy_target_info = globals.precomputed_targets[self.id]
+            else:
+                enemy_target_info = self.find_enemy_target(enemy_list)
             self.current_target_enemy = enemy_target_info[0]
             self.current_target_enemy_distance = enemy_target_info[1]
             if self.current_target_enemy is not None:
@@ -702,7 +629,7 @@ class Soldier(Entity):
                 if spawn_point.faction == self.faction:
                     faction_spawn_point_list.append(spawn_point)
             if faction_spawn_point_list:
-                best_spawn_point = choice(faction_spawn_point_list)
+                best_spawn_point = self.rng.choice(faction_spawn_point_list)
             return best_spawn_point
 
     def find_best_capture_point(self):
@@ -728,7 +655,8 @@ class Soldier(Entity):
                 self.current_target_enemy = None
                 self.current_target_enemy_distance = None
                 self.destination = None
-                self.destination_queue = []
+                self.destination_queue = deque()
+                self.path_request = None
                 self.health = self.maximum_health
                 self.shield_recharge_delay_blinking_effect_counter = 0
                 self.shield_recharge_delay_counter = 0
@@ -741,23 +669,34 @@ class Soldier(Entity):
 
 class CapturePoint(Entity):
 
-    def __init__(self, win, map, id, coordinates, faction="Neutral"):
+    def __init__(self, win, map, id, coordinates, faction="Neutral", rng=None):
         if faction != "Neutral" and faction not in globals.FACTION_LIST: raise TypeError("faction has to be None or a valid faction")
         shape = "circle"
         width = 10
         neutral_color = globals.YELLOW
-        super().__init__(win, map, id, shape, width, neutral_color, coordinates)
+        super().__init__(win, map, id, shape, width, neutral_color, coordinates, rng)
         self.capture_radius = 40
         self.current_faction = faction
         self.neutral_color = neutral_color
         self.time_to_be_flipped = 100
         self.time_to_be_flipped_counter = 0
+        self.faction_counter = {"TR": 0, "NC": 0, "VS": 0, "Contested": 0}
         self.draw_radius = True
 
     def update_at_start_of_frame(self):
         super().update_at_start_of_frame()
+        profiler = globals.profiler
+        if profiler is not None:
+            profiler.start_phase("capture")
+        self.update_capture_progress()
+        if profiler is not None:
+            profiler.end_phase("capture")
+
+    def update_capture_progress(self):
         list_of_soldiers = globals.soldiers_dict.values()
         faction_counter = {"TR": 0, "NC": 0, "VS": 0, "Contested": 0}
+        # Kept for telemetry, which records how many of each faction are in the capture radius every tick
+        self.faction_counter = faction_counter
         for soldier in list_of_soldiers:
             if soldier.alive:
                 if euclidean_distance(self.coordinates_center, soldier.coordinates_center) <= self.capture_radius:
@@ -785,9 +724,14 @@ class CapturePoint(Entity):
         else:
             self.time_to_be_flipped_counter = max(self.time_to_be_flipped_counter - 1, 0)
 
-    def draw(self):
-        if self.draw_radius:
-            draw.circle(self.win, globals.WHITE, (self.coordinates_center.x, self.coordinates_center.y), self.capture_radius, width=1)
+    def draw(self, camera):
+        from pygame import draw
+        if self.draw_radius and camera.is_point_visible(self.coordinates_center.x, self.coordinates_center.y, margin=self.capture_radius):
+            draw.circle(self.win, globals.WHITE, camera.world_to_screen(self.coordinates_center.x, self.coordinates_center.y), camera.scale(self.capture_radius), width=1)
+        self.update_color()
+        super().draw(camera)
+
+    def update_color(self):
         if self.current_faction == "Neutral":
             self.color = self.neutral_color
         elif self.current_faction == "TR":
@@ -796,25 +740,24 @@ class CapturePoint(Entity):
             self.color = globals.FactionColor.NC.value
         elif self.current_faction == "VS":
             self.color = globals.FactionColor.VS.value
-        super().draw()
 
 
 class SpawnPoint(Entity):
 
-    def __init__(self, win, map, id, shape, width, color, coordinates, faction):
+    def __init__(self, win, map, id, shape, width, color, coordinates, faction, rng=None):
         if faction not in ("TR", "NC", "VS"): raise ValueError("faction has to be valid")
-        super().__init__(win, map, id, shape, width, color, coordinates)
+        super().__init__(win, map, id, shape, width, color, coordinates, rng)
         self.spawn_timer = 0
         self.faction = faction
 
 
 class Sunderer(SpawnPoint):
 
-    def __init__(self, win, map, id, coordinates, faction):
+    def __init__(self, win, map, id, coordinates, faction, rng=None):
         shape = "circle"
         width = 15
         color = globals.FactionColor[faction].value
-        super().__init__(win, map, id, shape, width, color, coordinates, faction)
+        super().__init__(win, map, id, shape, width, color, coordinates, faction, rng)
         self.spawn_timer = 2000
 
 
@@ -1,6 +1,7 @@
 """Global variables shared across all scripts"""
+import os
 from enum import Enum
-from random import random, choice, randint
+from random import Random
 
 
 # Pygame
@@ -9,6 +10,11 @@ pygame_running = False
 WIN_SIZE = WIN_WIDTH, WIN_HEIGHT = (1200, 600)
 # Frames Per Second
 FPS = 240
+# Camera
+CAMERA_MAX_ZOOM = 4
+CAMERA_MIN_GRID_SQUARE_SIZE = 3
+CAMERA_PAN_SPEED = 0.5
+CAMERA_ZOOM_STEP = 1.1
 # Color Constants
 BLACK = [0, 0, 0]
 WHITE = [255, 255, 255]
@@ -42,48 +48,75 @@ OFFSCREEN = (-1000, -1000)
 
 # Control
 paused = False
+# Profiling, a profiler.TickProfiler while profiling is on
+profiler = None
+PROFILER_FLUSH_INTERVAL = 240
+PROFILER_OVERLAY_WINDOW = 60
+PROFILES_DIRECTORY = "./Profiles/"
+# AI scheduling, an ai_scheduler.AIScheduler while soldier AI is time-sliced, None runs every soldier's AI every tick
+ai_scheduler = None
+SCHEDULE_AI = False
+AI_TARGET_TICK_MS = 16
+AI_PATH_BUDGET_MS = 4
+# Ticks between target searches of soldiers that are near, at a middle distance from and far from the closest enemy
+AI_TARGETING_INTERVALS = (1, 4, 8)
+AI_MAX_INTERVAL_SCALE = 4
+# Shared distance-to-goal fields that are repaired when walls change, a goal_field.GoalFieldCache while they are used for
+# pathfinding, None finds every path with A*
+goal_fields = None
+USE_GOAL_FIELDS = False
+MAX_GOAL_FIELDS = 16
+# Checkpoints, F5 saves the battle to the quick save checkpoint and F9 loads it
+CHECKPOINTS_DIRECTORY = "./Checkpoints/"
+QUICK_SAVE_CHECKPOINT_NAME = "quicksave.ckpt"
+# Snapshots published for a viewer in another process, entities and rays past these are not drawn
+SNAPSHOT_ENTITY_CAPACITY = 4096
+SNAPSHOT_RAY_CAPACITY = 8192
+# Telemetry, a telemetry.TelemetryRecorder while battle telemetry is being recorded
+telemetry = None
+RECORD_TELEMETRY = False
+TELEMETRY_DIRECTORY = "./Telemetry/"
+TELEMETRY_POSITION_SAMPLE_INTERVAL = 10
+TELEMETRY_CHUNK_ROWS = 65536
+# Outcomes of scenario runs cached on disk by result_cache.ResultCache, the least recently used are removed past the size limit
+RESULT_CACHE_DIRECTORY = "./Results/"
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Sweeps over several machines with distributed.py, a chunk is leased again after DISTRIBUTED_LEASE_TIMEOUT seconds without
+# a heartbeat from its worker
+DISTRIBUTED_PORT = 5757
+DISTRIBUTED_CHUNK_SIZE = 4
+DISTRIBUTED_LEASE_TIMEOUT = 30
+# Steering a running battle with control_server.py, at most CONTROL_COMMAND_BUDGET commands are applied between two ticks
+# and clients wait to send more once CONTROL_QUEUE_SIZE commands are queued
+CONTROL_PORT = 5758
+CONTROL_COMMAND_BUDGET = 16
+CONTROL_QUEUE_SIZE = 1024
+# Seed for the simulation's random number generator and randomly generated maps, None for a different battle every run
+seed = None
+# Random number generator used by entities that aren't created through a Simulation
+rng = Random()
 # Delta time a.k.a how much time passed between the current frame and last frame
 dt = 0
 
 # Map
 map_name = None
+MAPS_DIRECTORY = "./Maps/"
+MAP_CATALOG_FILE_NAME = "catalog.json"
+MAP_PREVIEW_DIRECTORY_NAME = "Previews"
+MAP_PREVIEW_MAX_WIDTH = 40
+# Width of a grid square in world coordinates, the world is ncols * CELL_SIZE by nrows * CELL_SIZE
+CELL_SIZE = 15
+# Chunked maps, for maps too big to keep in memory
+TILED_MAP_EXTENSION = "tiles"
+MAP_CHUNK_SIZE = 64
+MAP_MAX_RESIDENT_CHUNKS = 256
 MAP_BLANK = [[0 for i in range(0, 80)] for i in range(0, 40)]
-def generate_random_map(width=80, p_of_wall=0.2):
-    map_array = [[0 for i in range(0, width)] for j in range(0, width // 2)]
-    for i in range(0, len(map_array)):
-        for j in range(0, len(map_array[0])):
-            far_from_center_penalty = 0
-            closeness_to_center_factor = (abs(i - width / 4)) + (abs(j - width / 2))
-            if closeness_to_center_factor != 0:
-                closeness_to_center_factor = 1 / closeness_to_center_factor
-            if closeness_to_center_factor <= 0.01:
-                far_from_center_penalty = 0.3
-            if min(random() - max((closeness_to_center_factor), 0) + far_from_center_penalty, 1) <= p_of_wall:
-                map_array[i][j] = 1
-    for i in range(0, len(map_array)):
-        for j in range(0, len(map_array[0])):
-            if map_array[i][j] == 0:
-                if i - 1 >= 0:
-                    if map_array[i - 1][j] == 1:
-                        if j - 1 >= 0:
-                            if map_array[i][j - 1] == 1:
-                                map_array[i][j] = 1
-                                continue
-                        elif j + 1 <= len(map_array[0]) - 1:
-                            if map_array[i][j + 1] == 1:
-                                map_array[i][j] = 1
-                                continue
-                elif i + 1 <= len(map_array) - 1:
-                    if map_array[i + 1][j] == 1:
-                        if j - 1 >= 0:
-                            if map_array[i][j - 1] == 1:
-                                map_array[i][j] = 1
-                                continue
-                        elif j + 1 <= len(map_array[0]) - 1:
-                            if map_array[i][j + 1] == 1:
-                                map_array[i][j] = 1
-                                continue
-    return map_array
+def generate_random_map(width=80, p_of_wall=0.2, seed=None, style="center weighted", height=None):
+    # Imported here so that numpy is only loaded when a random map is actually needed
+    from map_generator import generate_map
+    if height is None:
+        height = width // 2
+    return generate_map(nrows=height, ncols=width, style=style, seed=seed, p_of_wall=p_of_wall).tolist()
 
 # Map Creator
 save_map = False
@@ -97,12 +130,31 @@ class FactionColor(Enum):
 FACTION_LIST = ["NC", "TR", "VS"]
 
 # Weapons
+# Soldiers created at random pick one of these archetypes, the archetypes file can define more
 WEAPON_TYPES = ["short range", "med range", "long range"]
+# Archetypes compiled from the archetypes file, {name: archetypes.Archetype}, loaded when the first soldier is created
+archetypes = None
+ARCHETYPES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "archetypes.json")
+
+# Soldier separation, a neighbor_grid.NeighborGrid of the living soldiers while SEPARATE_SOLDIERS is on, None lets
+# soldiers walk through each other
+neighbor_grid = None
+SEPARATE_SOLDIERS = True
+SOLDIER_SEPARATION_RADIUS = 10
+# Largest push away from neighbors as a fraction of a soldier's step
+SOLDIER_SEPARATION_STRENGTH = 0.5
+# Slowest a soldier walks behind another one going the same way, as a fraction of its speed
+SOLDIER_MINIMUM_QUEUE_SPEED_FACTOR = 0.2
+# Shots, a shot_buffer.ShotBuffer every Simulation records its shots and rays into
+shot_buffer = None
+SHOT_BUFFER_CAPACITY = 65536
 
 # Entities
 entity_list = []
 # Soldiers
 soldiers_dict = {}
+# Format: {soldier id: (target enemy, distance)}, set by partitioned_simulation while targets are found in worker processes
+precomputed_targets = None
 next_soldiers_dict_key = 0
 soldiers_being_added = False
 number_of_TR_to_add = 0
@@ -0,0 +1,170 @@
+"""Distance-to-goal fields kept up to date with LPA* as walls change, so soldiers heading to the same goal share one search
+and a wall edit only repairs the part of the field it affects instead of every soldier planning again from scratch"""
+import heapq
+from collections import OrderedDict
+from math import sqrt, inf
+import globals
+from utility import *
+
+
+class GoalDistanceField:
+    """Cost of the cheapest path from every grid square to the goal, with the same moves and costs as pathfinding.AStarSearch.
+    It is a backwards LPA* search without a heuristic: g is the settled cost, rhs the cost from the neighbors' g values,
+    and squares where they differ wait in the queue to be settled"""
+
+    def __init__(self, map, goal, enable_collisions=True):
+        self.map = map
+        self.goal = goal
+        self.enable_collisions = enable_collisions
+        self.distance_to_edge_neighbor = map.grid_width
+        self.distance_to_corner_neighbor = sqrt(2 * (abs(map.grid_width) ** 2))
+        self.g = [[inf] * map.ncols for i in range(0, map.nrows)]
+        self.rhs = [[inf] * map.ncols for i in range(0, map.nrows)]
+        # Format: (key, square), entries whose key is no longer the square's queued key are skipped
+        self.queue = []
+        self.queued_keys = {}
+        self.rhs[goal[0]][goal[1]] = 0
+        self.queue_square(goal)
+        self.squares_settled = 0
+        self.compute_shortest_paths()
+
+    def get_move_cost(self, square, neighbor):
+        """Cost of moving from square to a neighboring square, inf if the move is blocked"""
+        if not 0 <= neighbor[0] < self.map.nrows or not 0 <= neighbor[1] < self.map.ncols:
+            return inf
+        is_corner_move = square[0] != neighbor[0] and square[1] != neighbor[1]
+        if self.enable_collisions:
+            map_array = self.map.map_array
+            if map_array[neighbor[0]][neighbor[1]] == 1:
+                return inf
+            # This is to prevent movement diagonally through two touching wall's corners
+            if is_corner_move and map_array[square[0]][neighbor[1]] == 1 and map_array[neighbor[0]][square[1]] == 1:
+                return inf
+        return self.distance_to_corner_neighbor if is_corner_move else self.distance_to_edge_neighbor
+
+    def get_neighbors(self, square):
+        return self.map.get_neighboring_corner_grid_positions(square) + self.map.get_neighboring_edge_grid_positions(square)
+
+    def queue_square(self, square):
+        key = min(self.g[square[0]][square[1]], self.rhs[square[0]][square[1]])
+        self.queued_keys[square] = key
+        heapq.heappush(self.queue, (key, square))
+
+    def update_square(self, square):
+        row, col = square
+        if square != self.goal:
+            rhs = inf
+            for neighbor in self.get_neighbors(square):
+                move_cost = self.get_move_cost(square, neighbor)
+                if move_cost != inf:
+                    rhs = min(rhs, move_cost + self.g[neighbor[0]][neighbor[1]])
+            self.rhs[row][col] = rhs
+        self.queued_keys.pop(square, None)
+        if self.g[row][col] != self.rhs[row][col]:
+            self.queue_square(square)
+
+    def compute_shortest_paths(self):
+        while self.queue:
+            key, square = heapq.heappop(self.queue)
+            if self.queued_keys.get(square) != key:
+                continue
+            del self.queued_keys[square]
+            row, col = square
+            self.squares_settled += 1
+            if self.g[row][col] > self.rhs[row][col]:
+                self.g[row][col] = self.rhs[row][col]
+            else:
+                self.g[row][col] = inf
+                self.update_square(square)
+            # Moves are symmetric apart from the wall check on the square moved into, so the neighbors are the
+            # squares whose rhs can depend on this one
+            for neighbor in self.get_neighbors(square):
+                if 0 <= neighbor[0] < self.map.nrows and 0 <= neighbor[1] < self.map.ncols:
+                    self.update_square(neighbor)
+
+    def update_cell(self, row, col):
+        """Repairs the field after the cell changed. Every move whose cost depends on the cell starts and ends within
+        the 3x3 block around it, so only those squares need their rhs recomputed"""
+        for neighbor_row in range(row - 1, row + 2):
+            for neighbor_col in range(col - 1, col + 2):
+                if 0 <= neighbor_row < self.map.nrows and 0 <= neighbor_col < self.map.ncols:
+                    self.update_square((neighbor_row, neighbor_col))
+        self.compute_shortest_paths()
+
+    def get_distance(self, square):
+        return self.g[square[0]][square[1]]
+
+    def get_path(self, start):
+        """Grid positions from the goal back to the start like pathfinding.AStarSearch.path, None if the goal can't be reached"""
+        if self.get_distance(start) == inf:
+            return None
+        path = [start]
+        square = start
+        while square != self.goal:
+            best_neighbor = None
+            best_cost = inf
+            for neighbor in self.get_neighbors(square):
+                move_cost = self.get_move_cost(square, neighbor)
+                if move_cost != inf and move_cost + self.g[neighbor[0]][neighbor[1]] < best_cost:
+                    best_neighbor = neighbor
+                    best_cost = move_cost + self.g[neighbor[0]][neighbor[1]]
+            if best_neighbor is None or len(path) > self.map.nrows * self.map.ncols:
+                return None
+            path.append(best_neighbor)
+            square = best_neighbor
+        path.reverse()
+        return path
+
+    def get_path_points(self, start):
+        path = self.get_path(start)
+        if path is None:
+            return None
+        half_grid_width = self.map.grid_width / 2
+        return [Point(self.map.grid_coordinates[row][col][0] + half_grid_width, self.map.grid_coordinates[row][col][1] + half_grid_width)
+                for row, col in path]
+
+
+class GoalFieldCache:
+    """Keeps the fields of the most recently used goals and repairs all of them when the map changes"""
+
+    def __init__(self, map, max_fields=None):
+        if max_fields is None:
+            max_fields = globals.MAX_GOAL_FIELDS
+        if not isinstance(max_fields, int) or max_fields <= 0: raise ValueError("max_fields has to be a positive int")
+        self.map = map
+        self.max_fields = max_fields
+        # Format: {(goal, enable_collisions): GoalDistanceField}, least recently used first
+        self.fields = OrderedDict()
+        self.map.add_change_listener(self.on_map_cell_changed)
+
+    def get_field(self, goal, enable_collisions=True):
+        field_key = (goal, enable_collisions)
+        field = self.fields.get(field_key)
+        if field is not None:
+            self.fields.move_to_end(field_key)
+            return field
+        field = GoalDistanceField(self.map, goal, enable_collisions)
+        self.fields[field_key] = field
+        while len(self.fields) > self.max_fields:
+            self.fields.popitem(last=False)
+        return field
+
+    def on_map_cell_changed(self, row, col, old_value, new_value):
+        for field in self.fields.values():
+            field.update_cell(row, col)
+
+    def close(self):
+        self.map.remove_change_listener(self.on_map_cell_changed)
+        self.fields.clear()
+
+
+def enable_goal_fields(map, max_fields=None):
+    disable_goal_fields()
+    globals.goal_fields = GoalFieldCache(map, max_fields)
+    return globals.goal_fields
+
+
+def disable_goal_fields():
+    if globals.goal_fields is not None:
+        globals.goal_fields.close()
+        globals.goal_fields = None
@@ -1,30 +1,59 @@
-from pygame import Surface, draw
+from math import ceil
 import globals
 from utility import *
+from chunked_map import ChunkedMapStorage, ChunkedMapArray, GridCoordinates
 
 
 class Map:
 
-    def __init__(self, win, map_array, wall_color):
-        if not isinstance(win, Surface): raise TypeError("win has to be a Surface object")
+    def __init__(self, win, map_array, wall_color, cell_size=None):
+        # Headless battles have no Surface to draw on, checked by duck typing so that pygame is only imported to draw
+        if win is not None and not hasattr(win, "blit"): raise TypeError("win has to be a Surface object or None")
         if not is_rgb_color_value(wall_color): raise TypeError("Wall color has to be an RGB color tuple")
-        self.validate_map(map_array)
+        if cell_size is None:
+            cell_size = globals.CELL_SIZE
+        if not isinstance(cell_size, int) or cell_size <= 0: raise ValueError("cell_size has to be a positive int")
+        # Chunked maps are validated when their tiled file is written, validating here would load every chunk
+        self.is_chunked = isinstance(map_array, ChunkedMapArray)
+        if not self.is_chunked:
+            self.validate_map(map_array)
         self.win = win
-        self.grid_width = globals.WIN_WIDTH // len(map_array[0])
+        self.grid_width = cell_size
         self.map_array = map_array
         self.nrows = len(self.map_array)
         self.ncols = len(self.map_array[0])
-        self.empty_squares = []
-        for i in range(0, self.nrows - 1):
-            for j in range(0, self.ncols - 1):
-                if self.map_array[i][j] == 0:
-                    self.empty_squares.append((i, j))
-        self.grid_coordinates = [[(0, 0) for j in range(0, self.ncols)] for i in range(0, self.nrows)]
+        # Size of the world in world coordinates, which is independent of the window size
+        self.world_width = self.ncols * self.grid_width
+        self.world_height = self.nrows * self.grid_width
+        self._empty_squares = None
+        if self.is_chunked:
+            self.grid_coordinates = GridCoordinates(self.nrows, self.grid_width)
+        else:
+            self.grid_coordinates = [[(0, 0) for j in range(0, self.ncols)] for i in range(0, self.nrows)]
         self.grid_column_x_values = []
         self.grid_row_y_values = []
         self.get_gridline_coordinates()
         self.wall_color = wall_color
         self.show_gridlines = True
+        # Functions called with (row, col, old value, new value) whenever set_cell changes a cell
+        self.change_listeners = []
+
+    @classmethod
+    def from_tiled_file(cls, win, path, wall_color, cell_size=None, max_resident_chunks=None):
+        storage = ChunkedMapStorage(path, max_resident_chunks=max_resident_chunks)
+        return cls(win=win, map_array=ChunkedMapArray(storage), wall_color=wall_color, cell_size=cell_size)
+
+    @property
+    def empty_squares(self):
+        """Computed on first use since most maps never need it and it is a list of every empty square"""
+        if self._empty_squares is None:
+            self._empty_squares = []
+            for i in range(0, self.nrows - 1):
+                map_row = self.map_array[i]
+                for j in range(0, self.ncols - 1):
+                    if map_row[j] == 0:
+                        self._empty_squares.append((i, j))
+        return self._empty_squares
 
     def validate_map(self, map_array):
         valid_values = (0, 1)
@@ -32,8 +61,6 @@ class Map:
             raise ValueError("Map array has to be a list or tuple")
         if len(set([len(i) for i in map_array])) != 1:
             raise ValueError("Each row has to be the same length in the map array")
-        if len(map_array) * 2 != len(map_array[0]):
-            raise ValueError("The number of rows has to be half the number of columns")
         for i in map_array:
             if not isinstance(i, list) and not isinstance(i, tuple):
                 raise ValueError("Each row has to be a list or tuple in the map array")
@@ -42,20 +69,237 @@ class Map:
                     raise ValueError(f"Each value in the map array must be in {valid_values}")
 
     def get_gridline_coordinates(self):
-        current_x = 0
-        current_y = 0
-        for i in range(0, self.nrows):
-            for j in range(0, self.ncols):
-                self.grid_coordinates[i][j] = (current_x, current_y)
-                current_x += self.grid_width
-            current_x = 0
-            current_y += self.grid_width
-        for row in self.grid_coordinates:
-            for c in row:
-                self.grid_column_x_values.append(c[0])
-                self.grid_row_y_values.append(c[1])
-        self.grid_column_x_values = sorted(list(set(self.grid_column_x_values)))
-        self.grid_row_y_values = sorted(list(set(self.grid_row_y_values)))
+        if not self.is_chunked:
+            for i in range(0, self.nrows):
+                for j in range(0, self.ncols):
+                    self.grid_coordinates[i][j] = (j * self.grid_width, i * self.grid_width)
+        self.grid_column_x_values = [j * self.grid_width for j in range(0, self.ncols)]
+        self.grid_row_y_values = [i * self.grid_width for i in range(0, self.nrows)]
+
+    def trace_ray(self, origin, grid_position, ray, end_grid_position=None):
+        """Walks the grid squares the ray passes through from origin, which is in grid_position, and returns where it first hits a wall.
+        With end_grid_position the walk stops at that square and returns None if no wall was hit before it, for segments"""
+        if not isinstance(ray, Ray): raise ValueError("ray has to be a Ray object")
+        current_grid_row_index = grid_position[0]
+        current_grid_col_index = grid_position[1]
+        if self.grid_coordinates[current_grid_row_index][current_grid_col_index] == 1:
+            return origin.get_coordinates()
+        # If line goes straight up then search grid squares straight above for walls and collide with first one encountered on its bottom line
+        if ray.angle == 0:
+            if current_grid_row_index == 0:
+                return None
+            last_row_index = 0 if end_grid_position is None else end_grid_position[0]
+            for row_index in range(current_grid_row_index - 1, last_row_index - 1, -1):
+                if self.map_array[row_index][current_grid_col_index] == 1:
+                    return Point(origin.x, self.grid_coordinates[row_index][current_grid_col_index][1] + self.grid_width)
+            return None
+        elif ray.angle == 180:
+            if current_grid_row_index == self.nrows - 1:
+                return None
+            last_row_index = self.nrows - 1 if end_grid_position is None else end_grid_position[0]
+            for row_index in range(current_grid_row_index + 1, last_row_index + 1):
+                if self.map_array[row_index][current_grid_col_index] == 1:
+                    return Point(origin.x, self.grid_coordinates[row_index][current_grid_col_index][1])
+            return None
+        elif ray.angle == 90:
+            if current_grid_col_index == self.ncols - 1:
+                return None
+            last_col_index = self.ncols - 1 if end_grid_position is None else end_grid_position[1]
+            for col_index in range(current_grid_col_index + 1, last_col_index + 1):
+                if self.map_array[current_grid_row_index][col_index] == 1:
+                    return Point(self.grid_coordinates[current_grid_row_index][col_index][0], origin.y)
+            return None
+        elif ray.angle == 270:
+            if current_grid_col_index == 0:
+                return None
+            last_col_index = 0 if end_grid_position is None else end_grid_position[1]
+            for col_index in range(current_grid_col_index - 1, last_col_index - 1, -1):
+                if self.map_array[current_grid_row_index][col_index] == 1:
+                    return Point(self.grid_coordinates[current_grid_row_index][col_index][0] + self.grid_width, origin.y)
+            return None
+        elif 0 < ray.angle < 90:
+            while current_grid_row_index != -1 and current_grid_col_index != self.ncols:
+                if (current_grid_row_index, current_grid_col_index) == end_grid_position:
+                    return None
+                if current_grid_row_index == 0 and current_grid_col_index == self.ncols - 1:
+                    return None
+                elif current_grid_col_index != self.ncols - 1:
+                    grid_square_to_the_right_coordinates = self.grid_coordinates[current_grid_row_index][current_grid_col_index + 1]
+                    y_value_of_ray_at_x_value_of_grid_square_to_the_right = ray.slope * grid_square_to_the_right_coordinates[0] + ray.intercept
+                    # If it intersects
+                    if grid_square_to_the_right_coordinates[1] <= y_value_of_ray_at_x_value_of_grid_square_to_the_right <= grid_square_to_the_right_coordinates[1] + self.grid_width:
+                        current_grid_col_index += 1
+                        if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                            left_edge_of_grid_square_line = Line(slope=0, intercept=0, is_vertical=True, x_value=grid_square_to_the_right_coordinates[0])
+                            return get_intersection_point_of_lines(ray, left_edge_of_grid_square_line)
+                    # Else it must mean that it intersects with the bottom edge of the grid square above
+                    else:
+                        if current_grid_row_index == 0:
+                            return None
+                        else:
+                            grid_square_above_coordinates = self.grid_coordinates[current_grid_row_index - 1][current_grid_col_index]
+                            current_grid_row_index -= 1
+                            if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                                bottom_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_above_coordinates[1] + self.grid_width, is_vertical=False)
+                                return get_intersection_point_of_lines(ray, bottom_edge_of_grid_square_line)
+                else:
+                    grid_square_above_coordinates = self.grid_coordinates[current_grid_row_index - 1][current_grid_col_index]
+                    x_value_of_ray_at_y_value_of_grid_square_above = (grid_square_above_coordinates[1] + self.grid_width - ray.intercept) / ray.slope
+                    # If it intersects
+                    if grid_square_above_coordinates[0] <= x_value_of_ray_at_y_value_of_grid_square_above <= grid_square_above_coordinates[0] + self.grid_width:
+                        current_grid_row_index -= 1
+                        if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                            bottom_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_above_coordinates[1] + self.grid_width, is_vertical=False)
+                            return get_intersection_point_of_lines(ray, bottom_edge_of_grid_square_line)
+                    else:
+                        return None
+        elif 90 < ray.angle < 180:
+            while current_grid_row_index != self.nrows and current_grid_col_index != self.ncols:
+                if (current_grid_row_index, current_grid_col_index) == end_grid_position:
+                    return None
+                if current_grid_row_index == self.nrows - 1 and current_grid_col_index == self.ncols - 1:
+                    return None
+                elif current_grid_col_index != self.ncols - 1:
+                    grid_square_to_the_right_coordinates = self.grid_coordinates[current_grid_row_index][current_grid_col_index + 1]
+                    y_value_of_ray_at_x_value_of_grid_square_to_the_right = ray.slope * grid_square_to_the_right_coordinates[0] + ray.intercept
+                    # If it intersects
+                    if grid_square_to_the_right_coordinates[1] <= y_value_of_ray_at_x_value_of_grid_square_to_the_right <= grid_square_to_the_right_coordinates[1] + self.grid_width:
+                        current_grid_col_index += 1
+                        if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                            left_edge_of_grid_square_line = Line(slope=0, intercept=0, is_vertical=True, x_value=grid_square_to_the_right_coordinates[0])
+                            return get_intersection_point_of_lines(ray, left_edge_of_grid_square_line)
+                    # Else it must mean that it intersects with the top edge of the grid square below
+                    else:
+                        if current_grid_row_index == self.nrows - 1:
+                            return None
+                        else:
+                            grid_square_below_coordinates = self.grid_coordinates[current_grid_row_index + 1][current_grid_col_index]
+                            current_grid_row_index += 1
+                            if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                                top_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_below_coordinates[1], is_vertical=False)
+                                return get_intersection_point_of_lines(ray, top_edge_of_grid_square_line)
+                else:
+                    grid_square_below_coordinates = self.grid_coordinates[current_grid_row_index + 1][current_grid_col_index]
+                    x_value_of_ray_at_y_value_of_grid_square_below = (grid_square_below_coordinates[1] - ray.intercept) / ray.slope
+                    # If it intersects
+                    if grid_square_below_coordinates[0] <= x_value_of_ray_at_y_value_of_grid_square_below <= grid_square_below_coordinates[0] + self.grid_width:
+                        current_grid_row_index += 1
+                        if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                            top_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_below_coordinates[1], is_vertical=False)
+                            return get_intersection_point_of_lines(ray, top_edge_of_grid_square_line)
+                    else:
+                        return None
+        elif 180 < ray.angle < 270:
+            while current_grid_row_index != self.nrows and current_grid_col_index != -1:
+                if (current_grid_row_index, current_grid_col_index) == end_grid_position:
+                    return None
+                if current_grid_row_index == self.nrows - 1 and current_grid_col_index == 0:
+                    return None
+                elif current_grid_col_index != 0:
+                    grid_square_to_the_left_coordinates = self.grid_coordinates[current_grid_row_index][current_grid_col_index - 1]
+                    y_value_of_ray_at_x_value_of_grid_square_to_the_left = ray.slope * (grid_square_to_the_left_coordinates[0] + self.grid_width) + ray.intercept
+                    # If it intersects
+                    if grid_square_to_the_left_coordinates[1] <= y_value_of_ray_at_x_value_of_grid_square_to_the_left <= grid_square_to_the_left_coordinates[1] + self.grid_width:
+                        current_grid_col_index -= 1
+                        if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                            right_edge_of_grid_square_line = Line(slope=0, intercept=0, is_vertical=True, x_value=grid_square_to_the_left_coordinates[0] + self.grid_width)
+                            return get_intersection_point_of_lines(ray, right_edge_of_grid_square_line)
+                    # Else it must mean that it intersects with the top edge of the grid square below
+                    else:
+                        if current_grid_row_index == self.nrows - 1:
+                            return None
+                        else:
+                            grid_square_below_coordinates = self.grid_coordinates[current_grid_row_index + 1][current_grid_col_index]
+                            current_grid_row_index += 1
+                            if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                                top_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_below_coordinates[1], is_vertical=False)
+                                return get_intersection_point_of_lines(ray, top_edge_of_grid_square_line)
+                else:
+                    grid_square_below_coordinates = self.grid_coordinates[current_grid_row_index + 1][current_grid_col_index]
+                    x_value_of_ray_at_y_value_of_grid_square_below = (grid_square_below_coordinates[1] - ray.intercept) / ray.slope
+                    # If it intersects
+                    if grid_square_below_coordinates[0] <= x_value_of_ray_at_y_value_of_grid_square_below <= grid_square_below_coordinates[0] + self.grid_width:
+                        current_grid_row_index += 1
+                        if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                            top_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_below_coordinates[1], is_vertical=False)
+                            return get_intersection_point_of_lines(ray, top_edge_of_grid_square_line)
+                    else:
+                        return None
+        elif ray.angle > 270:
+            while current_grid_row_index != -1 and current_grid_col_index != -1:
+                if (current_grid_row_index, current_grid_col_index) == end_grid_position:
+                    return None
+                if current_grid_row_index == 0 and current_grid_col_index == 0:
+                    return None
+                elif current_grid_col_index != 0:
+                    grid_square_to_the_left_coordinates = self.grid_coordinates[current_grid_row_index][current_grid_col_index - 1]
+                    y_value_of_ray_at_x_value_of_grid_square_to_the_left = ray.slope * (grid_square_to_the_left_coordinates[0] + self.grid_width) + ray.intercept
+                    # If it intersects
+                    if grid_square_to_the_left_coordinates[1] <= y_value_of_ray_at_x_value_of_grid_square_to_the_left <= grid_square_to_the_left_coordinates[1] + self.grid_width:
+                        current_grid_col_index -= 1
+                        if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                            right_edge_of_grid_square_line = Line(slope=0, intercept=0, is_vertical=True, x_value=grid_square_to_the_left_coordinates[0] + self.grid_width)
+                            return get_intersection_point_of_lines(ray, right_edge_of_grid_square_line)
+                    # Else it must mean that it intersects with the bottom edge of the grid square above
+                    else:
+                        if current_grid_row_index == 0:
+                            return None
+                        else:
+                            grid_square_above_coordinates = self.grid_coordinates[current_grid_row_index - 1][current_grid_col_index]
+                            current_grid_row_index -= 1
+                            if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                                bottom_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_above_coordinates[1] + self.grid_width, is_vertical=False)
+                                return get_intersection_point_of_lines(ray, bottom_edge_of_grid_square_line)
+                else:
+                    grid_square_above_coordinates = self.grid_coordinates[current_grid_row_index - 1][current_grid_col_index]
+                    x_value_of_ray_at_y_value_of_grid_square_above = (grid_square_above_coordinates[1] + self.grid_width - ray.intercept) / ray.slope
+                    # If it intersects
+                    if grid_square_above_coordinates[0] <= x_value_of_ray_at_y_value_of_grid_square_above <= grid_square_above_coordinates[0] + self.grid_width:
+                        current_grid_row_index -= 1
+                        if self.map_array[current_grid_row_index][current_grid_col_index] == 1:
+                            bottom_edge_of_grid_square_line = Line(slope=0, intercept=grid_square_above_coordinates[1] + self.grid_width, is_vertical=False)
+                            return get_intersection_point_of_lines(ray, bottom_edge_of_grid_square_line)
+                    else:
+                        return None
+
+    def has_line_of_sight(self, p1, p2):
+        """Whether the straight line between the points doesn't go through a wall. The ray is traced from both ends because
+        a ray passing exactly through a corner only checks one of the squares touching it. The rays stop at the other end's
+        square, walls past it can't be in the way"""
+        p1_grid_position = self.get_grid_position_of_point(p1)
+        p2_grid_position = self.get_grid_position_of_point(p2)
+        for origin, origin_grid_position, end, end_grid_position in ((p1, p1_grid_position, p2, p2_grid_position),
+                                                                    (p2, p2_grid_position, p1, p1_grid_position)):
+            line = find_equation_of_line(origin, end)
+            ray = Ray(angle=find_angle_of_line(origin, end), slope=line[1], intercept=line[2], is_vertical=line[0], x_value=line[3])
+            collision_point = self.trace_ray(origin, origin_grid_position, ray, end_grid_position)
+            if collision_point is not None and euclidean_distance(origin, collision_point) < euclidean_distance(origin, end):
+                return False
+        return True
+
+    def set_cell(self, row, col, value):
+        """Changes one cell and tells the change listeners, so paths and anything else derived from the map can be updated"""
+        if value not in (0, 1): raise ValueError("Each value in the map array must be in (0, 1)")
+        if not 0 <= row < self.nrows or not 0 <= col < self.ncols: raise ValueError("row and col have to be inside the map")
+        old_value = self.map_array[row][col]
+        if old_value == value:
+            return
+        self.map_array[row][col] = value
+        self._empty_squares = None
+        for change_listener in self.change_listeners:
+            change_listener(row, col, old_value, value)
+
+    def add_change_listener(self, change_listener):
+        self.change_listeners.append(change_listener)
+
+    def remove_change_listener(self, change_listener):
+        if change_listener in self.change_listeners:
+            self.change_listeners.remove(change_listener)
+
+    def pin_chunks_at_points(self, points):
+        """Keeps the chunks under the given points (living soldiers, capture points) from being evicted"""
+        if self.is_chunked:
+            self.map_array.storage.set_pinned_grid_positions([self.get_grid_position_of_point(point) for point in points])
 
     def get_grid_position_of_point(self, point):
         if not isinstance(point, Point): raise ValueError("point has to be a Point object")
@@ -70,6 +314,9 @@ class Map:
             row_index -= 1
         return row_index, column_index
 
+    def is_point_in_world(self, point):
+        return 0 <= point.x < self.world_width and 0 <= point.y < self.world_height
+
     def get_neighboring_grid_positions(self, grid_position):
         adjacent_grid_coordinates = ((grid_position[0] - 1, grid_position[1] - 1),
                                      (grid_position[0] - 1, grid_position[1]),
@@ -95,27 +342,34 @@ class Map:
                                      (grid_position[0] + 1, grid_position[1]))
         return adjacent_grid_coordinates
 
-    def draw_gridlines(self):
-        current_x = 0
-        current_y = 0
+    def draw_gridlines(self, camera):
+        from pygame import draw
+        # Gridlines would cover the whole window when zoomed far out
+        if camera.scale(self.grid_width) < 4:
+            return
+        first_row, last_row, first_col, last_col = camera.get_visible_grid_range(self)
+        top = camera.world_to_screen(0, first_row * self.grid_width)[1]
+        bottom = camera.world_to_screen(0, last_row * self.grid_width)[1]
+        left = camera.world_to_screen(first_col * self.grid_width, 0)[0]
+        right = camera.world_to_screen(last_col * self.grid_width, 0)[0]
         # Verical lines
-        for i in range(0, self.ncols):
-            draw.line(self.win, globals.GREY, (current_x, current_y), (current_x, current_y + globals.WIN_HEIGHT), width=1)
-            current_x += self.grid_width
+        for col in range(first_col, last_col + 1):
+            x = camera.world_to_screen(col * self.grid_width, 0)[0]
+            draw.line(self.win, globals.GREY, (x, top), (x, bottom), width=1)
         # Horizontal lines
-        current_x = 0
-        for i in range(0, self.nrows):
-            draw.line(self.win, globals.GREY, (current_x, current_y), (current_x + globals.WIN_WIDTH, current_y), width=1)
-            current_y += self.grid_width
-
-    def draw(self):
-        current_x = 0
-        current_y = 0
-        for row in self.map_array:
-            for value in row:
-                if value == 1:
-                    draw.rect(self.win, self.wall_color, (current_x, current_y, self.grid_width, self.grid_width))
-                current_x += self.grid_width
-            current_x = 0
-            current_y += self.grid_width
+        for row in range(first_row, last_row + 1):
+            y = camera.world_to_screen(0, row * self.grid_width)[1]
+            draw.line(self.win, globals.GREY, (left, y), (right, y), width=1)
 
+    def draw(self, camera):
+        """Only draws the walls inside the camera's view so the cost doesn't grow with the size of the world"""
+        from pygame import draw
+        first_row, last_row, first_col, last_col = camera.get_visible_grid_range(self)
+        # Rounded up so that neighboring walls don't leave gaps between them when zoomed
+        screen_grid_width = ceil(camera.scale(self.grid_width))
+        for row in range(first_row, last_row):
+            map_row = self.map_array[row]
+            for col in range(first_col, last_col):
+                if map_row[col] == 1:
+                    screen_x, screen_y = camera.world_to_screen(col * self.grid_width, row * self.grid_width)
+                    draw.rect(self.win, self.wall_color, (screen_x, screen_y, screen_grid_width, screen_grid_width))
@@ -0,0 +1,205 @@
+"""Index of saved maps with cached metadata and preview thumbnails so maps can be listed without unpickling them"""
+import os
+import json
+import hashlib
+import threading
+import _pickle
+import numpy as np
+import globals
+from chunked_map import ChunkedMapStorage, ChunkedMapArray
+
+
+class MapCatalog:
+
+    def __init__(self, maps_directory=globals.MAPS_DIRECTORY, index_file_name=globals.MAP_CATALOG_FILE_NAME,
+                 preview_directory_name=globals.MAP_PREVIEW_DIRECTORY_NAME, preview_max_width=globals.MAP_PREVIEW_MAX_WIDTH):
+        if not isinstance(preview_max_width, int) or preview_max_width <= 0: raise ValueError("preview_max_width has to be a positive int")
+        self.maps_directory = maps_directory
+        self.index_path = os.path.join(maps_directory, index_file_name)
+        self.preview_directory = os.path.join(maps_directory, preview_directory_name)
+        self.preview_max_width = preview_max_width
+        # Format: {map_name: {"file_name", "file_size", "mtime_ns", "checksum", "nrows", "ncols", "wall_density", "preview"}}
+        self.entries = {}
+        self.loaded = False
+        # The map creator saves from the pygame thread while tkinter reads from the main thread
+        self.lock = threading.Lock()
+
+    def load(self):
+        self.entries = {}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    self.entries = json.load(f)
+            except (ValueError, OSError):
+                # A corrupt index is only a cache, it gets rebuilt by refresh()
+                self.entries = {}
+        self.loaded = True
+
+    def save(self):
+        temporary_index_path = self.index_path + ".tmp"
+        with open(temporary_index_path, "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(temporary_index_path, self.index_path)
+
+    def refresh(self):
+        """Bring the index in line with the Maps directory, only re-reading map files whose size or modification time changed"""
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            changed = False
+            map_names_on_disk = set()
+            for file in os.listdir(self.maps_directory):
+                map_name, extension = os.path.splitext(file)
+                if extension not in (".txt", f".{globals.TILED_MAP_EXTENSION}"):
+                    continue
+                map_names_on_disk.add(map_name)
+                file_stat = os.stat(os.path.join(self.maps_directory, file))
+                entry = self.entries.get(map_name)
+                if entry is not None and entry.get("file_name") == file and entry["file_size"] == file_stat.st_size and entry["mtime_ns"] == file_stat.st_mtime_ns:
+                    continue
+                try:
+                    if extension == ".txt":
+                        with open(os.path.join(self.maps_directory, file), "rb") as f:
+                            map_array = _pickle.load(f)
+                        self.entries[map_name] = self.build_entry(map_name, map_array, file)
+                    else:
+                        # Tiled maps are streamed chunk by chunk through the LRU instead of being loaded whole
+                        storage = ChunkedMapStorage(os.path.join(self.maps_directory, file))
+                        self.entries[map_name] = self.build_entry(map_name, ChunkedMapArray(storage), file)
+                        storage.close()
+                except Exception:
+                    # Not a map, leave it out of the catalog
+                    self.entries.pop(map_name, None)
+                changed = True
+            for map_name in list(self.entries.keys()):
+                if map_name not in map_names_on_disk:
+                    self.remove_preview(self.entries.pop(map_name))
+                    changed = True
+            if changed:
+                self.save()
+
+    def update_map(self, map_name, map_array, file_name=None):
+        """Called right after a map file is written so the catalog stays current without a rescan"""
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            self.entries[map_name] = self.build_entry(map_name, map_array, file_name)
+            self.save()
+
+    def build_entry(self, map_name, map_array, file_name=None):
+        if file_name is None:
+            file_name = f"{map_name}.txt"
+        map_path = os.path.join(self.maps_directory, file_name)
+        file_stat = os.stat(map_path)
+        nrows = len(map_array)
+        ncols = len(map_array[0])
+        block_walls = self.count_block_walls(map_array, self.get_preview_block_size(ncols))
+        number_of_walls = int(block_walls.sum())
+        preview_file_name = self.write_preview(map_name, block_walls, nrows, ncols)
+        return {"file_name": file_name,
+                "file_size": file_stat.st_size,
+                "mtime_ns": file_stat.st_mtime_ns,
+                "checksum": self.calculate_checksum(map_path),
+                "nrows": nrows,
+                "ncols": ncols,
+                "wall_density": number_of_walls / (nrows * ncols),
+                "preview": preview_file_name}
+
+    def calculate_checksum(self, map_path):
+        sha256 = hashlib.sha256()
+        with open(map_path, "rb") as f:
+            for block in iter(lambda: f.read(65536), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def get_preview_block_size(self, ncols):
+        return max(1, -(-ncols // self.preview_max_width))
+
+    def count_block_walls(self, map_array, block_size):
+        """Returns the number of walls in every block_size x block_size block of the map as a 2D NumPy array.
+        Tiled maps are counted from the raw bytes of one chunk at a time instead of cell by cell through the LRU"""
+        nrows = len(map_array)
+        ncols = len(map_array[0])
+        preview_width = -(-ncols // block_size)
+        preview_height = -(-nrows // block_size)
+        if isinstance(map_array, ChunkedMapArray):
+            storage = map_array.storage
+            chunk_size = storage.chunk_size
+            block_walls = np.zeros(preview_height * preview_width, dtype=np.int64)
+            for chunk_row in range(0, storage.nchunk_rows):
+                rows = np.arange(chunk_row * chunk_size, min((chunk_row + 1) * chunk_size, nrows))
+                for chunk_col in range(0, storage.nchunk_cols):
+                    cols = np.arange(chunk_col * chunk_size, min((chunk_col + 1) * chunk_size, ncols))
+                    chunk = np.frombuffer(storage.read_chunk_bytes((chunk_row, chunk_col)), dtype=np.uint8).reshape(chunk_size, chunk_size)
+                    # Edge chunks are padded with walls that aren't part of the map
+                    cells = chunk[:len(rows), :len(cols)]
+                    block_indices = (rows[:, None] // block_size) * preview_width + cols[None, :] // block_size
+                    block_walls += np.bincount(block_indices.ravel(), weights=cells.ravel(), minlength=block_walls.size).astype(np.int64)
+            return block_walls.reshape(preview_height, preview_width)
+        cells = np.zeros((preview_height * block_size, preview_width * block_size), dtype=np.int64)
+        cells[:nrows, :ncols] = np.asarray(map_array, dtype=np.int64)
+        return cells.reshape(preview_height, block_size, preview_width, block_size).sum(axis=(1, 3))
+
+    def write_preview(self, map_name, block_walls, nrows, ncols):
+        """Writes the block wall counts as a greyscale PGM image where each pixel is the wall density of a block of cells"""
+        block_size = self.get_preview_block_size(ncols)
+        preview_height, preview_width = block_walls.shape
+        # Blocks on the bottom and right edges can be smaller than block_size
+        block_heights = np.minimum(block_size, nrows - np.arange(0, preview_height) * block_size)
+        block_widths = np.minimum(block_size, ncols - np.arange(0, preview_width) * block_size)
+        number_of_cells = block_heights[:, None] * block_widths[None, :]
+        # Walls are drawn light and empty space dark like in the simulation
+        pixels = np.rint(255 * block_walls / number_of_cells).astype(np.uint8).tobytes()
+        os.makedirs(self.preview_directory, exist_ok=True)
+        preview_file_name = f"{map_name}.pgm"
+        with open(os.path.join(self.preview_directory, preview_file_name), "wb") as f:
+            f.write(f"P5 {preview_width} {preview_height} 255\n".encode("ascii"))
+            f.write(pixels)
+        return os.path.join(os.path.basename(self.preview_directory), preview_file_name)
+
+    def remove_preview(self, entry):
+        preview_path = os.path.join(self.maps_directory, entry["preview"])
+        if os.path.exists(preview_path):
+            os.remove(preview_path)
+
+    def get_entry(self, map_name):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            return self.entries.get(map_name)
+
+    def get_preview_path(self, map_name):
+        entry = self.get_entry(map_name)
+        if entry is None:
+            return None
+        return os.path.join(self.maps_directory, entry["preview"])
+
+    def find_maps(self, min_nrows=None, max_nrows=None, min_ncols=None, max_ncols=None,
+                  min_wall_density=None, max_wall_density=None):
+        """Returns sorted map names matching every given bound, using only the index"""
+        bounds = (("nrows", min_nrows, max_nrows), ("ncols", min_ncols, max_ncols),
+                  ("wall_density", min_wall_density, max_wall_density))
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            map_names = []
+            for map_name, entry in self.entries.items():
+                matches = True
+                for key, minimum, maximum in bounds:
+                    if minimum is not None and entry[key] < minimum:
+                        matches = False
+                    if maximum is not None and entry[key] > maximum:
+                        matches = False
+                if matches:
+                    map_names.append(map_name)
+        return sorted(map_names)
+
+
+map_catalog = MapCatalog()
+
+
+if __name__ == "__main__":
+    map_catalog.refresh()
+    for name in map_catalog.find_maps():
+        entry = map_catalog.get_entry(name)
+        print(f"{name}: {entry['nrows']}x{entry['ncols']}, wall density {entry['wall_density']:.2f}, {entry['checksum'][:12]}")
@@ -0,0 +1,177 @@
+"""Seeded random map generation on NumPy arrays, for any map size"""
+import numpy as np
+
+
+GENERATOR_STYLES = ("center weighted", "cellular automata", "rooms and corridors")
+
+
+def generate_map(nrows=40, ncols=80, style="center weighted", seed=None, p_of_wall=0.2, spawn_areas=(), objective_areas=()):
+    """Returns an nrows x ncols uint8 array where 1 is a wall.
+    spawn_areas and objective_areas are (top_row, left_col, bottom_row, right_col) rectangles, bottom and right
+    exclusive. They are cleared of walls and every one of them is guaranteed to be reachable from the first area"""
+    if not isinstance(nrows, int) or nrows <= 0: raise ValueError("nrows has to be a positive int")
+    if not isinstance(ncols, int) or ncols <= 0: raise ValueError("ncols has to be a positive int")
+    if style not in GENERATOR_STYLES: raise ValueError(f"style has to be one of {GENERATOR_STYLES}")
+    if not 0 <= p_of_wall <= 1: raise ValueError("p_of_wall has to be between 0 and 1")
+    rng = np.random.default_rng(seed)
+    if style == "center weighted":
+        map_array = generate_center_weighted_map(rng, nrows, ncols, p_of_wall)
+    elif style == "cellular automata":
+        map_array = generate_cellular_automata_map(rng, nrows, ncols, p_of_wall)
+    else:
+        map_array = generate_rooms_and_corridors_map(rng, nrows, ncols)
+    areas = [clip_area(area, nrows, ncols) for area in list(spawn_areas) + list(objective_areas)]
+    for area in areas:
+        map_array[area[0]:area[2], area[1]:area[3]] = 0
+    connect_areas(map_array, areas)
+    return map_array
+
+
+def generate_maps(count, nrows=40, ncols=80, style="center weighted", seed=None, **kwargs):
+    """Yields count independent maps. The same seed always gives the same sequence of maps"""
+    for child_seed in np.random.SeedSequence(seed).spawn(count):
+        yield generate_map(nrows, ncols, style, child_seed, **kwargs)
+
+
+def generate_center_weighted_map(rng, nrows, ncols, p_of_wall):
+    """Noise that gets sparser towards the center of the map and denser far away from it"""
+    rows, cols = np.indices((nrows, ncols), dtype=np.float64)
+    closeness_to_center_factor = np.abs(rows - nrows / 2) + np.abs(cols - ncols / 2)
+    closeness_to_center_factor = np.divide(1, closeness_to_center_factor, out=np.zeros_like(closeness_to_center_factor),
+                                           where=closeness_to_center_factor != 0)
+    far_from_center_penalty = np.where(closeness_to_center_factor <= 0.01, 0.3, 0)
+    noise = np.minimum(rng.random((nrows, ncols)) - closeness_to_center_factor + far_from_center_penalty, 1)
+    map_array = (noise <= p_of_wall).astype(np.uint8)
+    fill_wall_corners(map_array)
+    return map_array
+
+
+def generate_cellular_automata_map(rng, nrows, ncols, p_of_wall, iterations=4):
+    """Cave-like maps from smoothing noise: a cell becomes a wall when most of its neighbors are walls"""
+    # Denser starting noise than p_of_wall because smoothing erodes isolated walls
+    map_array = (rng.random((nrows, ncols)) < min(p_of_wall + 0.25, 1)).astype(np.uint8)
+    for i in range(0, iterations):
+        neighbor_walls = count_neighbor_walls(map_array)
+        map_array = ((neighbor_walls >= 5) | ((map_array == 1) & (neighbor_walls >= 4))).astype(np.uint8)
+    return map_array
+
+
+def generate_rooms_and_corridors_map(rng, nrows, ncols, min_room_size=3, max_room_size=10):
+    """Starts solid and carves rectangular rooms joined one after the other by L shaped corridors"""
+    map_array = np.ones((nrows, ncols), dtype=np.uint8)
+    max_room_size = max(min(max_room_size, nrows - 2, ncols - 2), 1)
+    min_room_size = min(min_room_size, max_room_size)
+    number_of_rooms = max(2, (nrows * ncols) // (max_room_size * max_room_size * 3))
+    room_centers = []
+    for i in range(0, number_of_rooms):
+        room_height = int(rng.integers(min_room_size, max_room_size + 1))
+        room_width = int(rng.integers(min_room_size, max_room_size + 1))
+        top_row = int(rng.integers(0, max(nrows - room_height, 0) + 1))
+        left_col = int(rng.integers(0, max(ncols - room_width, 0) + 1))
+        map_array[top_row:top_row + room_height, left_col:left_col + room_width] = 0
+        room_centers.append((top_row + room_height // 2, left_col + room_width // 2))
+    for room_center, next_room_center in zip(room_centers, room_centers[1:]):
+        carve_corridor(map_array, room_center, next_room_center, horizontal_first=bool(rng.integers(0, 2)))
+    return map_array
+
+
+def count_neighbor_walls(map_array):
+    """Number of walls among the 8 neighbors of every cell, cells outside the map count as empty"""
+    padded = np.pad(map_array, 1).astype(np.int8)
+    nrows, ncols = map_array.shape
+    neighbor_walls = np.zeros((nrows, ncols), dtype=np.int8)
+    for row_offset in (0, 1, 2):
+        for col_offset in (0, 1, 2):
+            if row_offset == 1 and col_offset == 1:
+                continue
+            neighbor_walls += padded[row_offset:row_offset + nrows, col_offset:col_offset + ncols]
+    return neighbor_walls
+
+
+def fill_wall_corners(map_array):
+    """Fills empty cells that have a wall above and to the left of them, with the same result as the row by row pass the
+    old generator made. On the top row the wall below counts instead of the one above, and in the left column the wall
+    to the right instead of the one to the left, and as in that pass those edge cells see the cells below and to the
+    right as they were before it. A filled cell can complete the corner for the cell below or to the right of it, so the
+    rest of the map is filled again until nothing changes"""
+    nrows, ncols = map_array.shape
+    original = map_array.copy()
+    if nrows > 1:
+        for col in range(0, ncols):
+            if col > 0:
+                beside = map_array[0, col - 1]
+            else:
+                beside = original[0, 1] if ncols > 1 else 0
+            if map_array[0, col] == 0 and original[1, col] == 1 and beside == 1:
+                map_array[0, col] = 1
+    if ncols > 1:
+        for row in range(1, nrows):
+            if map_array[row, 0] == 0 and map_array[row - 1, 0] == 1 and original[row, 1] == 1:
+                map_array[row, 0] = 1
+    while True:
+        corner = np.zeros(map_array.shape, dtype=bool)
+        corner[1:, 1:] = (map_array[:-1, 1:] == 1) & (map_array[1:, :-1] == 1) & (map_array[1:, 1:] == 0)
+        if not corner.any():
+            return
+        map_array[corner] = 1
+
+
+def clip_area(area, nrows, ncols):
+    top_row, left_col, bottom_row, right_col = area
+    top_row = min(max(top_row, 0), nrows - 1)
+    left_col = min(max(left_col, 0), ncols - 1)
+    bottom_row = min(max(bottom_row, top_row + 1), nrows)
+    right_col = min(max(right_col, left_col + 1), ncols)
+    return top_row, left_col, bottom_row, right_col
+
+
+def find_reachable_cells(map_array, start_area):
+    """Flood fill (4-connected) over empty cells starting from every cell of start_area"""
+    empty = map_array == 0
+    reachable = np.zeros_like(empty)
+    reachable[start_area[0]:start_area[2], start_area[1]:start_area[3]] = True
+    reachable &= empty
+    while True:
+        grown = reachable.copy()
+        grown[1:, :] |= reachable[:-1, :]
+        grown[:-1, :] |= reachable[1:, :]
+        grown[:, 1:] |= reachable[:, :-1]
+        grown[:, :-1] |= reachable[:, 1:]
+        grown &= empty
+        if np.array_equal(grown, reachable):
+            return reachable
+        reachable = grown
+
+
+def connect_areas(map_array, areas):
+    """Carves a corridor from the first area to every area it can't already reach"""
+    if len(areas) < 2:
+        return
+    first_area = areas[0]
+    first_area_center = ((first_area[0] + first_area[2] - 1) // 2, (first_area[1] + first_area[3] - 1) // 2)
+    reachable = find_reachable_cells(map_array, first_area)
+    for area in areas[1:]:
+        if reachable[area[0]:area[2], area[1]:area[3]].any():
+            continue
+        area_center = ((area[0] + area[2] - 1) // 2, (area[1] + area[3] - 1) // 2)
+        carve_corridor(map_array, first_area_center, area_center)
+        reachable = find_reachable_cells(map_array, first_area)
+
+
+def carve_corridor(map_array, start, end, horizontal_first=True):
+    """Clears an L shaped corridor between two (row, col) cells"""
+    (start_row, start_col), (end_row, end_col) = start, end
+    if horizontal_first:
+        corner = (start_row, end_col)
+    else:
+        corner = (end_row, start_col)
+    for (row_a, col_a), (row_b, col_b) in (((start_row, start_col), corner), (corner, (end_row, end_col))):
+        map_array[min(row_a, row_b):max(row_a, row_b) + 1, min(col_a, col_b):max(col_a, col_b) + 1] = 0
+
+
+if __name__ == "__main__":
+    for style in GENERATOR_STYLES:
+        test_map = generate_map(20, 40, style=style, seed=1, spawn_areas=[(1, 1, 3, 3)], objective_areas=[(9, 19, 11, 21)])
+        print(style)
+        for row in test_map:
+            print("".join("#" if value else "." for value in row))
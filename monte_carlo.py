@@ -0,0 +1,227 @@
+"""Sequential Monte Carlo over scenario files: every scenario is run with seed after seed while online estimates of its
+win probabilities and capture times are kept, and a scenario stops getting runs once its confidence intervals are narrow
+enough. The worker processes are given to the scenarios whose intervals are still the widest, so the runs a fixed seed
+budget would spend on already decided scenarios go to the undecided ones instead"""
+import os
+import json
+import queue
+import multiprocessing
+from math import sqrt, inf
+from statistics import NormalDist
+import globals
+from result_cache import ResultCache
+from sweep import run_configuration
+
+
+class OnlineEstimate:
+    """Running mean and variance of a stream of values with Welford's algorithm"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0
+        self.sum_of_squared_differences = 0
+
+    def add(self, value):
+        self.count += 1
+        difference = value - self.mean
+        self.mean += difference / self.count
+        self.sum_of_squared_differences += difference * (value - self.mean)
+
+    @property
+    def variance(self):
+        return self.sum_of_squared_differences / (self.count - 1) if self.count > 1 else None
+
+    def get_interval(self, z):
+        """Normal approximation confidence interval of the mean, None until there are two values"""
+        if self.count < 2:
+            return None
+        half_width = z * sqrt(self.variance / self.count)
+        return self.mean - half_width, self.mean + half_width
+
+
+def get_wilson_interval(successes, count, z):
+    """Wilson score interval of a proportion, which unlike the normal approximation stays useful near 0 and 1"""
+    if count == 0:
+        return 0, 1
+    proportion = successes / count
+    denominator = 1 + z ** 2 / count
+    center = (proportion + z ** 2 / (2 * count)) / denominator
+    half_width = z * sqrt(proportion * (1 - proportion) / count + z ** 2 / (4 * count ** 2)) / denominator
+    return max(center - half_width, 0), min(center + half_width, 1)
+
+
+def get_winner(outcome):
+    """The faction owning the most capture points at the end, the one with the most kills between factions owning
+    as many, None for a draw"""
+    owned = {faction: 0 for faction in outcome["kills"]}
+    for faction in outcome["capture_points"].values():
+        if faction in owned:
+            owned[faction] += 1
+    ranking = sorted(owned.keys(), key=lambda faction: (owned[faction], outcome["kills"][faction]), reverse=True)
+    if len(ranking) > 1 and (owned[ranking[0]], outcome["kills"][ranking[0]]) == (owned[ranking[1]], outcome["kills"][ranking[1]]):
+        return None
+    return ranking[0]
+
+
+def get_first_capture_ticks(outcome):
+    """Format: {capture point id: tick it first changed owner or None}"""
+    return {id: timeline[1][0] if len(timeline) > 1 else None for id, timeline in outcome["capture_timeline"].items()}
+
+
+class ScenarioEstimate:
+
+    def __init__(self, scenario_path, factions=None):
+        if factions is None:
+            factions = globals.FACTION_LIST
+        self.scenario_path = scenario_path
+        self.wins = {faction: 0 for faction in factions}
+        self.draws = 0
+        self.count = 0
+        self.in_flight = 0
+        self.next_seed = 0
+        # Format: {capture point id: OnlineEstimate of the tick it was first captured}, battles where it never was are
+        # left out of the estimate and counted in uncaptured instead
+        self.capture_ticks = {}
+        self.uncaptured = {}
+
+    def add(self, outcome):
+        self.count += 1
+        winner = get_winner(outcome)
+        if winner is None:
+            self.draws += 1
+        else:
+            self.wins[winner] += 1
+        for id, capture_tick in get_first_capture_ticks(outcome).items():
+            self.capture_ticks.setdefault(id, OnlineEstimate())
+            self.uncaptured.setdefault(id, 0)
+            if capture_tick is None:
+                self.uncaptured[id] += 1
+            else:
+                self.capture_ticks[id].add(capture_tick)
+
+    def get_uncertainty(self, z, interval_width, capture_time_width=None):
+        """Largest ratio of an interval's width to the width asked for, above 1 while the scenario isn't decided"""
+        ratios = []
+        for successes in list(self.wins.values()) + [self.draws]:
+            low, high = get_wilson_interval(successes, self.count, z)
+            ratios.append((high - low) / interval_width)
+        if capture_time_width is not None:
+            for capture_tick in self.capture_ticks.values():
+                interval = capture_tick.get_interval(z)
+                if interval is not None:
+                    ratios.append((interval[1] - interval[0]) / capture_time_width)
+                elif capture_tick.count == 1:
+                    # One capture can't say how spread out the capture times are, a point never captured is left out
+                    ratios.append(inf)
+        return max(ratios)
+
+    def get_report(self, z):
+        report = {"samples": self.count, "win_probability": {}, "draw_probability": None, "first_capture_tick": {}}
+        for faction, successes in list(self.wins.items()) + [("draw", self.draws)]:
+            estimate = {"estimate": successes / self.count if self.count else None, "interval": get_wilson_interval(successes, self.count, z)}
+            if faction == "draw":
+                report["draw_probability"] = estimate
+            else:
+                report["win_probability"][faction] = estimate
+        for id, capture_tick in self.capture_ticks.items():
+            report["first_capture_tick"][id] = {"captured": capture_tick.count, "uncaptured": self.uncaptured[id],
+                                                "mean": capture_tick.mean if capture_tick.count else None,
+                                                "standard_deviation": sqrt(capture_tick.variance) if capture_tick.variance is not None else None,
+                                                "interval": capture_tick.get_interval(z)}
+        return report
+
+
+def sequential_monte_carlo(scenario_paths, interval_width=0.1, capture_time_width=None, confidence=0.95, min_samples=10,
+                           max_samples=1000, ticks=None, processes=None, cache=None, on_result=None):
+    """Runs every scenario with seeds 0, 1, 2... until its win probability intervals (and its first capture tick intervals
+    if capture_time_width is given, in ticks) are at most the width asked for, or it has max_samples runs.
+    on_result is called with (scenario path, seed, outcome) as runs finish. Returns {scenario path: report}"""
+    if not 0 < interval_width <= 1: raise ValueError("interval_width has to be between 0 and 1")
+    if capture_time_width is not None and capture_time_width <= 0: raise ValueError("capture_time_width has to be positive")
+    if not 0 < confidence < 1: raise ValueError("confidence has to be between 0 and 1")
+    if not isinstance(min_samples, int) or not 2 <= min_samples <= max_samples: raise ValueError("min_samples has to be an int from 2 to max_samples")
+    if cache is None:
+        cache = ResultCache()
+    if processes is None:
+        processes = os.cpu_count() or 1
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    estimates = {scenario_path: ScenarioEstimate(scenario_path) for scenario_path in scenario_paths}
+
+    def get_next_scenario():
+        """The scenario with the widest interval, counting runs in flight as if they had already narrowed it"""
+        candidates = []
+        for estimate in estimates.values():
+            submitted = estimate.count + estimate.in_flight
+            if submitted >= max_samples:
+                continue
+            if submitted < min_samples:
+                # Every scenario gets its minimum number of runs before intervals are compared
+                priority = inf
+            else:
+                # Interval widths shrink with the square root of the number of runs
+                priority = estimate.get_uncertainty(z, interval_width, capture_time_width) * sqrt(estimate.count / submitted)
+            if priority > 1:
+                candidates.append((priority, -submitted, estimate))
+        if not candidates:
+            return None
+        return max(candidates, key=lambda candidate: candidate[:2])[2]
+
+    def submit(estimate):
+        estimate.in_flight += 1
+        estimate.next_seed += 1
+        return (estimate.scenario_path, estimate.next_seed - 1, ticks, cache.directory, cache.max_bytes)
+
+    def add_result(result):
+        scenario_path, seed, outcome = result
+        estimates[scenario_path].in_flight -= 1
+        estimates[scenario_path].add(outcome)
+        if on_result is not None:
+            on_result(scenario_path, seed, outcome)
+
+    if processes == 1:
+        estimate = get_next_scenario()
+        while estimate is not None:
+            add_result(run_configuration(submit(estimate)))
+            estimate = get_next_scenario()
+    else:
+        results = queue.Queue()
+        in_flight = 0
+        with multiprocessing.Pool(processes=processes) as pool:
+            while True:
+                while in_flight < processes:
+                    estimate = get_next_scenario()
+                    if estimate is None:
+                        break
+                    pool.apply_async(run_configuration, (submit(estimate),), callback=results.put, error_callback=results.put)
+                    in_flight += 1
+                if in_flight == 0:
+                    break
+                result = results.get()
+                in_flight -= 1
+                if isinstance(result, BaseException):
+                    raise result
+                add_result(result)
+
+    reports = {}
+    for scenario_path, estimate in estimates.items():
+        reports[scenario_path] = estimate.get_report(z)
+        reports[scenario_path]["converged"] = estimate.get_uncertainty(z, interval_width, capture_time_width) <= 1
+    return reports
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run scenario files until their win probabilities and capture times are known to a given precision")
+    parser.add_argument("scenarios", nargs="+", help="scenario files (.json or .toml)")
+    parser.add_argument("--width", type=float, default=0.1, help="width of the win probability intervals to stop at (default: 0.1)")
+    parser.add_argument("--capture-time-width", type=float, default=None, help="width in ticks of the first capture tick intervals to stop at (default: not used)")
+    parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of the intervals (default: 0.95)")
+    parser.add_argument("--min-samples", type=int, default=10, help="runs of every scenario before it can stop (default: 10)")
+    parser.add_argument("--max-samples", type=int, default=1000, help="runs of a scenario after which it stops even if undecided (default: 1000)")
+    parser.add_argument("--ticks", type=int, default=None, help="number of ticks to run (default: every scenario's ticks)")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--cache", default=globals.RESULT_CACHE_DIRECTORY, help="result cache directory")
+    args = parser.parse_args()
+    print(json.dumps(sequential_monte_carlo(args.scenarios, interval_width=args.width, capture_time_width=args.capture_time_width,
+                                            confidence=args.confidence, min_samples=args.min_samples, max_samples=args.max_samples,
+                                            ticks=args.ticks, processes=args.processes, cache=ResultCache(args.cache)), indent=2))
@@ -0,0 +1,39 @@
+"""Uniform grid of the living soldiers so a soldier only looks at the soldiers in the cells around it instead of every
+soldier in the battle. It is rebuilt at the start of every tick, which is linear in the number of soldiers"""
+import globals
+
+
+class NeighborGrid:
+
+    def __init__(self, cell_size=None):
+        if cell_size is None:
+            cell_size = globals.SOLDIER_SEPARATION_RADIUS
+        if not isinstance(cell_size, (int, float)) or cell_size <= 0: raise ValueError("cell_size has to be a positive number")
+        self.cell_size = cell_size
+        # Format: {(cell col, cell row): [soldier, ...]}
+        self.cells = {}
+
+    def rebuild(self, soldiers):
+        cells = {}
+        cell_size = self.cell_size
+        for soldier in soldiers:
+            if not soldier.alive or soldier.coordinates_center is None:
+                continue
+            cell = (int(soldier.coordinates_center.x // cell_size), int(soldier.coordinates_center.y // cell_size))
+            cell_soldiers = cells.get(cell)
+            if cell_soldiers is None:
+                cells[cell] = [soldier]
+            else:
+                cell_soldiers.append(soldier)
+        self.cells = cells
+
+    def get_soldiers_near(self, point):
+        """Soldiers in the 3x3 cells around the point, which includes every soldier within cell_size of it as of the
+        last rebuild. Soldiers move less than a cell per tick, so callers check the current distance themselves"""
+        cell_col = int(point.x // self.cell_size)
+        cell_row = int(point.y // self.cell_size)
+        for col in range(cell_col - 1, cell_col + 2):
+            for row in range(cell_row - 1, cell_row + 2):
+                cell_soldiers = self.cells.get((col, row))
+                if cell_soldiers is not None:
+                    yield from cell_soldiers
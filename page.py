@@ -3,10 +3,26 @@ from utility import *
 import globals
 from entity import *
 from map import *
+from map_catalog import map_catalog
+from camera import Camera
+from simulation import Simulation
+from checkpoint import save_checkpoint, load_checkpoint
+from profiler import enable_profiler, disable_profiler
+from telemetry import enable_telemetry, disable_telemetry
+from ai_scheduler import enable_ai_scheduler, disable_ai_scheduler
+from goal_field import enable_goal_fields, disable_goal_fields
 import pygame
-from random import random, choice, randint
 import sys
+import os
+import time
 import _pickle
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_font(name, size, bold=False):
+    """SysFont searches the installed fonts every time it's called, so every font is only made once while pygame is running"""
+    return pygame.font.SysFont(name, size, bold=bold)
 
 
 class Page:
@@ -21,6 +37,15 @@ class Page:
         self.clock = clock
         self.bg_color = bg_color
 
+    # Fonts are only made when a page first draws text, not when the pages are made on startup
+    @property
+    def font(self):
+        return get_font("Times New Roman", 30, bold=True)
+
+    @property
+    def button_font(self):
+        return get_font("Times New Roman", 20, bold=False)
+
     def mainloop(self):
         pass
 
@@ -29,9 +54,6 @@ class SimulationPage(Page):
 
     def __init__(self, win, name, clock, bg_color=None):
         super().__init__(win, name, clock, bg_color)
-        # Font
-        self.font = pygame.font.SysFont("Times New Roman", 30, bold=True)
-        self.button_font = pygame.font.SysFont("Times New Roman", 20, bold=False)
 
         # Screenshots
         self.take_screenshots = False
@@ -42,6 +64,18 @@ class SimulationPage(Page):
         self.map = None
         self.load_map()
 
+        # Camera
+        self.camera = Camera(globals.WIN_WIDTH, globals.WIN_HEIGHT, self.map)
+
+        # Battle state and logic
+        self.simulation = Simulation(win=self.win, map=self.map, seed=globals.seed)
+        if globals.RECORD_TELEMETRY:
+            enable_telemetry(output_directory=f"{globals.TELEMETRY_DIRECTORY}{time.strftime('%Y%m%d_%H%M%S')}")
+        if globals.SCHEDULE_AI:
+            enable_ai_scheduler()
+        if globals.USE_GOAL_FIELDS:
+            enable_goal_fields(self.map)
+
     def mainloop(self):
         while True:
 
@@ -52,26 +86,36 @@ class SimulationPage(Page):
                 break
 
             # Time since last clock tick
-            globals.dt = self.clock.tick(globals.FPS)
+            dt = self.clock.tick(globals.FPS)
             # Do not use dt if taking screenshots
             if self.take_screenshots and not globals.paused:
-                globals.dt = 1
+                dt = 1
+            globals.dt = dt
 
-            # Update mouse position
+            # Update camera and mouse position in world coordinates
+            self.camera.update(globals.dt)
             mouse_pos = pygame.mouse.get_pos()
-            mouse_pos = Point(mouse_pos[0], mouse_pos[1])
+            mouse_pos = self.camera.screen_to_world(Point(mouse_pos[0], mouse_pos[1]))
             mouse_pos_grid_position = self.map.get_grid_position_of_point(mouse_pos)
 
             # Update entities
-            for entity in globals.entity_list:
-                entity.update_at_start_of_frame()
+            self.simulation.step(dt)
 
             # Events
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
+                    disable_telemetry()
                     pygame.quit()
                     sys.exit()
-                if event.type == pygame.MOUSEBUTTONDOWN:
+                self.camera.handle_event(event)
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    self.toggle_profiler()
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F5:
+                    self.quick_save()
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F9:
+                    self.quick_load()
+                    mouse_pos_grid_position = self.map.get_grid_position_of_point(mouse_pos)
+                if event.type == pygame.MOUSEBUTTONDOWN and self.map.is_point_in_world(mouse_pos):
                     if pygame.mouse.get_pressed()[0]:
                         # If the user is placing a spawn point
                         if globals.spawn_being_placed:
@@ -80,83 +124,101 @@ class SimulationPage(Page):
                         elif globals.capture_point_being_placed:
                             if self.map.map_array[mouse_pos_grid_position[0]][mouse_pos_grid_position[1]] == 0:
                                 self.create_capture_point(mouse_pos)
+                    # Right click adds or removes a wall while the battle is running
+                    elif pygame.mouse.get_pressed()[2]:
+                        is_wall = self.map.map_array[mouse_pos_grid_position[0]][mouse_pos_grid_position[1]] == 1
+                        self.simulation.set_wall(mouse_pos_grid_position, not is_wall)
 
             # Updates Based on Changes in Tkinter Options
             if globals.soldiers_being_added:
                 globals.soldiers_being_added = False
-                for i in range(0, globals.number_of_NC_to_add):
-                    random_weapon_type = choice(globals.WEAPON_TYPES)
-                    aim_factor = min(random() + 0.3, 1)
-                    self.create_soldier(faction="NC", weapon_type=random_weapon_type, aim_factor=aim_factor)
-                for i in range(0, globals.number_of_TR_to_add):
-                    random_weapon_type = choice(globals.WEAPON_TYPES)
-                    aim_factor = min(random() + 0.3, 1)
-                    self.create_soldier(faction="TR", weapon_type=random_weapon_type, aim_factor=aim_factor)
-                for i in range(0, globals.number_of_VS_to_add):
-                    random_weapon_type = choice(globals.WEAPON_TYPES)
-                    aim_factor = min(random() + 0.3, 1)
-                    self.create_soldier(faction="VS", weapon_type=random_weapon_type, aim_factor=aim_factor)
+                self.simulation.add_soldiers(faction="NC", number_of_soldiers=globals.number_of_NC_to_add)
+                self.simulation.add_soldiers(faction="TR", number_of_soldiers=globals.number_of_TR_to_add)
+                self.simulation.add_soldiers(faction="VS", number_of_soldiers=globals.number_of_VS_to_add)
 
             # Simulation Logic
             if not globals.paused:
                 pass
 
             """DRAW STUFF BELOW"""
+            profiler = globals.profiler
+            if profiler is not None:
+                profiler.start_phase("render")
             self.win.fill(globals.BLACK)
             if self.map.show_gridlines:
-                self.map.draw_gridlines()
+                self.map.draw_gridlines(self.camera)
+            if globals.shot_buffer is not None:
+                globals.shot_buffer.draw(self.win, self.camera)
             for entity in globals.entity_list:
-                entity.draw()
-            self.map.draw()
+                entity.draw(self.camera)
+            self.map.draw(self.camera)
+            if profiler is not None:
+                profiler.end_phase("render")
+                profiler.draw_overlay(self.win, self.button_font)
 
             # Update frame
             pygame.display.update()
             if self.take_screenshots:
                 pygame.image.save(self.win, f"./Images/screenshot{self.frame_counter}.jpg")
                 self.frame_counter += 1
+        disable_profiler()
+        disable_telemetry()
+        disable_ai_scheduler()
+        disable_goal_fields()
+
+    def toggle_profiler(self):
+        """F3 turns profiling and its overlay on and off, while it's on the timings are also saved to a CSV file"""
+        if globals.profiler is None:
+            os.makedirs(globals.PROFILES_DIRECTORY, exist_ok=True)
+            enable_profiler(output_path=f"{globals.PROFILES_DIRECTORY}profile_{time.strftime('%Y%m%d_%H%M%S')}.csv")
+        else:
+            disable_profiler()
+
+    def quick_save(self):
+        save_checkpoint(self.simulation, f"{globals.CHECKPOINTS_DIRECTORY}{globals.QUICK_SAVE_CHECKPOINT_NAME}")
+
+    def quick_load(self):
+        """Replaces the running battle with the quick save, including its map"""
+        checkpoint_path = f"{globals.CHECKPOINTS_DIRECTORY}{globals.QUICK_SAVE_CHECKPOINT_NAME}"
+        if not os.path.exists(checkpoint_path):
+            return
+        self.simulation = load_checkpoint(checkpoint_path, self.win)
+        self.map = self.simulation.map
+        self.camera = Camera(globals.WIN_WIDTH, globals.WIN_HEIGHT, self.map)
+        if globals.goal_fields is not None:
+            enable_goal_fields(self.map)
 
     def load_map(self):
         self.map_name = globals.map_name
         if self.map_name == "Blank":
             map_array = globals.MAP_BLANK
         elif self.map_name == "Randomly Generated":
-            map_array = globals.generate_random_map()
+            map_array = globals.generate_random_map(seed=globals.seed)
+        elif os.path.exists(f"{globals.MAPS_DIRECTORY}{self.map_name}.{globals.TILED_MAP_EXTENSION}"):
+            # Tiled maps are read chunk by chunk as they are needed instead of being loaded whole
+            self.map = Map.from_tiled_file(win=self.win, path=f"{globals.MAPS_DIRECTORY}{self.map_name}.{globals.TILED_MAP_EXTENSION}",
+                                           wall_color=globals.BROWNISH_GREY)
+            return
         else:
-            with open(f"./Maps/{self.map_name}.txt", "rb") as f:
+            with open(f"{globals.MAPS_DIRECTORY}{self.map_name}.txt", "rb") as f:
                 map_array = _pickle.load(f)
         self.map = Map(win=self.win, map_array=map_array, wall_color=globals.BROWNISH_GREY)
 
     def create_spawn_point(self, coordinates):
-        if globals.spawn_being_placed_type == "Sunderer":
-            new_spawn_point = Sunderer(win=self.win, map=self.map, id=globals.next_spawn_dict_key,
-                                       coordinates=coordinates, faction=globals.spawn_being_placed_faction)
-            globals.spawn_point_dict[globals.next_spawn_dict_key] = new_spawn_point
-            globals.entity_list.append(new_spawn_point)
-            globals.next_spawn_dict_key += 1
+        self.simulation.create_spawn_point(coordinates=coordinates, faction=globals.spawn_being_placed_faction,
+                                           spawn_type=globals.spawn_being_placed_type)
 
     def create_capture_point(self, coordinates):
-        new_capture_point = CapturePoint(win=self.win, map=self.map, id=globals.next_capture_point_dict_key,
-                                         coordinates=coordinates, faction=globals.capture_point_being_placed_faction)
-        globals.capture_point_dict[globals.next_capture_point_dict_key] = new_capture_point
-        globals.entity_list.append(new_capture_point)
-        globals.next_capture_point_dict_key += 1
+        self.simulation.create_capture_point(coordinates=coordinates, faction=globals.capture_point_being_placed_faction)
 
     def create_soldier(self, faction, weapon_type, aim_factor, coordinates=None):
-        new_soldier = Soldier(win=self.win, map=self.map, id=globals.next_soldiers_dict_key,
-                              shape="square", width=5, coordinates=coordinates, faction=faction,
-                              weapon_type=weapon_type, aim_factor=aim_factor)
-        globals.soldiers_dict[globals.next_soldiers_dict_key] = new_soldier
-        globals.entity_list.append(new_soldier)
-        globals.next_soldiers_dict_key += 1
+        self.simulation.create_soldier(faction=faction, weapon_type=weapon_type, aim_factor=aim_factor, coordinates=coordinates)
 
 
 class MapCreatorPage(Page):
 
     def __init__(self, win, name, clock, bg_color=None):
         super().__init__(win, name, clock, bg_color)
-        # Font
-        self.font = pygame.font.SysFont("Times New Roman", 30, bold=True)
-        self.button_font = pygame.font.SysFont("Times New Roman", 20, bold=False)
 
         # Screenshots
         self.take_screenshots = False
@@ -167,6 +229,9 @@ class MapCreatorPage(Page):
         self.map = None
         self.load_map()
 
+        # Camera
+        self.camera = Camera(globals.WIN_WIDTH, globals.WIN_HEIGHT, self.map)
+
         # Format: ((grid_col, grid_row), (from, to))
         self.previous_actions = []
 
@@ -188,28 +253,31 @@ class MapCreatorPage(Page):
             if self.take_screenshots:
                 globals.dt = 1
 
+            # Camera
+            self.camera.update(globals.dt)
+
             # Events
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     sys.exit()
-                if pygame.mouse.get_pressed()[0]:
-                    mouse_pos = pygame.mouse.get_pos()
-                    mouse_pos = Point(mouse_pos[0], mouse_pos[1])
+                self.camera.handle_event(event)
+                mouse_pos = pygame.mouse.get_pos()
+                mouse_pos = self.camera.screen_to_world(Point(mouse_pos[0], mouse_pos[1]))
+                mouse_in_world = self.map.is_point_in_world(mouse_pos)
+                if pygame.mouse.get_pressed()[0] and mouse_in_world:
                     mouse_pos_grid_position = self.map.get_grid_position_of_point(mouse_pos)
                     value_at_grid_position = self.map.map_array[mouse_pos_grid_position[0]][mouse_pos_grid_position[1]]
                     if value_at_grid_position != 1:
                         new_value = 1
-                        self.map.map_array[mouse_pos_grid_position[0]][mouse_pos_grid_position[1]] = new_value
+                        self.map.set_cell(mouse_pos_grid_position[0], mouse_pos_grid_position[1], new_value)
                         self.previous_actions.append((mouse_pos_grid_position, (value_at_grid_position, new_value)))
-                if pygame.mouse.get_pressed()[2]:
-                    mouse_pos = pygame.mouse.get_pos()
-                    mouse_pos = Point(mouse_pos[0], mouse_pos[1])
+                if pygame.mouse.get_pressed()[2] and mouse_in_world:
                     mouse_pos_grid_position = self.map.get_grid_position_of_point(mouse_pos)
                     value_at_grid_position = self.map.map_array[mouse_pos_grid_position[0]][mouse_pos_grid_position[1]]
                     if value_at_grid_position != 0:
                         new_value = 0
-                        self.map.map_array[mouse_pos_grid_position[0]][mouse_pos_grid_position[1]] = new_value
+                        self.map.set_cell(mouse_pos_grid_position[0], mouse_pos_grid_position[1], new_value)
                         self.previous_actions.append((mouse_pos_grid_position, (value_at_grid_position, new_value)))
                 if pygame.key.get_pressed()[pygame.K_LCTRL]:
                     if event.type == pygame.KEYDOWN:
@@ -218,7 +286,7 @@ class MapCreatorPage(Page):
                                 previous_action = self.previous_actions.pop()
                                 previous_value = previous_action[1][0]
                                 previous_action_grid_position = previous_action[0]
-                                self.map.map_array[previous_action_grid_position[0]][previous_action_grid_position[1]] = previous_value
+                                self.map.set_cell(previous_action_grid_position[0], previous_action_grid_position[1], previous_value)
 
             # Tkinter Options Updates
             if globals.save_map:
@@ -229,8 +297,8 @@ class MapCreatorPage(Page):
             # Redraw level
             self.win.fill(globals.BLACK)
             if self.map.show_gridlines:
-                self.map.draw_gridlines()
-            self.map.draw()
+                self.map.draw_gridlines(self.camera)
+            self.map.draw(self.camera)
 
             # Update frame
             pygame.display.update()
@@ -243,13 +311,24 @@ class MapCreatorPage(Page):
         if self.map_name == "Blank":
             map_array = globals.MAP_BLANK
         elif self.map_name == "Randomly Generated":
-            map_array = globals.generate_random_map()
+            map_array = globals.generate_random_map(seed=globals.seed)
+        elif os.path.exists(f"{globals.MAPS_DIRECTORY}{self.map_name}.{globals.TILED_MAP_EXTENSION}"):
+            # Tiled maps are read chunk by chunk as they are needed instead of being loaded whole
+            self.map = Map.from_tiled_file(win=self.win, path=f"{globals.MAPS_DIRECTORY}{self.map_name}.{globals.TILED_MAP_EXTENSION}",
+                                           wall_color=globals.BROWNISH_GREY)
+            return
         else:
-            with open(f"./Maps/{self.map_name}.txt", "rb") as f:
+            with open(f"{globals.MAPS_DIRECTORY}{self.map_name}.txt", "rb") as f:
                 map_array = _pickle.load(f)
         self.map = Map(win=self.win, map_array=map_array, wall_color=globals.BROWNISH_GREY)
 
     def save_map(self):
         map_name = globals.save_map_name
-        with open(f"./Maps/{map_name}.txt", "wb") as f:
-            _pickle.dump(self.map.map_array, f)
+        if self.map.is_chunked:
+            file_name = f"{map_name}.{globals.TILED_MAP_EXTENSION}"
+            self.map.map_array.storage.save_as(f"{globals.MAPS_DIRECTORY}{file_name}")
+        else:
+            file_name = f"{map_name}.txt"
+            with open(f"{globals.MAPS_DIRECTORY}{file_name}", "wb") as f:
+                _pickle.dump(self.map.map_array, f)
+        map_catalog.update_map(map_name, self.map.map_array, file_name)
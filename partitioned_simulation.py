@@ -0,0 +1,253 @@
+"""Parallel target finding: every tick, worker processes that each own a vertical strip of the map find targets for the
+soldiers in their strip, the most expensive part of a tick. Soldier state is shared with the workers through shared memory
+arrays, and a barrier starts and ends every targeting pass.
+
+Only target finding is partitioned. Movement, shooting and capture points mutate soldiers of every strip and draw from the
+battle's random number generator in entity order, so they stay in the main process, which makes the battle the same for
+any number of partitions. That caps the speedup at 1 / (share of a tick that isn't target finding), about 4.5x for the
+medium benchmark battle, however many cores there are. Targets are chosen from the state at the start of the tick for
+every soldier at once, while a plain Simulation lets each soldier see the moves and kills of the soldiers updated before it,
+so a partitioned battle is a different battle from a plain Simulation run with the same seed"""
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import globals
+from utility import *
+from simulation import Simulation
+
+
+# Columns of the shared soldier state, one row per soldier
+STATE_COLUMNS = ("x", "y", "grid_row", "grid_col", "alive", "target_index", "target_distance")
+X, Y, GRID_ROW, GRID_COL, ALIVE, TARGET_INDEX, TARGET_DISTANCE = range(0, len(STATE_COLUMNS))
+# Columns written back by the workers
+RESULT_COLUMNS = ("target_index", "target_distance")
+
+
+def get_partition_bounds(world_width, number_of_partitions):
+    """Splits the world into equally wide vertical strips, returns (left, right) world x values"""
+    strip_width = world_width / number_of_partitions
+    return [(i * strip_width, (i + 1) * strip_width) for i in range(0, number_of_partitions)]
+
+
+def sync_soldiers_from_state(soldiers, state):
+    """Brings soldier copies in line with the shared state, only what target finding reads is synced"""
+    for soldier, row in zip(soldiers, state):
+        soldier.alive = bool(row[ALIVE])
+        if not soldier.alive:
+            continue
+        if soldier.coordinates_center is None:
+            soldier.coordinates_center = Point(float(row[X]), float(row[Y]))
+        else:
+            soldier.coordinates_center.x = float(row[X])
+            soldier.coordinates_center.y = float(row[Y])
+
+
+def build_soldier_grid(state, cell_size):
+    """Format: {(cell col, cell row): [indices of the living soldiers in the cell, in soldier order]}"""
+    alive_indices = np.flatnonzero(state[:, ALIVE] != 0)
+    cell_cols = (state[alive_indices, X] // cell_size).astype(np.int64).tolist()
+    cell_rows = (state[alive_indices, Y] // cell_size).astype(np.int64).tolist()
+    grid = {}
+    for index, cell in zip(alive_indices.tolist(), zip(cell_cols, cell_rows)):
+        cell_indices = grid.get(cell)
+        if cell_indices is None:
+            grid[cell] = [index]
+        else:
+            cell_indices.append(index)
+    return grid
+
+
+def get_grid_candidates(grid, cell_size, x, y, reach):
+    """Indices of the soldiers in the cells within reach of (x, y), sorted so ties resolve like in Soldier.find_enemy_target"""
+    indices = []
+    for col in range(int((x - reach) // cell_size), int((x + reach) // cell_size) + 1):
+        for row in range(int((y - reach) // cell_size), int((y + reach) // cell_size) + 1):
+            cell_indices = grid.get((col, row))
+            if cell_indices is not None:
+                indices.extend(cell_indices)
+    indices.sort()
+    return indices
+
+
+def find_partition_targets(soldiers, state, results, bounds, is_last_partition, cell_size):
+    """Finds targets for the living soldiers in the strip. A soldier can only target enemies within its engagement range,
+    so its candidates are the soldiers in the grid cells that range reaches instead of every soldier near the strip"""
+    left, right = bounds
+    x_values = state[:, X]
+    alive = state[:, ALIVE] != 0
+    in_strip = alive & (x_values >= left) & ((x_values <= right) if is_last_partition else (x_values < right))
+    grid = build_soldier_grid(state, cell_size)
+    for i in np.flatnonzero(in_strip):
+        soldier = soldiers[i]
+        soldier.grid_position = (int(state[i, GRID_ROW]), int(state[i, GRID_COL]))
+        target_index = int(state[i, TARGET_INDEX])
+        soldier.current_target_enemy = soldiers[target_index] if target_index != -1 else None
+        soldier.current_target_enemy_distance = float(state[i, TARGET_DISTANCE]) if target_index != -1 else None
+        candidates = [soldiers[j] for j in get_grid_candidates(grid, cell_size, state[i, X], state[i, Y], soldier.enemy_engagement_range)]
+        target, distance = soldier.find_enemy_target(candidates)
+        results[i, 0] = -1 if target is None else target.index
+        results[i, 1] = distance if distance is not None else 0.0
+
+
+def partition_worker(partition_index, soldiers, state_name, number_of_soldiers, bounds, is_last_partition, cell_size,
+                     start_barrier, end_barrier, stop):
+    """Runs in a forked process with its own copies of the soldiers and the map, the workers are restarted when either changes"""
+    # The parent's profiler and telemetry files must not be written to from the workers
+    globals.profiler = None
+    globals.telemetry = None
+    state_memory = shared_memory.SharedMemory(name=state_name)
+    state = np.ndarray((number_of_soldiers, len(STATE_COLUMNS)), dtype=np.float64, buffer=state_memory.buf)
+    results = np.ndarray((number_of_soldiers, len(RESULT_COLUMNS)), dtype=np.float64, buffer=state_memory.buf,
+                         offset=state.nbytes)
+    try:
+        while True:
+            start_barrier.wait()
+            if stop.value:
+                break
+            sync_soldiers_from_state(soldiers, state)
+            find_partition_targets(soldiers, state, results, bounds, is_last_partition, cell_size)
+            end_barrier.wait()
+    finally:
+        del state, results
+        state_memory.close()
+
+
+class PartitionedSimulation:
+    """Steps a Simulation with its targets found by partition workers. targeting_seconds adds up the time of the partitioned
+    passes and step_seconds the time of whole ticks, so the share of a tick that runs in parallel can be measured"""
+
+    def __init__(self, simulation, number_of_partitions):
+        if not isinstance(simulation, Simulation): raise TypeError("simulation has to be a Simulation object")
+        if not isinstance(number_of_partitions, int) or number_of_partitions <= 0: raise ValueError("number_of_partitions has to be a positive int")
+        self.simulation = simulation
+        self.number_of_partitions = number_of_partitions
+        self.partition_bounds = get_partition_bounds(simulation.map.world_width, number_of_partitions)
+        self.soldiers = []
+        self.state_memory = None
+        self.state = None
+        self.results = None
+        self.workers = []
+        self.start_barrier = None
+        self.end_barrier = None
+        self.stop = None
+        self.grid_cell_size = None
+        # Without fork the partitions are run one after the other in this process, which gives the same targets
+        self.use_workers = "fork" in multiprocessing.get_all_start_methods() and number_of_partitions > 1
+        # Set when a wall is added or removed, the workers' copies of the map are out of date until they are restarted
+        self.map_changed = False
+        self.targeting_seconds = 0
+        self.step_seconds = 0
+        simulation.map.add_change_listener(self.on_map_cell_changed)
+
+    def on_map_cell_changed(self, row, col, old_value, new_value):
+        """Walls are edited rarely (by hand in the GUI), so the workers are forked again with the current map instead of
+        every worker being sent every edit"""
+        self.map_changed = True
+
+    @property
+    def tick(self):
+        return self.simulation.tick
+
+    def start_workers(self):
+        """Workers are forked with copies of the current soldiers and map, so they are restarted whenever soldiers are added
+        or walls are changed"""
+        self.stop_workers()
+        self.map_changed = False
+        self.soldiers = list(globals.soldiers_dict.values())
+        for i, soldier in enumerate(self.soldiers):
+            soldier.index = i
+        number_of_soldiers = max(len(self.soldiers), 1)
+        state_size = number_of_soldiers * (len(STATE_COLUMNS) + len(RESULT_COLUMNS)) * np.dtype(np.float64).itemsize
+        self.state_memory = shared_memory.SharedMemory(create=True, size=state_size)
+        self.state = np.ndarray((number_of_soldiers, len(STATE_COLUMNS)), dtype=np.float64, buffer=self.state_memory.buf)
+        self.results = np.ndarray((number_of_soldiers, len(RESULT_COLUMNS)), dtype=np.float64, buffer=self.state_memory.buf,
+                                  offset=self.state.nbytes)
+        self.state[:] = 0
+        # Cells half as wide as the shortest engagement range, so a soldier's candidates are mostly soldiers it can reach
+        self.grid_cell_size = max(min((soldier.enemy_engagement_range for soldier in self.soldiers), default=1) / 2, 1)
+        if not self.use_workers:
+            return
+        context = multiprocessing.get_context("fork")
+        self.start_barrier = context.Barrier(self.number_of_partitions + 1)
+        self.end_barrier = context.Barrier(self.number_of_partitions + 1)
+        self.stop = context.Value("b", 0)
+        for partition_index, bounds in enumerate(self.partition_bounds):
+            worker = context.Process(target=partition_worker, daemon=True,
+                                     args=(partition_index, self.soldiers, self.state_memory.name, number_of_soldiers, bounds,
+                                           partition_index == self.number_of_partitions - 1, self.grid_cell_size,
+                                           self.start_barrier, self.end_barrier, self.stop))
+            worker.start()
+            self.workers.append(worker)
+
+    def stop_workers(self):
+        if self.workers:
+            self.stop.value = 1
+            self.start_barrier.wait()
+            for worker in self.workers:
+                worker.join()
+            self.workers = []
+        if self.state_memory is not None:
+            self.state = None
+            self.results = None
+            self.state_memory.close()
+            self.state_memory.unlink()
+            self.state_memory = None
+
+    def close(self):
+        self.simulation.map.remove_change_listener(self.on_map_cell_changed)
+        self.stop_workers()
+
+    def write_state(self):
+        for i, soldier in enumerate(self.soldiers):
+            row = self.state[i]
+            row[ALIVE] = soldier.alive
+            if not soldier.alive:
+                continue
+            row[X] = soldier.coordinates_center.x
+            row[Y] = soldier.coordinates_center.y
+            row[GRID_ROW] = soldier.grid_position[0]
+            row[GRID_COL] = soldier.grid_position[1]
+            if soldier.current_target_enemy is not None:
+                row[TARGET_INDEX] = soldier.current_target_enemy.index
+                row[TARGET_DISTANCE] = soldier.current_target_enemy_distance
+            else:
+                row[TARGET_INDEX] = -1
+
+    def find_targets(self):
+        """Returns {soldier id: (target enemy, distance)} for every living soldier"""
+        self.write_state()
+        self.results[:] = 0
+        start = time.perf_counter()
+        if self.use_workers:
+            self.start_barrier.wait()
+            self.end_barrier.wait()
+        else:
+            for partition_index, bounds in enumerate(self.partition_bounds):
+                find_partition_targets(self.soldiers, self.state, self.results, bounds,
+                                       partition_index == self.number_of_partitions - 1, self.grid_cell_size)
+        self.targeting_seconds += time.perf_counter() - start
+        precomputed_targets = {}
+        for i, soldier in enumerate(self.soldiers):
+            if self.state[i, ALIVE]:
+                target_index = int(self.results[i, 0])
+                if target_index == -1:
+                    precomputed_targets[soldier.id] = (None, None)
+                else:
+                    precomputed_targets[soldier.id] = (self.soldiers[target_index], float(self.results[i, 1]))
+        return precomputed_targets
+
+    def step(self, dt):
+        if self.state_memory is None or len(self.soldiers) != len(globals.soldiers_dict) or self.map_changed:
+            self.start_workers()
+        start = time.perf_counter()
+        globals.precomputed_targets = self.find_targets()
+        try:
+            self.simulation.step(dt)
+        finally:
+            globals.precomputed_targets = None
+        self.step_seconds += time.perf_counter() - start
+
+    def run(self, number_of_ticks, dt):
+        for i in range(0, number_of_ticks):
+            self.step(dt)
@@ -0,0 +1,129 @@
+"""A* pathfinding over the map grid that can be paused after any number of node expansions and resumed later"""
+import heapq
+from itertools import count
+from math import sqrt
+from utility import *
+
+
+class AStarSearch:
+    """Finds the path between two grid positions, moving to the 8 neighboring squares.
+    Nodes with the same f-score are expanded in the order they were opened, which gives the same paths as the original
+    list-based search in Soldier.move_astar"""
+
+    def __init__(self, map, start, goal, enable_collisions=True):
+        self.map = map
+        self.start = start
+        self.goal = goal
+        self.enable_collisions = enable_collisions
+        self.distance_to_corner_neighbor = sqrt(2 * (abs(map.grid_width) ** 2))
+        self.came_from = {}
+        self.g_scores = {start: 0}
+        self.f_scores = {start: self.heuristic_function(start)}
+        # Format: (f-score, order the node was opened in, node), entries for nodes that got a better score are skipped
+        self.open_heap = []
+        self.open_order = {}
+        self.next_open_order = count()
+        self.open_node(start)
+        self.nodes_expanded = 0
+        self.done = False
+        # Grid positions from the goal back to the start, None if there is no path
+        self.path = None
+
+    def heuristic_function(self, grid_position):
+        """Calculates euclidean distance between the centers of the grid squares"""
+        grid_width = self.map.grid_width
+        return int(sqrt(abs((grid_position[1] - self.goal[1]) * grid_width) ** 2 + abs((grid_position[0] - self.goal[0]) * grid_width) ** 2))
+
+    def open_node(self, node):
+        if node not in self.open_order:
+            self.open_order[node] = next(self.next_open_order)
+        heapq.heappush(self.open_heap, (self.f_scores[node], self.open_order[node], node))
+
+    def pop_lowest_f_score_node(self):
+        while self.open_heap:
+            f_score, open_order, node = heapq.heappop(self.open_heap)
+            if self.open_order.get(node) == open_order and self.f_scores[node] == f_score:
+                del self.open_order[node]
+                return node
+        return None
+
+    def step(self, max_node_expansions=None):
+        """Expands up to max_node_expansions nodes, or until the search is done when it is None. Returns self.done"""
+        map_array = self.map.map_array
+        nrows = self.map.nrows
+        ncols = self.map.ncols
+        expansions = 0
+        while not self.done:
+            if max_node_expansions is not None and expansions >= max_node_expansions:
+                break
+            current_node = self.pop_lowest_f_score_node()
+            if current_node is None:
+                self.done = True
+                break
+            if current_node == self.goal:
+                self.path = self.reconstruct_path(current_node)
+                self.done = True
+                break
+            self.nodes_expanded += 1
+            expansions += 1
+            current_node_row, current_node_col = current_node
+            for corner_neighbor in self.map.get_neighboring_corner_grid_positions(current_node):
+                if corner_neighbor[1] < 0 or corner_neighbor[1] > ncols - 1:
+                    continue
+                if corner_neighbor[0] < 0 or corner_neighbor[0] > nrows - 1:
+                    continue
+                if self.enable_collisions:
+                    if map_array[corner_neighbor[0]][corner_neighbor[1]] == 1:
+                        continue
+                    # This is to prevent movement diagonally through two touching wall's corners
+                    if map_array[current_node_row][corner_neighbor[1]] == 1 and map_array[corner_neighbor[0]][current_node_col] == 1:
+                        continue
+                self.relax(current_node, corner_neighbor, self.distance_to_corner_neighbor)
+            for edge_neighbor in self.map.get_neighboring_edge_grid_positions(current_node):
+                if edge_neighbor[1] < 0 or edge_neighbor[1] > ncols - 1:
+                    continue
+                if edge_neighbor[0] < 0 or edge_neighbor[0] > nrows - 1:
+                    continue
+                if map_array[edge_neighbor[0]][edge_neighbor[1]] == 1 and self.enable_collisions:
+                    continue
+                self.relax(current_node, edge_neighbor, self.map.grid_width)
+        return self.done
+
+    def relax(self, current_node, neighbor, distance):
+        tentative_g_score = self.g_scores[current_node] + distance
+        g_score = self.g_scores.get(neighbor)
+        if g_score is None or tentative_g_score < g_score:
+            self.came_from[neighbor] = current_node
+            self.g_scores[neighbor] = tentative_g_score
+            self.f_scores[neighbor] = tentative_g_score + self.heuristic_function(neighbor)
+            self.open_node(neighbor)
+
+    def reconstruct_path(self, current_node):
+        total_path = [current_node]
+        while current_node in self.came_from:
+            current_node = self.came_from[current_node]
+            total_path.append(current_node)
+        return total_path
+
+    def get_path_points(self):
+        """The path as the world coordinates of the grid square centers, from the goal back to the start"""
+        if self.path is None:
+            return None
+        half_grid_width = self.map.grid_width / 2
+        return [Point(self.map.grid_coordinates[row][col][0] + half_grid_width, self.map.grid_coordinates[row][col][1] + half_grid_width)
+                for row, col in self.path]
+
+
+def smooth_path(map, points):
+    """Drops the waypoints that can be skipped by walking straight to a later one without going through a wall,
+    so a path only turns where it has to go around a corner. The first and last points are kept"""
+    if len(points) <= 2:
+        return list(points)
+    smoothed_points = [points[0]]
+    anchor_index = 0
+    for i in range(2, len(points)):
+        if not map.has_line_of_sight(points[anchor_index], points[i]):
+            anchor_index = i - 1
+            smoothed_points.append(points[anchor_index])
+    smoothed_points.append(points[-1])
+    return smoothed_points
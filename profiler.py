@@ -0,0 +1,129 @@
+"""Per-tick phase timers and counters for finding out where the time of a slow frame goes.
+Instrumented code checks globals.profiler and does nothing else when it is None, so profiling is free when off"""
+import csv
+import json
+import os
+import time
+from collections import deque
+import globals
+
+
+# Phases nest: los_rays happen inside targeting, astar inside movement
+PHASES = ("targeting", "los_rays", "astar", "movement", "capture", "render")
+COUNTERS = ("rays_cast", "nodes_expanded", "paths_planned")
+
+
+class TickProfiler:
+
+    def __init__(self, output_path=None, flush_interval=None, overlay_window=None):
+        """Rows are written to output_path every flush_interval ticks, as CSV or as JSON lines if it ends in .jsonl"""
+        if flush_interval is None:
+            flush_interval = globals.PROFILER_FLUSH_INTERVAL
+        if overlay_window is None:
+            overlay_window = globals.PROFILER_OVERLAY_WINDOW
+        self.output_path = output_path
+        self.flush_interval = flush_interval
+        self.tick = None
+        self.tick_start_ns = 0
+        self.phase_times_ns = dict.fromkeys(PHASES, 0)
+        self.phase_starts_ns = dict.fromkeys(PHASES, 0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # Rows not written to output_path yet
+        self.rows = []
+        # Rows averaged for the overlay
+        self.recent_rows = deque(maxlen=overlay_window)
+        self.show_overlay = True
+
+    def begin_tick(self, tick):
+        if self.tick is not None:
+            self.end_tick()
+        self.tick = tick
+        self.tick_start_ns = time.perf_counter_ns()
+
+    def end_tick(self):
+        """Closes the current tick. Called by the next begin_tick so that drawing after a step counts towards its tick"""
+        if self.tick is None:
+            return
+        row = {"tick": self.tick, "tick_ms": (time.perf_counter_ns() - self.tick_start_ns) / 1e6}
+        for phase in PHASES:
+            row[f"{phase}_ms"] = self.phase_times_ns[phase] / 1e6
+            self.phase_times_ns[phase] = 0
+        for counter in COUNTERS:
+            row[counter] = self.counters[counter]
+            self.counters[counter] = 0
+        self.tick = None
+        self.recent_rows.append(row)
+        if self.output_path is not None:
+            self.rows.append(row)
+            if len(self.rows) >= self.flush_interval:
+                self.flush()
+
+    def start_phase(self, phase):
+        self.phase_starts_ns[phase] = time.perf_counter_ns()
+
+    def end_phase(self, phase):
+        self.phase_times_ns[phase] += time.perf_counter_ns() - self.phase_starts_ns[phase]
+
+    def count(self, counter, amount=1):
+        self.counters[counter] += amount
+
+    def flush(self):
+        if self.output_path is None or not self.rows:
+            return
+        if self.output_path.endswith(".jsonl"):
+            with open(self.output_path, "a") as f:
+                for row in self.rows:
+                    f.write(json.dumps(row) + "\n")
+        else:
+            write_header = not os.path.exists(self.output_path)
+            with open(self.output_path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(self.rows[0].keys()))
+                if write_header:
+                    writer.writeheader()
+                writer.writerows(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.end_tick()
+        self.flush()
+
+    def get_averages(self):
+        averages = {}
+        if not self.recent_rows:
+            return averages
+        for key in self.recent_rows[0].keys():
+            if key != "tick":
+                averages[key] = sum(row[key] for row in self.recent_rows) / len(self.recent_rows)
+        return averages
+
+    def draw_overlay(self, win, font):
+        """Draws the averages over the last few ticks in the top left corner of the window"""
+        if not self.show_overlay:
+            return
+        averages = self.get_averages()
+        if not averages:
+            return
+        lines = [f"tick {averages['tick_ms']:.2f} ms"]
+        for phase in PHASES:
+            lines.append(f"{phase} {averages[f'{phase}_ms']:.2f} ms")
+        for counter in COUNTERS:
+            lines.append(f"{counter} {averages[counter]:.1f}")
+        line_height = font.get_linesize()
+        # Imported here so that only drawing the overlay needs pygame
+        import pygame
+        background = pygame.Surface((220, line_height * len(lines) + 10), pygame.SRCALPHA)
+        background.fill((0, 0, 0, 170))
+        win.blit(background, (5, 5))
+        for i, line in enumerate(lines):
+            win.blit(font.render(line, True, globals.WHITE), (10, 10 + i * line_height))
+
+
+def enable_profiler(output_path=None, flush_interval=None):
+    globals.profiler = TickProfiler(output_path=output_path, flush_interval=flush_interval)
+    return globals.profiler
+
+
+def disable_profiler():
+    if globals.profiler is not None:
+        globals.profiler.close()
+        globals.profiler = None
@@ -0,0 +1,132 @@
+"""On-disk cache of scenario outcomes. Battles with the same seed play out exactly the same, so a result is keyed by a
+hash of everything that decides the battle: the scenario, the map file, the seed, the number of ticks and the simulator's
+own source. Each result is a JSON file named by its key, and the least recently used are removed past the size limit"""
+import os
+import json
+import hashlib
+import globals
+
+
+SIMULATOR_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# Definition keys that don't change how the battle plays out, the seed and ticks are hashed as they are run instead
+UNHASHED_SCENARIO_KEYS = ("name", "seed", "ticks")
+_simulator_version = None
+
+
+def get_simulator_version():
+    """Hash of the simulator's modules and archetypes, so results of a simulator that has changed since are never returned"""
+    global _simulator_version
+    if _simulator_version is None:
+        version_hash = hashlib.blake2b(digest_size=16)
+        file_names = sorted(file_name for file_name in os.listdir(SIMULATOR_DIRECTORY) if file_name.endswith(".py"))
+        for file_name in file_names + [os.path.basename(globals.ARCHETYPES_FILE)]:
+            version_hash.update(file_name.encode("utf-8"))
+            with open(os.path.join(SIMULATOR_DIRECTORY, file_name), "rb") as f:
+                # Line endings depend on how each machine checked the repository out, distributed workers compare versions
+                version_hash.update(f.read().replace(b"\r\n", b"\n"))
+        _simulator_version = version_hash.hexdigest()
+    return _simulator_version
+
+
+def get_map_hash(scenario):
+    """Hash of the scenario's map file, None for blank and generated maps which only depend on the scenario"""
+    map_path = scenario.get_map_path()
+    if map_path is None:
+        return None
+    map_hash = hashlib.blake2b(digest_size=20)
+    with open(map_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            map_hash.update(block)
+    return map_hash.hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, directory=None, max_bytes=None):
+        if directory is None:
+            directory = globals.RESULT_CACHE_DIRECTORY
+        if max_bytes is None:
+            max_bytes = globals.RESULT_CACHE_MAX_BYTES
+        if not isinstance(max_bytes, int) or max_bytes <= 0: raise ValueError("max_bytes has to be a positive int")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        # Other processes can add results too, so this is only an estimate that is recounted before evicting
+        self.total_bytes = sum(size for path, size, last_used in self.get_entries())
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, scenario, ticks=None):
+        """Key of the scenario run with its seed for ticks ticks (default: the scenario's ticks)"""
+        key_hash = hashlib.blake2b(digest_size=20)
+        definition = {key: value for key, value in scenario.definition.items() if key not in UNHASHED_SCENARIO_KEYS}
+        key_hash.update(json.dumps({"scenario": definition, "seed": scenario.seed, "ticks": scenario.ticks if ticks is None else ticks,
+                                    "dt": scenario.dt, "simulator": get_simulator_version(), "map": get_map_hash(scenario)},
+                                   sort_keys=True).encode("utf-8"))
+        return key_hash.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached outcome or None, and marks it as used"""
+        path = self.get_path(key)
+        try:
+            with open(path, "r") as f:
+                outcome = json.load(f)
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # A result evicted by another process or left half written by a crash counts as missing
+            self.misses += 1
+            return None
+        self.hits += 1
+        return outcome
+
+    def __contains__(self, key):
+        return os.path.exists(self.get_path(key))
+
+    def put(self, key, outcome):
+        path = self.get_path(key)
+        # Written to a temporary file first so a crash never leaves a half written result under the key
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(outcome, f)
+        os.replace(temporary_path, path)
+        self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def get_entries(self):
+        """Format: [(path, size, last used time)] of every cached result"""
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self):
+        """Removes the least recently used results until the cache is under max_bytes"""
+        entries = sorted(self.get_entries(), key=lambda entry: entry[2])
+        self.total_bytes = sum(size for path, size, last_used in entries)
+        for path, size, last_used in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+
+    def clear(self):
+        for path, size, last_used in self.get_entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.total_bytes = 0
@@ -0,0 +1,86 @@
+"""Runs a scenario file without a window or tkinter and prints a JSON summary of how the battle ended, for running many
+battles from shell scripts and job schedulers. The exit code is 0 when the battle ran and 1 when the scenario is invalid"""
+import argparse
+import json
+import sys
+import time
+import globals
+from scenario import Scenario
+from branching import summarize_simulation
+from telemetry import enable_telemetry, disable_telemetry
+from result_cache import ResultCache
+
+
+def run_battle(scenario, ticks=None):
+    """Runs the scenario and returns the simulation at its last tick and the capture timeline.
+    Format: {capture point id: [[tick, faction], ...]}, the owner at the start and every change of owner after"""
+    simulation = scenario.build_simulation()
+    capture_points = list(globals.capture_point_dict.values())
+    capture_timeline = {capture_point.id: [[0, capture_point.current_faction]] for capture_point in capture_points}
+    for i in range(0, scenario.ticks if ticks is None else ticks):
+        simulation.step(scenario.dt)
+        for capture_point in capture_points:
+            if capture_point.current_faction != capture_timeline[capture_point.id][-1][1]:
+                capture_timeline[capture_point.id].append([simulation.tick, capture_point.current_faction])
+    return simulation, capture_timeline
+
+
+def get_outcome(simulation, capture_timeline):
+    """How the battle ended, capture point ids are strings so an outcome read back from the cache is the same"""
+    outcome = summarize_simulation(simulation)
+    outcome["capture_points"] = {str(id): faction for id, faction in outcome["capture_points"].items()}
+    outcome["capture_timeline"] = {str(id): timeline for id, timeline in capture_timeline.items()}
+    return outcome
+
+
+def run_scenario(scenario, ticks=None, telemetry_directory=None, cache=None):
+    """Runs the scenario and returns its outcome with the run's seed and ticks per second.
+    If the cache has the outcome of the same run it is returned without running the battle, and ticks per second is None"""
+    key = None
+    # Battles without a seed play out differently every run, and telemetry is only recorded by running the battle
+    if cache is not None and scenario.seed is not None and telemetry_directory is None:
+        key = cache.get_key(scenario, ticks)
+        outcome = cache.get(key)
+        if outcome is not None:
+            return dict(outcome, scenario=scenario.name, seed=scenario.seed, cached=True, ticks_per_second=None)
+    if telemetry_directory is not None:
+        enable_telemetry(telemetry_directory)
+    try:
+        start = time.perf_counter()
+        simulation, capture_timeline = run_battle(scenario, ticks)
+        elapsed = time.perf_counter() - start
+    finally:
+        if telemetry_directory is not None:
+            disable_telemetry()
+    outcome = get_outcome(simulation, capture_timeline)
+    if key is not None:
+        cache.put(key, outcome)
+    return dict(outcome, scenario=scenario.name, seed=scenario.seed, cached=False,
+                ticks_per_second=simulation.tick / elapsed if elapsed > 0 else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a battle scenario file headless and print a JSON summary")
+    parser.add_argument("scenario", help="scenario file (.json or .toml), see scenario.py for the format")
+    parser.add_argument("--ticks", type=int, default=None, help="number of ticks to run (default: the scenario's ticks)")
+    parser.add_argument("--seed", type=int, default=None, help="seed to run with instead of the scenario's seed")
+    parser.add_argument("--output", default=None, help="write the JSON summary to this file instead of stdout")
+    parser.add_argument("--telemetry", default=None, help="record battle telemetry into this directory")
+    parser.add_argument("--cache", nargs="?", const=globals.RESULT_CACHE_DIRECTORY, default=None,
+                        help=f"return the cached outcome of the same run if there is one and cache it otherwise (default directory: {globals.RESULT_CACHE_DIRECTORY})")
+    args = parser.parse_args()
+    try:
+        loaded_scenario = Scenario.from_file(args.scenario)
+        if args.seed is not None:
+            loaded_scenario.seed = args.seed
+        globals.seed = loaded_scenario.seed
+        result = run_scenario(loaded_scenario, ticks=args.ticks, telemetry_directory=args.telemetry,
+                              cache=ResultCache(args.cache) if args.cache is not None else None)
+    except (TypeError, ValueError, KeyError, OSError) as error:
+        print(f"{args.scenario}: {error}", file=sys.stderr)
+        sys.exit(1)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
@@ -0,0 +1,189 @@
+"""Battles described in a scenario file instead of set up by clicking through the GUI: the map, where the spawn and capture
+points are, how many soldiers each faction has with their weapon and aim distributions, and how many ticks to run with
+which seed. Scenario files are JSON, or TOML when they end in .toml.
+
+Example:
+{"map": {"generate": {"style": "cellular automata", "rows": 40, "cols": 80, "seed": 7}},
+ "spawn_points": [{"faction": "NC", "square": [5, 5]}, {"faction": "TR", "position": [1100, 500], "spawn_timer": 500}],
+ "capture_points": [{"square": [17, 40]}],
+ "factions": {"NC": {"soldiers": 30, "weapons": {"short range": 2, "long range": 1}, "aim": [0.5, 1]},
+              "TR": {"soldiers": 30}},
+ "ticks": 5000, "seed": 7}
+
+The map is a saved map's name ("Blank" and "Randomly Generated" work like in the GUI), {"file": path} relative to the
+scenario file or {"generate": generate_random_map keyword arguments}. Generated maps use the scenario's seed unless they
+have their own, which keeps the map the same when the battle is run with other seeds. Spawn and capture points are placed at a world
+"position" or at the center of a grid "square". Weapons are weights of archetype names, aim is a uniform [minimum, maximum]
+range, and factions that leave them out get the GUI's random weapons and aim"""
+import json
+import os
+import _pickle
+import globals
+from utility import *
+from map import Map
+from simulation import Simulation
+from archetypes import get_archetype
+
+
+SCENARIO_KEYS = ("name", "map", "spawn_points", "capture_points", "factions", "ticks", "seed", "dt")
+FACTION_KEYS = ("soldiers", "weapons", "aim")
+GENERATE_MAP_KEYS = ("style", "rows", "cols", "p_of_wall", "seed")
+
+
+class Scenario:
+
+    def __init__(self, definition, directory=None):
+        """definition is the parsed scenario file, directory is where relative map files are looked for"""
+        if not isinstance(definition, dict): raise TypeError("definition has to be a dict")
+        unknown_keys = set(definition.keys()) - set(SCENARIO_KEYS)
+        if unknown_keys: raise ValueError(f"Unknown scenario keys {sorted(unknown_keys)}, they have to be some of {SCENARIO_KEYS}")
+        self.name = definition.get("name", "scenario")
+        self.map = definition.get("map", "Blank")
+        self.spawn_points = definition.get("spawn_points", [])
+        self.capture_points = definition.get("capture_points", [])
+        self.factions = definition.get("factions", {})
+        self.ticks = definition.get("ticks", 2000)
+        self.seed = definition.get("seed", None)
+        self.dt = definition.get("dt", 1000 / globals.FPS)
+        self.directory = directory if directory is not None else os.getcwd()
+        self.definition = definition
+        self.validate()
+
+    @classmethod
+    def from_file(cls, path):
+        if path.endswith(".toml"):
+            # tomllib is only in the standard library from Python 3.11, it is imported here so JSON scenarios work without it
+            import tomllib
+            with open(path, "rb") as f:
+                definition = tomllib.load(f)
+        else:
+            with open(path, "r") as f:
+                definition = json.load(f)
+        definition.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+        return cls(definition, directory=os.path.dirname(os.path.abspath(path)))
+
+    def validate(self):
+        if not isinstance(self.name, str): raise TypeError("name has to be a string")
+        if not isinstance(self.map, (str, dict)): raise TypeError("map has to be a map name or a dict")
+        if isinstance(self.map, dict):
+            if len(self.map) != 1 or not ("file" in self.map or "generate" in self.map): raise ValueError("map has to have exactly one of file or generate")
+            if "generate" in self.map:
+                if not isinstance(self.map["generate"], dict): raise TypeError("map generate has to be a dict")
+                unknown_keys = set(self.map["generate"].keys()) - set(GENERATE_MAP_KEYS)
+                if unknown_keys: raise ValueError(f"Unknown map generate keys {sorted(unknown_keys)}, they have to be some of {GENERATE_MAP_KEYS}")
+        if not isinstance(self.ticks, int) or self.ticks < 0: raise ValueError("ticks has to be a non-negative int")
+        if self.seed is not None and not isinstance(self.seed, int): raise TypeError("seed has to be an int or None")
+        if not isinstance(self.dt, (int, float)) or self.dt <= 0: raise ValueError("dt has to be a positive number")
+        for spawn_point in self.spawn_points:
+            if spawn_point.get("faction") not in globals.FACTION_LIST: raise ValueError(f"spawn point faction has to be one of {globals.FACTION_LIST}")
+            if spawn_point.get("type", "Sunderer") not in globals.SPAWN_TYPES: raise ValueError(f"spawn point type has to be one of {globals.SPAWN_TYPES}")
+            if "spawn_timer" in spawn_point and (not isinstance(spawn_point["spawn_timer"], int) or spawn_point["spawn_timer"] < 0): raise ValueError("spawn_timer has to be a non-negative int")
+            self.validate_placement(spawn_point)
+        for capture_point in self.capture_points:
+            if capture_point.get("faction", "Neutral") not in ["Neutral"] + globals.FACTION_LIST: raise ValueError(f"capture point faction has to be Neutral or one of {globals.FACTION_LIST}")
+            self.validate_placement(capture_point)
+        if not isinstance(self.factions, dict): raise TypeError("factions has to be a dict of faction name to soldiers")
+        for faction, soldiers in self.factions.items():
+            if faction not in globals.FACTION_LIST: raise ValueError(f"faction has to be one of {globals.FACTION_LIST}")
+            unknown_keys = set(soldiers.keys()) - set(FACTION_KEYS)
+            if unknown_keys: raise ValueError(f"Unknown {faction} keys {sorted(unknown_keys)}, they have to be some of {FACTION_KEYS}")
+            if not isinstance(soldiers.get("soldiers", 0), int) or soldiers.get("soldiers", 0) < 0: raise ValueError(f"{faction} soldiers has to be a non-negative int")
+            weapons = soldiers.get("weapons")
+            if weapons is not None:
+                if not isinstance(weapons, dict) or not weapons: raise TypeError(f"{faction} weapons has to be a dict of archetype name to weight")
+                if any(not isinstance(weight, (int, float)) or weight < 0 for weight in weapons.values()) or sum(weapons.values()) <= 0: raise ValueError(f"{faction} weapon weights have to be non-negative and not all 0")
+                for weapon_type in weapons:
+                    get_archetype(weapon_type)
+            aim = soldiers.get("aim")
+            if aim is not None:
+                if not isinstance(aim, list) or len(aim) != 2 or not 0 <= aim[0] <= aim[1] <= 1: raise ValueError(f"{faction} aim has to be [minimum, maximum] between 0 and 1")
+
+    def validate_placement(self, placement):
+        if ("position" in placement) == ("square" in placement): raise ValueError("placements have to have exactly one of position or square")
+        coordinates = placement.get("position", placement.get("square"))
+        if not isinstance(coordinates, list) or len(coordinates) != 2: raise ValueError("position and square have to be [x, y] and [row, col]")
+
+    def get_map_path(self):
+        """Path of the file the map is loaded from, None for blank and generated maps"""
+        if isinstance(self.map, dict):
+            return os.path.join(self.directory, self.map["file"]) if "file" in self.map else None
+        if self.map in ("Blank", "Randomly Generated"):
+            return None
+        if os.path.exists(f"{globals.MAPS_DIRECTORY}{self.map}.{globals.TILED_MAP_EXTENSION}"):
+            return f"{globals.MAPS_DIRECTORY}{self.map}.{globals.TILED_MAP_EXTENSION}"
+        return f"{globals.MAPS_DIRECTORY}{self.map}.txt"
+
+    def load_map(self, win):
+        """Loads the map the same way SimulationPage.load_map does for saved maps"""
+        path = self.get_map_path()
+        if path is None:
+            if isinstance(self.map, dict):
+                generate = self.map["generate"]
+                map_array = globals.generate_random_map(width=generate.get("cols", 80), height=generate.get("rows"),
+                                                        p_of_wall=generate.get("p_of_wall", 0.2), style=generate.get("style", "center weighted"),
+                                                        seed=generate.get("seed", self.seed))
+            elif self.map == "Blank":
+                map_array = globals.MAP_BLANK
+            else:
+                map_array = globals.generate_random_map(seed=self.seed)
+            return Map(win=win, map_array=map_array, wall_color=globals.BROWNISH_GREY)
+        if path.endswith(f".{globals.TILED_MAP_EXTENSION}"):
+            return Map.from_tiled_file(win=win, path=path, wall_color=globals.BROWNISH_GREY)
+        with open(path, "rb") as f:
+            map_array = _pickle.load(f)
+        return Map(win=win, map_array=map_array, wall_color=globals.BROWNISH_GREY)
+
+    @staticmethod
+    def get_placement_coordinates(map, placement):
+        """placement has a "position" [x, y] in world coordinates or a "square" [row, col] on the map"""
+        if "position" in placement:
+            coordinates = Point(*placement["position"])
+        else:
+            row, col = placement["square"]
+            if not 0 <= row < map.nrows or not 0 <= col < map.ncols: raise ValueError(f"square {placement['square']} is outside the map")
+            coordinates = Point(col * map.grid_width + map.grid_width / 2, row * map.grid_width + map.grid_width / 2)
+        if not map.is_point_in_world(coordinates): raise ValueError(f"{placement} is outside the map")
+        # Soldiers couldn't reach a point inside a wall and would search the whole map for a path to it every tick
+        row, col = map.get_grid_position_of_point(coordinates)
+        if map.map_array[row][col] == 1: raise ValueError(f"{placement} is inside a wall")
+        return coordinates
+
+    def build_simulation(self, win=None):
+        """Returns a new Simulation set up as the scenario describes, drawing on win or headless if win is None"""
+        map = self.load_map(win)
+        simulation = Simulation(win=win, map=map, seed=self.seed)
+        for spawn_point in self.spawn_points:
+            new_spawn_point = simulation.create_spawn_point(coordinates=self.get_placement_coordinates(map, spawn_point),
+                                                            faction=spawn_point["faction"], spawn_type=spawn_point.get("type", "Sunderer"))
+            if "spawn_timer" in spawn_point:
+                new_spawn_point.spawn_timer = spawn_point["spawn_timer"]
+        for capture_point in self.capture_points:
+            simulation.create_capture_point(coordinates=self.get_placement_coordinates(map, capture_point),
+                                            faction=capture_point.get("faction", "Neutral"))
+        for faction, soldiers in self.factions.items():
+            self.add_soldiers(simulation, faction, soldiers)
+        return simulation
+
+    def add_soldiers(self, simulation, faction, soldiers):
+        number_of_soldiers = soldiers.get("soldiers", 0)
+        weapons = soldiers.get("weapons")
+        aim = soldiers.get("aim")
+        if weapons is None and aim is None:
+            simulation.add_soldiers(faction=faction, number_of_soldiers=number_of_soldiers)
+            return
+        for i in range(0, number_of_soldiers):
+            if weapons is None:
+                weapon_type = simulation.rng.choice(globals.WEAPON_TYPES)
+            else:
+                weapon_type = simulation.rng.choices(list(weapons.keys()), weights=list(weapons.values()))[0]
+            if aim is None:
+                aim_factor = min(simulation.rng.random() + 0.3, 1)
+            else:
+                aim_factor = simulation.rng.uniform(aim[0], aim[1])
+            simulation.create_soldier(faction=faction, weapon_type=weapon_type, aim_factor=aim_factor)
+
+    def run(self, win=None, ticks=None):
+        """Builds and runs the battle, returns the simulation at its last tick"""
+        simulation = self.build_simulation(win)
+        simulation.run(self.ticks if ticks is None else ticks, self.dt)
+        return simulation
@@ -0,0 +1,170 @@
+"""Engine-wide ring buffer of the shots and rays of the battle in a preallocated NumPy structured array, read through one
+view per column. Soldiers record into it during the tick, the renderer, the snapshot viewer and telemetry read the tick's
+events back out of it, and projectiles with a travel time stay in it until they arrive"""
+import heapq
+import numpy as np
+import globals
+
+
+# Event kinds. Hit-scan shots land the tick they are fired, projectiles after their travel time and rays are only drawn
+HITSCAN = 0
+PROJECTILE = 1
+RAY = 2
+COLUMNS = (("tick", np.int64), ("arrival_tick", np.int64), ("kind", np.int8), ("shooter_id", np.int32), ("target_id", np.int32),
+           ("faction", np.int8), ("hit", np.bool_), ("killed", np.bool_), ("damage", np.float64), ("distance", np.float32),
+           ("visible", np.bool_), ("color", np.uint8, 3), ("x0", np.float64), ("y0", np.float64), ("x1", np.float64), ("y1", np.float64))
+# One record per event, so recording an event is a single write instead of one per column
+EVENT_DTYPE = np.dtype(list(COLUMNS))
+FACTION_CODES = {"Neutral": 0, "TR": 1, "NC": 2, "VS": 3}
+
+
+class ShotBuffer:
+    """Events are numbered in the order they are recorded and event n is kept in slot n % capacity. The buffer doubles
+    instead of overwriting an event of the current tick or a projectile that hasn't arrived yet"""
+
+    def __init__(self, capacity=None):
+        if capacity is None:
+            capacity = globals.SHOT_BUFFER_CAPACITY
+        if not isinstance(capacity, int) or capacity <= 0: raise ValueError("capacity has to be a positive int")
+        self.capacity = capacity
+        self.set_events(np.zeros(capacity, dtype=EVENT_DTYPE))
+        self.clear()
+
+    def set_events(self, events):
+        self.events = events
+        # Format: {column name: view of the column in events}
+        self.columns = {column[0]: events[column[0]] for column in COLUMNS}
+
+    def clear(self):
+        self.tick = 0
+        self.next_event_number = 0
+        self.tick_start_event_number = 0
+        # Format: (arrival tick, event number), a heap of the projectiles in flight
+        self.in_flight = []
+        self.oldest_in_flight_event_number = None
+        # Projectiles that arrived this tick, telemetry records them along with the tick's hit-scan shots
+        self.arrived_event_numbers = []
+
+    def begin_tick(self, tick):
+        self.tick = tick
+        self.tick_start_event_number = self.next_event_number
+        self.arrived_event_numbers = []
+
+    def record(self, kind, shooter, origin, end, color, target=None, hit=False, damage=0, distance=0, killed=False, travel_ticks=0):
+        """Returns the event number of the new event"""
+        self.make_room()
+        event_number = self.next_event_number
+        # In COLUMNS order
+        self.events[event_number % self.capacity] = (self.tick, self.tick + travel_ticks, kind, shooter.id,
+                                                     target.id if target is not None else -1, FACTION_CODES[shooter.faction],
+                                                     hit, killed, damage, distance, shooter.show_rays, color,
+                                                     origin.x, origin.y, end.x, end.y)
+        self.next_event_number += 1
+        if kind == PROJECTILE:
+            heapq.heappush(self.in_flight, (self.tick + travel_ticks, event_number))
+            if self.oldest_in_flight_event_number is None:
+                self.oldest_in_flight_event_number = event_number
+        return event_number
+
+    def restore_projectile(self, event):
+        """Puts a projectile in flight from {column name: value}, as returned by get_event, when a battle is restored"""
+        self.make_room()
+        event_number = self.next_event_number
+        slot = event_number % self.capacity
+        for name, column in self.columns.items():
+            column[slot] = event[name]
+        self.next_event_number += 1
+        heapq.heappush(self.in_flight, (int(event["arrival_tick"]), event_number))
+        if self.oldest_in_flight_event_number is None:
+            self.oldest_in_flight_event_number = event_number
+        # Restored projectiles aren't events of the tick the battle continues from
+        self.tick_start_event_number = self.next_event_number
+
+    def make_room(self):
+        """Grows the buffer if the next event would overwrite one that is still needed"""
+        oldest_kept = self.tick_start_event_number
+        if self.oldest_in_flight_event_number is not None:
+            oldest_kept = min(oldest_kept, self.oldest_in_flight_event_number)
+        if self.next_event_number - oldest_kept >= self.capacity:
+            self.grow()
+
+    def grow(self):
+        new_capacity = self.capacity * 2
+        first_event_number = max(self.next_event_number - self.capacity, 0)
+        event_numbers = np.arange(first_event_number, self.next_event_number)
+        new_events = np.zeros(new_capacity, dtype=EVENT_DTYPE)
+        new_events[event_numbers % new_capacity] = self.events[event_numbers % self.capacity]
+        self.set_events(new_events)
+        self.capacity = new_capacity
+
+    def set_killed(self, event_number, killed):
+        self.columns["killed"][event_number % self.capacity] = killed
+
+    def pop_arrivals(self, tick):
+        """Event numbers of the projectiles arriving by tick, in the order they were fired when they arrive together"""
+        arrived = []
+        while self.in_flight and self.in_flight[0][0] <= tick:
+            arrived.append(heapq.heappop(self.in_flight)[1])
+        if arrived:
+            self.arrived_event_numbers.extend(arrived)
+            self.oldest_in_flight_event_number = min((event_number for arrival_tick, event_number in self.in_flight), default=None)
+        return arrived
+
+    def get_event(self, event_number):
+        """Returns {column name: value} of one event"""
+        slot = event_number % self.capacity
+        return {name: column[slot] for name, column in self.columns.items()}
+
+    def get_tick_slots(self):
+        return np.arange(self.tick_start_event_number, self.next_event_number) % self.capacity
+
+    def get_resolved_shots(self):
+        """Columns of the hit-scan shots fired and the projectiles that arrived this tick"""
+        slots = self.get_tick_slots()
+        slots = slots[self.columns["kind"][slots] == HITSCAN]
+        if self.arrived_event_numbers:
+            slots = np.concatenate((slots, np.array(self.arrived_event_numbers) % self.capacity))
+        return {name: column[slots] for name, column in self.columns.items()}
+
+    def get_in_flight_event_numbers(self):
+        return sorted(event_number for arrival_tick, event_number in self.in_flight)
+
+    def get_visible_segments(self):
+        """Returns (x0, y0, x1, y1, colors) of the lines to draw: this tick's shots and rays, and the part of their path
+        that projectiles in flight covered this tick"""
+        slots = self.get_tick_slots()
+        columns = self.columns
+        slots = slots[columns["visible"][slots] & (columns["kind"][slots] != PROJECTILE)]
+        x0, y0, x1, y1 = columns["x0"][slots], columns["y0"][slots], columns["x1"][slots], columns["y1"][slots]
+        colors = columns["color"][slots]
+        if self.in_flight:
+            flight_slots = np.array([event_number for arrival_tick, event_number in self.in_flight]) % self.capacity
+            flight_slots = flight_slots[columns["visible"][flight_slots]]
+            fire_tick = columns["tick"][flight_slots]
+            travel_ticks = np.maximum(columns["arrival_tick"][flight_slots] - fire_tick, 1)
+            start_fraction = np.clip((self.tick - fire_tick) / travel_ticks, 0, 1)
+            end_fraction = np.clip((self.tick + 1 - fire_tick) / travel_ticks, 0, 1)
+            dx = columns["x1"][flight_slots] - columns["x0"][flight_slots]
+            dy = columns["y1"][flight_slots] - columns["y0"][flight_slots]
+            x0 = np.concatenate((x0, columns["x0"][flight_slots] + dx * start_fraction))
+            y0 = np.concatenate((y0, columns["y0"][flight_slots] + dy * start_fraction))
+            x1 = np.concatenate((x1, columns["x0"][flight_slots] + dx * end_fraction))
+            y1 = np.concatenate((y1, columns["y0"][flight_slots] + dy * end_fraction))
+            colors = np.concatenate((colors, columns["color"][flight_slots]))
+        return x0, y0, x1, y1, colors
+
+    def draw(self, win, camera):
+        """Culls and transforms the visible segments to the screen as arrays, pygame then draws them one line at a time"""
+        from pygame import draw
+        x0, y0, x1, y1, colors = self.get_visible_segments()
+        if len(x0) == 0:
+            return
+        left, top, right, bottom = camera.get_visible_world_rect()
+        start_visible = (left <= x0) & (x0 <= right) & (top <= y0) & (y0 <= bottom)
+        end_visible = (left <= x1) & (x1 <= right) & (top <= y1) & (y1 <= bottom)
+        # Segments are short compared to the world so a segment with neither end in view is skipped
+        visible = start_visible | end_visible
+        screen_starts = np.column_stack(((x0[visible] - camera.x) * camera.zoom, (y0[visible] - camera.y) * camera.zoom)).tolist()
+        screen_ends = np.column_stack(((x1[visible] - camera.x) * camera.zoom, (y1[visible] - camera.y) * camera.zoom)).tolist()
+        for color, start, end in zip(colors[visible].tolist(), screen_starts, screen_ends):
+            draw.line(win, color, start, end, width=1)
@@ -0,0 +1,156 @@
+"""Battle state and tick logic, separate from the pygame pages so battles can also be run without a window"""
+from random import Random
+import globals
+from utility import *
+from entity import Soldier, CapturePoint, Sunderer
+from shot_buffer import ShotBuffer
+from neighbor_grid import NeighborGrid
+
+
+def reset_simulation_state():
+    """Clears every entity from the shared state so a new battle starts empty"""
+    globals.entity_list.clear()
+    globals.soldiers_dict.clear()
+    globals.spawn_point_dict.clear()
+    globals.capture_point_dict.clear()
+    globals.next_soldiers_dict_key = 0
+    globals.next_spawn_dict_key = 0
+    globals.next_capture_point_dict_key = 0
+    if globals.shot_buffer is not None:
+        globals.shot_buffer.clear()
+
+
+class Simulation:
+
+    def __init__(self, win, map, seed=None):
+        self.win = win
+        self.map = map
+        self.seed = seed
+        # Every random decision in the battle comes from this generator so the same seed gives the same battle
+        self.rng = Random(seed)
+        self.tick = 0
+        if globals.shot_buffer is None:
+            globals.shot_buffer = ShotBuffer()
+        globals.neighbor_grid = NeighborGrid() if globals.SEPARATE_SOLDIERS else None
+        reset_simulation_state()
+        self.map.add_change_listener(self.on_map_cell_changed)
+
+    def step(self, dt):
+        """Advances the battle by one tick"""
+        globals.dt = dt
+        if globals.profiler is not None:
+            globals.profiler.begin_tick(self.tick)
+        if globals.ai_scheduler is not None:
+            globals.ai_scheduler.begin_tick(self.tick)
+        globals.shot_buffer.begin_tick(self.tick)
+        self.resolve_projectiles()
+        if globals.neighbor_grid is not None:
+            globals.neighbor_grid.rebuild(globals.soldiers_dict.values())
+        # Keep the map chunks that living soldiers and capture points are in loaded
+        if self.map.is_chunked:
+            self.map.pin_chunks_at_points([soldier.coordinates_center for soldier in globals.soldiers_dict.values() if soldier.alive] +
+                                          [capture_point.coordinates_center for capture_point in globals.capture_point_dict.values()])
+        for entity in globals.entity_list:
+            entity.update_at_start_of_frame()
+        if globals.ai_scheduler is not None:
+            globals.ai_scheduler.end_tick()
+        if globals.telemetry is not None:
+            globals.telemetry.record_tick(self.tick)
+        self.tick += 1
+
+    def resolve_projectiles(self):
+        """Applies the hits of the projectiles that arrive this tick, a target that died or respawned meanwhile isn't hit"""
+        shot_buffer = globals.shot_buffer
+        for event_number in shot_buffer.pop_arrivals(self.tick):
+            event = shot_buffer.get_event(event_number)
+            if not event["hit"]:
+                continue
+            shooter = globals.soldiers_dict.get(int(event["shooter_id"]))
+            target = globals.soldiers_dict.get(int(event["target_id"]))
+            if shooter is None or target is None or not target.alive or target.health <= 0:
+                continue
+            shot_buffer.set_killed(event_number, shooter.hit_enemy(target, float(event["damage"])))
+
+    def set_wall(self, grid_position, is_wall):
+        """Adds or removes a wall while the battle is running"""
+        self.map.set_cell(grid_position[0], grid_position[1], 1 if is_wall else 0)
+
+    def on_map_cell_changed(self, row, col, old_value, new_value):
+        """Soldiers whose queued or still searched for path goes through a new wall drop it and plan again on their next move.
+        Paths are straight lines between their waypoints, so each leg is checked and not only the waypoints' squares"""
+        if new_value != 1:
+            return
+        wall_x, wall_y = self.map.grid_coordinates[row][col]
+        wall_width = self.map.grid_width
+        for soldier in globals.soldiers_dict.values():
+            if not soldier.alive:
+                continue
+            # A path the AI scheduler is still searching for (or hasn't handed over yet) may lead through the new wall if
+            # its search already reached the square, so it's searched for again
+            if soldier.path_request is not None and (row, col) in soldier.path_request.g_scores:
+                soldier.path_request = None
+            # The next waypoint is at the end of the queue
+            waypoints = [soldier.coordinates_center]
+            if soldier.destination is not None:
+                waypoints.append(soldier.destination)
+            waypoints.extend(reversed(soldier.destination_queue))
+            for i in range(1, len(waypoints)):
+                start, end = waypoints[i - 1], waypoints[i]
+                # Only legs passing near the new wall can go through it
+                if max(start.x, end.x) < wall_x or min(start.x, end.x) > wall_x + wall_width:
+                    continue
+                if max(start.y, end.y) < wall_y or min(start.y, end.y) > wall_y + wall_width:
+                    continue
+                if not self.map.has_line_of_sight(start, end):
+                    soldier.cancel_all_queued_moves()
+                    break
+
+    def run(self, number_of_ticks, dt):
+        for i in range(0, number_of_ticks):
+            self.step(dt)
+
+    def create_spawn_point(self, coordinates, faction, spawn_type="Sunderer"):
+        if spawn_type not in globals.SPAWN_TYPES: raise ValueError(f"spawn_type has to be one of {globals.SPAWN_TYPES}")
+        if spawn_type == "Sunderer":
+            new_spawn_point = Sunderer(win=self.win, map=self.map, id=globals.next_spawn_dict_key,
+                                       coordinates=coordinates, faction=faction, rng=self.rng)
+        globals.spawn_point_dict[globals.next_spawn_dict_key] = new_spawn_point
+        globals.entity_list.append(new_spawn_point)
+        globals.next_spawn_dict_key += 1
+        return new_spawn_point
+
+    def create_capture_point(self, coordinates, faction="Neutral"):
+        new_capture_point = CapturePoint(win=self.win, map=self.map, id=globals.next_capture_point_dict_key,
+                                         coordinates=coordinates, faction=faction, rng=self.rng)
+        globals.capture_point_dict[globals.next_capture_point_dict_key] = new_capture_point
+        globals.entity_list.append(new_capture_point)
+        globals.next_capture_point_dict_key += 1
+        return new_capture_point
+
+    def remove_spawn_point(self, id):
+        """Soldiers pick a spawn point every time they respawn, so none of them hold on to a removed one"""
+        spawn_point = globals.spawn_point_dict.pop(id)
+        globals.entity_list.remove(spawn_point)
+        return spawn_point
+
+    def remove_capture_point(self, id):
+        """Soldiers pick the capture point to go to every tick, so the ones heading to a removed one turn on their next tick"""
+        capture_point = globals.capture_point_dict.pop(id)
+        globals.entity_list.remove(capture_point)
+        return capture_point
+
+    def create_soldier(self, faction, weapon_type, aim_factor, coordinates=None):
+        new_soldier = Soldier(win=self.win, map=self.map, id=globals.next_soldiers_dict_key,
+                              shape="square", width=5, coordinates=coordinates, faction=faction,
+                              weapon_type=weapon_type, aim_factor=aim_factor, rng=self.rng)
+        globals.soldiers_dict[globals.next_soldiers_dict_key] = new_soldier
+        globals.entity_list.append(new_soldier)
+        globals.next_soldiers_dict_key += 1
+        return new_soldier
+
+    def add_soldiers(self, faction, number_of_soldiers):
+        """Adds soldiers with a random weapon type and aim, they appear once a spawn point of their faction is ready"""
+        for i in range(0, number_of_soldiers):
+            random_weapon_type = self.rng.choice(globals.WEAPON_TYPES)
+            aim_factor = min(self.rng.random() + 0.3, 1)
+            self.create_soldier(faction=faction, weapon_type=random_weapon_type, aim_factor=aim_factor)
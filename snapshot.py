@@ -0,0 +1,126 @@
+"""Double-buffered shared memory snapshots of what a battle looks like after a tick, so another process can draw it.
+The simulation writes into the buffer the reader isn't pointed at and then flips to it. Each buffer has a sequence
+number that is odd while it is being written, so a reader that raced a write can tell and read again"""
+from multiprocessing import shared_memory
+import numpy as np
+import globals
+
+
+SQUARE = 0
+CIRCLE = 1
+# Format: shape, top left (squares) or center (circles), width (squares) or radius (circles), capture radius ring
+ENTITY_RECORD = np.dtype([("shape", np.uint8), ("color", np.uint8, 3), ("x", np.float64), ("y", np.float64),
+                          ("size", np.float64), ("ring_radius", np.float64)])
+RAY_RECORD = np.dtype([("color", np.uint8, 3), ("x0", np.float64), ("y0", np.float64), ("x1", np.float64), ("y1", np.float64)])
+# Format: latest complete buffer, stop requested by the reader
+CONTROL_FIELDS = 2
+LATEST, STOP = range(0, CONTROL_FIELDS)
+# Format: sequence number, tick, number of entities, number of rays
+BUFFER_HEADER_FIELDS = 4
+SEQUENCE, TICK, NUMBER_OF_ENTITIES, NUMBER_OF_RAYS = range(0, BUFFER_HEADER_FIELDS)
+
+
+class SnapshotBuffer:
+
+    def __init__(self, name=None, entity_capacity=None, ray_capacity=None):
+        """Creates the shared memory when name is None, otherwise attaches to the one the simulation created"""
+        if entity_capacity is None:
+            entity_capacity = globals.SNAPSHOT_ENTITY_CAPACITY
+        if ray_capacity is None:
+            ray_capacity = globals.SNAPSHOT_RAY_CAPACITY
+        if not isinstance(entity_capacity, int) or entity_capacity <= 0: raise ValueError("entity_capacity has to be a positive int")
+        if not isinstance(ray_capacity, int) or ray_capacity <= 0: raise ValueError("ray_capacity has to be a positive int")
+        self.entity_capacity = entity_capacity
+        self.ray_capacity = ray_capacity
+        integer_size = np.dtype(np.int64).itemsize
+        buffer_size = BUFFER_HEADER_FIELDS * integer_size + entity_capacity * ENTITY_RECORD.itemsize + ray_capacity * RAY_RECORD.itemsize
+        self.is_owner = name is None
+        if self.is_owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=CONTROL_FIELDS * integer_size + 2 * buffer_size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.control = np.ndarray(CONTROL_FIELDS, dtype=np.int64, buffer=self.memory.buf)
+        self.headers = []
+        self.entities = []
+        self.rays = []
+        offset = CONTROL_FIELDS * integer_size
+        for i in range(0, 2):
+            self.headers.append(np.ndarray(BUFFER_HEADER_FIELDS, dtype=np.int64, buffer=self.memory.buf, offset=offset))
+            offset += BUFFER_HEADER_FIELDS * integer_size
+            self.entities.append(np.ndarray(entity_capacity, dtype=ENTITY_RECORD, buffer=self.memory.buf, offset=offset))
+            offset += entity_capacity * ENTITY_RECORD.itemsize
+            self.rays.append(np.ndarray(ray_capacity, dtype=RAY_RECORD, buffer=self.memory.buf, offset=offset))
+            offset += ray_capacity * RAY_RECORD.itemsize
+        if self.is_owner:
+            self.control[:] = 0
+            for header in self.headers:
+                header[:] = 0
+            # Nothing has been published yet
+            self.control[LATEST] = -1
+
+    def publish(self, tick, entity_list, shot_buffer=None):
+        """Writes the entities and the shot buffer's lines into the buffer that isn't the latest one and makes it the latest.
+        Entities and rays past the capacities are left out"""
+        buffer_index = 1 - self.control[LATEST] if self.control[LATEST] != -1 else 0
+        header = self.headers[buffer_index]
+        entity_records = []
+        for entity in entity_list:
+            if entity.coordinates is None:
+                continue
+            entity.update_color()
+            ring_radius = entity.capture_radius if getattr(entity, "draw_radius", False) else 0
+            if entity.shape == "square":
+                entity_records.append((SQUARE, entity.color, entity.coordinates.x, entity.coordinates.y, entity.width, ring_radius))
+            else:
+                entity_records.append((CIRCLE, entity.color, entity.coordinates.x, entity.coordinates.y, entity.radius, ring_radius))
+        entity_records = entity_records[:self.entity_capacity]
+        header[SEQUENCE] += 1
+        if entity_records:
+            self.entities[buffer_index][:len(entity_records)] = entity_records
+        number_of_rays = 0
+        if shot_buffer is not None:
+            x0, y0, x1, y1, colors = shot_buffer.get_visible_segments()
+            number_of_rays = min(len(x0), self.ray_capacity)
+            rays = self.rays[buffer_index]
+            rays["x0"][:number_of_rays] = x0[:number_of_rays]
+            rays["y0"][:number_of_rays] = y0[:number_of_rays]
+            rays["x1"][:number_of_rays] = x1[:number_of_rays]
+            rays["y1"][:number_of_rays] = y1[:number_of_rays]
+            rays["color"][:number_of_rays] = colors[:number_of_rays]
+        header[TICK] = tick
+        header[NUMBER_OF_ENTITIES] = len(entity_records)
+        header[NUMBER_OF_RAYS] = number_of_rays
+        header[SEQUENCE] += 1
+        self.control[LATEST] = buffer_index
+
+    def read_latest(self):
+        """Returns (tick, entities, rays) copied out of the latest complete buffer, or None if nothing is published yet"""
+        while True:
+            buffer_index = self.control[LATEST]
+            if buffer_index == -1:
+                return None
+            header = self.headers[buffer_index]
+            sequence = header[SEQUENCE]
+            if sequence % 2 == 1:
+                continue
+            tick = int(header[TICK])
+            entities = self.entities[buffer_index][:header[NUMBER_OF_ENTITIES]].copy()
+            rays = self.rays[buffer_index][:header[NUMBER_OF_RAYS]].copy()
+            if header[SEQUENCE] == sequence:
+                return tick, entities, rays
+
+    def request_stop(self):
+        self.control[STOP] = 1
+
+    def is_stop_requested(self):
+        return bool(self.control[STOP])
+
+    def close(self):
+        self.control = None
+        self.headers = []
+        self.entities = []
+        self.rays = []
+        self.memory.close()
+        if self.is_owner:
+            self.memory.unlink()
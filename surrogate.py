@@ -0,0 +1,399 @@
+"""Lanchester-style surrogate of the full simulation for quick what-if questions like "what if NC brings 30 more".
+Battles are summarized by a few numbers per faction (soldiers, mean aim, damage per tick of their weapon mix, spawn timer
+and how long they take to walk to the fight) and the map's openness. Deaths follow Lanchester's aimed fire law with
+reinforcements: every faction loses soldiers in proportion to the fire the other factions aim at it from the tick they
+first come within engagement range of each other, and capture point owners follow a multinomial logit of the factions' fighting strength and arrival
+time. The coefficients are fitted to outcomes of full simulations with their error bounds, and predictions for battles
+unlike any the model was fitted to are flagged so they can be run for real"""
+import json
+import warnings
+from math import exp, log, sqrt, hypot, ceil
+import numpy as np
+import globals
+from utility import Point
+from archetypes import get_archetype
+
+
+# Mean of min(random() + 0.3, 1), the aim soldiers get when the scenario doesn't give one
+DEFAULT_MEAN_AIM = 0.755
+# Per-faction features whose calibrated range is checked, along with the map's openness and the number of ticks
+FACTION_RANGE_FEATURES = ("soldiers", "aim", "damage_rate", "engagement_range", "spawn_timer", "arrival_ticks")
+BATTLE_RANGE_FEATURES = ("openness", "ticks")
+NEUTRAL = "Neutral"
+
+
+def get_damage_rate(archetype):
+    """Mean damage per tick of one soldier that always hits, over the falloff ranges it engages enemies at"""
+    engagement_range = archetype.enemy_engagement_range
+    total_damage = 0
+    for (minimum_range, maximum_range), damage in archetype.damage_falloff.items():
+        total_damage += damage * max(min(maximum_range, engagement_range) - minimum_range, 0)
+    # A shot is fired every fire_rate + 1 ticks since the counter is reset to 0 and counts up to fire_rate
+    return total_damage / engagement_range / (archetype.fire_rate + 1)
+
+
+def get_route_positions(route, ticks):
+    """x and y of a faction's soldiers at every tick of the ticks array, walking their route in a straight line at their
+    speed, NaN before they spawn. route is (start Point, end Point, tick they spawn, distance walked per tick)"""
+    start, end, start_tick, speed = route
+    length = hypot(end.x - start.x, end.y - start.y)
+    fraction = np.clip((ticks - start_tick) * speed / length, 0, 1) if length > 0 else np.zeros(len(ticks))
+    x = np.where(ticks >= start_tick, start.x + (end.x - start.x) * fraction, np.nan)
+    y = np.where(ticks >= start_tick, start.y + (end.y - start.y) * fraction, np.nan)
+    return x, y
+
+
+def get_engagement_tick(shooter_route, target_route, engagement_range):
+    """First tick the shooter's soldiers are within their engagement range of the target's on their routes, None if they
+    never are. Line of sight isn't checked, walls are left to the openness term of the attrition fit"""
+    last_tick = 0
+    for start, end, start_tick, speed in (shooter_route, target_route):
+        last_tick = max(last_tick, start_tick + hypot(end.x - start.x, end.y - start.y) / speed)
+    # Both stand still once they reach the end of their routes, so later ticks can't bring them closer
+    ticks = np.arange(0, ceil(last_tick) + 1, dtype=np.float64)
+    shooter_x, shooter_y = get_route_positions(shooter_route, ticks)
+    target_x, target_y = get_route_positions(target_route, ticks)
+    with np.errstate(invalid="ignore"):
+        in_range = np.flatnonzero(np.hypot(shooter_x - target_x, shooter_y - target_y) <= engagement_range)
+    return float(ticks[in_range[0]]) if len(in_range) else None
+
+
+def get_scenario_features(scenario, ticks=None):
+    """The numbers the surrogate predicts a scenario's outcome from. Format:
+    {"ticks", "openness", "capture_points": [ids], "factions": {faction: {"soldiers", "aim", "damage_rate", "health",
+    "engagement_range", "spawn_timer", "arrival_ticks", "capture_point_arrival_ticks": [ticks to reach each capture point],
+    "engagement_ticks": {enemy: first tick the faction can shoot at the enemy or None}}}}.
+    Loading the map makes this much slower than a prediction, so for what-ifs the features are changed and predicted again"""
+    map = scenario.load_map(None)
+    empty_squares = sum(1 for row in range(0, map.nrows) for col in range(0, map.ncols) if map.map_array[row][col] == 0)
+    features = {"ticks": scenario.ticks if ticks is None else ticks, "openness": empty_squares / (map.nrows * map.ncols),
+                "capture_points": list(range(0, len(scenario.capture_points))), "factions": {}}
+    capture_point_coordinates = [scenario.get_placement_coordinates(map, capture_point) for capture_point in scenario.capture_points]
+    spawn_points = {}
+    speeds = {}
+    for spawn_point in scenario.spawn_points:
+        spawn_points.setdefault(spawn_point["faction"], []).append((scenario.get_placement_coordinates(map, spawn_point),
+                                                                    spawn_point.get("spawn_timer", 2000)))
+    for faction, soldiers in scenario.factions.items():
+        # Soldiers without a spawn point never enter the battle
+        if soldiers.get("soldiers", 0) == 0 or faction not in spawn_points:
+            continue
+        weapons = soldiers.get("weapons") or {weapon_type: 1 for weapon_type in globals.WEAPON_TYPES}
+        total_weight = sum(weapons.values())
+        archetypes = [(get_archetype(weapon_type), weight / total_weight) for weapon_type, weight in weapons.items()]
+        aim = soldiers.get("aim")
+        speed = sum(archetype.movement_speed * weight for archetype, weight in archetypes) * scenario.dt
+        speeds[faction] = speed
+        features["factions"][faction] = {"soldiers": soldiers["soldiers"], "aim": (aim[0] + aim[1]) / 2 if aim is not None else DEFAULT_MEAN_AIM,
+                                         "damage_rate": sum(get_damage_rate(archetype) * weight for archetype, weight in archetypes),
+                                         "health": sum(archetype.maximum_health * weight for archetype, weight in archetypes),
+                                         "engagement_range": sum(archetype.enemy_engagement_range * weight for archetype, weight in archetypes),
+                                         "spawn_timer": min(spawn_timer for coordinates, spawn_timer in spawn_points[faction]),
+                                         "capture_point_arrival_ticks": []}
+        for capture_point in capture_point_coordinates:
+            walking_ticks = min(hypot(coordinates.x - capture_point.x, coordinates.y - capture_point.y) for coordinates, spawn_timer in spawn_points[faction]) / speed
+            features["factions"][faction]["capture_point_arrival_ticks"].append(features["factions"][faction]["spawn_timer"] + walking_ticks)
+    # Every faction walks from its spawn point to the capture point it reaches first
+    routes = {}
+    for faction, faction_features in features["factions"].items():
+        if faction_features["capture_point_arrival_ticks"]:
+            faction_features["arrival_ticks"] = min(faction_features["capture_point_arrival_ticks"])
+            objective = capture_point_coordinates[faction_features["capture_point_arrival_ticks"].index(faction_features["arrival_ticks"])]
+            start = min((coordinates for coordinates, spawn_timer in spawn_points[faction]),
+                        key=lambda coordinates: hypot(coordinates.x - objective.x, coordinates.y - objective.y))
+        else:
+            # Without capture points factions meet halfway to the closest enemy spawn point
+            enemy_spawn_points = [(hypot(coordinates.x - enemy_coordinates.x, coordinates.y - enemy_coordinates.y), coordinates, enemy_coordinates)
+                                  for coordinates, spawn_timer in spawn_points[faction]
+                                  for enemy in features["factions"] if enemy != faction
+                                  for enemy_coordinates, enemy_spawn_timer in spawn_points[enemy]]
+            if enemy_spawn_points:
+                distance, start, enemy_coordinates = min(enemy_spawn_points, key=lambda enemy_spawn_point: enemy_spawn_point[0])
+                objective = Point((start.x + enemy_coordinates.x) / 2, (start.y + enemy_coordinates.y) / 2)
+            else:
+                distance, start, objective = 0, spawn_points[faction][0][0], spawn_points[faction][0][0]
+            faction_features["arrival_ticks"] = faction_features["spawn_timer"] + distance / 2 / speeds[faction]
+        routes[faction] = (start, objective, faction_features["spawn_timer"], speeds[faction])
+    for faction, faction_features in features["factions"].items():
+        faction_features["engagement_ticks"] = {enemy: get_engagement_tick(routes[faction], routes[enemy], faction_features["engagement_range"])
+                                                for enemy in features["factions"] if enemy != faction}
+    return features
+
+
+def get_exposures(features):
+    """Format: {(shooter faction, target faction): expected kills with every shot hitting}. Each faction splits its fire
+    over its enemies by their number of soldiers, and fights from the first tick its soldiers are in range of the enemy's"""
+    factions = features["factions"]
+    exposures = {}
+    for shooter, shooter_features in factions.items():
+        enemy_soldiers = sum(target_features["soldiers"] for target, target_features in factions.items() if target != shooter)
+        if enemy_soldiers == 0:
+            continue
+        fire = shooter_features["soldiers"] * shooter_features["aim"] * shooter_features["damage_rate"]
+        for target, target_features in factions.items():
+            if target == shooter:
+                continue
+            engagement_tick = shooter_features["engagement_ticks"][target]
+            engaged_ticks = max(features["ticks"] - engagement_tick, 0) if engagement_tick is not None else 0
+            exposures[(shooter, target)] = fire * target_features["soldiers"] / enemy_soldiers * engaged_ticks / target_features["health"]
+    return exposures
+
+
+def get_attrition_row(exposure, openness):
+    return [exposure, exposure * openness]
+
+
+def get_capture_point_scores(features, capture_point_index, weights):
+    """Format: {owner: score} of a multinomial logit over the factions and Neutral"""
+    strength_weight, arrival_weight, neutral_weight, neutral_arrival_weight = weights
+    ticks = features["ticks"]
+    scores = {}
+    earliest_arrival = 1
+    for faction, faction_features in features["factions"].items():
+        arrival = faction_features["capture_point_arrival_ticks"][capture_point_index] / ticks
+        earliest_arrival = min(earliest_arrival, arrival)
+        strength = faction_features["soldiers"] * faction_features["aim"] * faction_features["damage_rate"]
+        scores[faction] = strength_weight * log(strength + 1e-9) - arrival_weight * arrival
+    # Points nobody reaches early in the battle tend to stay Neutral
+    scores[NEUTRAL] = neutral_weight + neutral_arrival_weight * earliest_arrival
+    return scores
+
+
+class Surrogate:
+
+    def __init__(self, attrition_coefficients, attrition_covariance, attrition_residual_deviation, capture_weights,
+                 calibrated_range, errors=None):
+        """attrition_covariance is (X^T X)^-1 of the fit, scaled by the residual variance it gives the coefficients'"""
+        self.attrition_coefficients = attrition_coefficients
+        self.attrition_covariance = attrition_covariance
+        self.attrition_residual_deviation = attrition_residual_deviation
+        self.capture_weights = capture_weights
+        # Format: {feature name: [minimum, maximum]} over the battles the model was fitted to
+        self.calibrated_range = calibrated_range
+        self.errors = errors if errors is not None else {}
+
+    @classmethod
+    def fit(cls, samples, folds=5):
+        """Fits the model to [(features, outcome)] of full simulation runs and estimates its errors by cross-validation"""
+        if len(samples) < 2: raise ValueError("At least 2 samples are needed to fit the surrogate")
+        model = cls.fit_without_errors(samples)
+        model.errors = get_cross_validation_errors(samples, folds)
+        model.errors["attrition_coefficient_standard_errors"] = [sqrt(model.attrition_covariance[i][i]) * model.attrition_residual_deviation for i in range(0, 2)]
+        return model
+
+    @classmethod
+    def fit_without_errors(cls, samples):
+        rows, deaths = [], []
+        capture_samples = []
+        calibrated_range = {}
+        for features, outcome in samples:
+            exposures = get_exposures(features)
+            for target in features["factions"]:
+                exposure = sum(exposure for (shooter, exposure_target), exposure in exposures.items() if exposure_target == target)
+                rows.append(get_attrition_row(exposure, features["openness"]))
+                deaths.append(outcome["deaths"][target])
+            for index, id in enumerate(features["capture_points"]):
+                capture_samples.append((features, index, outcome["capture_points"][str(id)]))
+            update_calibrated_range(calibrated_range, features)
+        x = np.array(rows, dtype=np.float64)
+        y = np.array(deaths, dtype=np.float64)
+        if not np.any(x[:, 0]): raise ValueError("No faction came within engagement range of an enemy in any battle, so there is no fighting to fit deaths to")
+        coefficients, residuals, rank, singular_values = np.linalg.lstsq(x, y, rcond=None)
+        if rank < 2:
+            warnings.warn("The battles don't tell the openness term of the attrition fit apart (they were all fought on maps "
+                          "equally open), so predictions for maps more or less open than them are unreliable")
+        degrees_of_freedom = max(len(y) - x.shape[1], 1)
+        residual_deviation = sqrt(float(np.sum((y - x @ coefficients) ** 2)) / degrees_of_freedom)
+        covariance = np.linalg.pinv(x.T @ x)
+        return cls(coefficients.tolist(), covariance.tolist(), residual_deviation, fit_capture_weights(capture_samples), calibrated_range)
+
+    def predict(self, features, z=1.96):
+        """Predicted deaths and kills of every faction with prediction intervals, and the probability of every owner of
+        every capture point at the end. Features outside the calibrated range are listed in outside_calibrated_range"""
+        exposures = get_exposures(features)
+        openness = features["openness"]
+        first_coefficient, second_coefficient = self.attrition_coefficients
+        covariance = self.attrition_covariance
+        deaths = {}
+        kills = {faction: 0 for faction in features["factions"]}
+        for target in features["factions"]:
+            exposure = 0
+            for shooter in features["factions"]:
+                if (shooter, target) in exposures:
+                    shooter_kills = max(exposures[(shooter, target)] * (first_coefficient + second_coefficient * openness), 0)
+                    kills[shooter] += shooter_kills
+                    exposure += exposures[(shooter, target)]
+            x0, x1 = get_attrition_row(exposure, openness)
+            estimate = max(x0 * first_coefficient + x1 * second_coefficient, 0)
+            # Prediction interval of a new battle, the coefficients' uncertainty and the battle to battle spread
+            leverage = x0 * x0 * covariance[0][0] + 2 * x0 * x1 * covariance[0][1] + x1 * x1 * covariance[1][1]
+            half_width = z * self.attrition_residual_deviation * sqrt(1 + leverage)
+            deaths[target] = {"estimate": estimate, "interval": [max(estimate - half_width, 0), estimate + half_width]}
+        capture_points = {}
+        for index, id in enumerate(features["capture_points"]):
+            scores = get_capture_point_scores(features, index, self.capture_weights)
+            highest_score = max(scores.values())
+            total = sum(exp(score - highest_score) for score in scores.values())
+            capture_points[str(id)] = {owner: exp(score - highest_score) / total for owner, score in scores.items()}
+        return {"deaths": deaths, "kills": kills, "capture_points": capture_points,
+                "outside_calibrated_range": self.get_features_outside_calibrated_range(features)}
+
+    def get_features_outside_calibrated_range(self, features):
+        outside = []
+        for feature in BATTLE_RANGE_FEATURES:
+            minimum, maximum = self.calibrated_range[feature]
+            if not minimum <= features[feature] <= maximum:
+                outside.append(f"{feature} {features[feature]:g} is outside [{minimum:g}, {maximum:g}]")
+        for faction, faction_features in features["factions"].items():
+            for feature in FACTION_RANGE_FEATURES:
+                minimum, maximum = self.calibrated_range[feature]
+                if not minimum <= faction_features[feature] <= maximum:
+                    outside.append(f"{faction} {feature} {faction_features[feature]:g} is outside [{minimum:g}, {maximum:g}]")
+        return outside
+
+    def to_dict(self):
+        return {"attrition_coefficients": self.attrition_coefficients, "attrition_covariance": self.attrition_covariance,
+                "attrition_residual_deviation": self.attrition_residual_deviation, "capture_weights": self.capture_weights,
+                "calibrated_range": self.calibrated_range, "errors": self.errors}
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls(**json.load(f))
+
+
+def update_calibrated_range(calibrated_range, features):
+    values = [(feature, features[feature]) for feature in BATTLE_RANGE_FEATURES]
+    for faction_features in features["factions"].values():
+        values += [(feature, faction_features[feature]) for feature in FACTION_RANGE_FEATURES]
+    for feature, value in values:
+        if feature not in calibrated_range:
+            calibrated_range[feature] = [value, value]
+        else:
+            calibrated_range[feature] = [min(calibrated_range[feature][0], value), max(calibrated_range[feature][1], value)]
+
+
+def fit_capture_weights(capture_samples, iterations=2000, learning_rate=0.5, regularization=1e-3):
+    """Maximum likelihood weights of get_capture_point_scores by gradient ascent, [(features, capture point index, owner)].
+    The scores are linear in the weights, so each owner's score is its feature vector times the weights"""
+    if not capture_samples:
+        return [1.0, 1.0, 0.0, 0.0]
+    owners = globals.FACTION_LIST + [NEUTRAL]
+    feature_vectors = np.zeros((len(capture_samples), len(owners), 4))
+    possible = np.zeros((len(capture_samples), len(owners)), dtype=bool)
+    observed = np.zeros((len(capture_samples), len(owners)))
+    for i, (features, index, owner) in enumerate(capture_samples):
+        for j in range(0, 4):
+            unit_weights = [0.0] * 4
+            unit_weights[j] = 1.0
+            for owner_name, score in get_capture_point_scores(features, index, unit_weights).items():
+                feature_vectors[i, owners.index(owner_name), j] = score
+        for owner_name in list(features["factions"].keys()) + [NEUTRAL]:
+            possible[i, owners.index(owner_name)] = True
+        if owner in owners and possible[i, owners.index(owner)]:
+            observed[i, owners.index(owner)] = 1
+        else:
+            # Owned by a faction that had no soldiers, which can only be the scenario's starting owner
+            observed[i, owners.index(NEUTRAL)] = 1
+    weights = np.array([1.0, 1.0, 0.0, 0.0])
+    for iteration in range(0, iterations):
+        scores = np.where(possible, feature_vectors @ weights, -np.inf)
+        probabilities = np.exp(scores - scores.max(axis=1, keepdims=True))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        gradient = np.einsum("so,sof->f", observed - probabilities, feature_vectors) / len(capture_samples) - regularization * weights
+        weights += learning_rate * gradient
+        # More fighting strength and arriving earlier never make a faction less likely to hold a point, which keeps
+        # battles whose strengths barely varied from fitting a sign the model would extrapolate wrongly
+        weights[:2] = np.maximum(weights[:2], 0)
+    return weights.tolist()
+
+
+def get_cross_validation_errors(samples, folds):
+    """Errors of models fitted without each fold on the battles of that fold"""
+    folds = min(folds, len(samples))
+    squared_errors, absolute_errors = [], []
+    log_loss, correct, capture_predictions = 0, 0, 0
+    for fold in range(0, folds):
+        training_samples = [sample for i, sample in enumerate(samples) if i % folds != fold]
+        test_samples = [sample for i, sample in enumerate(samples) if i % folds == fold]
+        if len(training_samples) < 2:
+            continue
+        model = Surrogate.fit_without_errors(training_samples)
+        for features, outcome in test_samples:
+            prediction = model.predict(features)
+            for faction, deaths in prediction["deaths"].items():
+                squared_errors.append((deaths["estimate"] - outcome["deaths"][faction]) ** 2)
+                absolute_errors.append(abs(deaths["estimate"] - outcome["deaths"][faction]))
+            for id, probabilities in prediction["capture_points"].items():
+                owner = outcome["capture_points"][id]
+                log_loss -= log(max(probabilities.get(owner, 0), 1e-12))
+                correct += max(probabilities, key=probabilities.get) == owner
+                capture_predictions += 1
+    return {"deaths_rmse": sqrt(sum(squared_errors) / len(squared_errors)) if squared_errors else None,
+            "deaths_mean_absolute_error": sum(absolute_errors) / len(absolute_errors) if absolute_errors else None,
+            "capture_owner_accuracy": correct / capture_predictions if capture_predictions else None,
+            "capture_owner_log_loss": log_loss / capture_predictions if capture_predictions else None,
+            "samples": len(samples)}
+
+
+def calibrate(scenario_paths, seeds, ticks=None, processes=None, cache=None):
+    """Fits a surrogate to full simulations of every scenario with every seed, run through sweep.sweep and its cache"""
+    from sweep import sweep, load_scenario
+    samples = []
+    for scenario_path, seed, outcome in sweep(scenario_paths, seeds, ticks=ticks, processes=processes, cache=cache):
+        # Generated maps without their own seed change with the battle's seed, so the features are found per run
+        samples.append((get_scenario_features(load_scenario(scenario_path, seed), ticks), outcome))
+    return Surrogate.fit(samples)
+
+
+def parse_soldier_changes(changes):
+    """{faction: change} from strings like "NC=+30" or "TR=-10", or "VS=25" to set the number"""
+    parsed_changes = {}
+    for change in changes:
+        faction, value = change.split("=", 1)
+        if faction not in globals.FACTION_LIST: raise ValueError(f"faction has to be one of {globals.FACTION_LIST}")
+        parsed_changes[faction] = (value[0] in "+-", int(value))
+    return parsed_changes
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from sweep import parse_seeds
+    from scenario import Scenario
+    from result_cache import ResultCache
+    parser = argparse.ArgumentParser(description="Fit a Lanchester-style surrogate to full simulations and predict battles with it")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    calibrate_parser = subparsers.add_parser("calibrate", help="fit the surrogate to runs of scenario files")
+    calibrate_parser.add_argument("scenarios", nargs="+", help="scenario files (.json or .toml), the more they differ the wider the calibrated range")
+    calibrate_parser.add_argument("--seeds", default="0-9", help="seeds to run every scenario with (default: 0-9)")
+    calibrate_parser.add_argument("--ticks", type=int, default=None, help="number of ticks to run (default: every scenario's ticks)")
+    calibrate_parser.add_argument("--processes", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    calibrate_parser.add_argument("--cache", default=globals.RESULT_CACHE_DIRECTORY, help="result cache directory")
+    calibrate_parser.add_argument("--output", required=True, help="file to save the fitted model to")
+    predict_parser = subparsers.add_parser("predict", help="predict a scenario's outcome with a fitted surrogate")
+    predict_parser.add_argument("model", help="model file saved by calibrate")
+    predict_parser.add_argument("scenario", help="scenario file (.json or .toml)")
+    predict_parser.add_argument("--soldiers", action="append", default=[], help="change a faction's soldiers, like NC=+30, TR=-10 or VS=25, can be repeated")
+    predict_parser.add_argument("--ticks", type=int, default=None, help="number of ticks (default: the scenario's ticks)")
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        model = calibrate(args.scenarios, parse_seeds(args.seeds), ticks=args.ticks, processes=args.processes, cache=ResultCache(args.cache))
+        model.save(args.output)
+        print(json.dumps(model.errors, indent=2))
+    else:
+        model = Surrogate.load(args.model)
+        query_features = get_scenario_features(Scenario.from_file(args.scenario), args.ticks)
+        for faction, (is_relative, value) in parse_soldier_changes(args.soldiers).items():
+            if faction not in query_features["factions"]: raise ValueError(f"{faction} has no soldiers or spawn point in the scenario")
+            faction_features = query_features["factions"][faction]
+            faction_features["soldiers"] = faction_features["soldiers"] + value if is_relative else value
+        start = time.perf_counter()
+        prediction = model.predict(query_features)
+        prediction["prediction_microseconds"] = (time.perf_counter() - start) * 1e6
+        print(json.dumps(prediction, indent=2))
@@ -0,0 +1,87 @@
+"""Runs every combination of scenario files and seeds in worker processes. Each outcome goes into the result cache as soon
+as its battle is finished, so an interrupted sweep is resumed by running it again: configurations that already have a
+result are read from the cache instead of being run"""
+import os
+import json
+import multiprocessing
+from scenario import Scenario
+from result_cache import ResultCache
+from run_scenario import run_scenario
+
+
+def parse_seeds(seeds):
+    """Seeds from a string like "0-99,200,300-309", ranges include both ends"""
+    parsed_seeds = []
+    for part in seeds.split(","):
+        if "-" in part.strip()[1:]:
+            first, last = part.strip().rsplit("-", 1)
+            if int(last) < int(first): raise ValueError(f"Seed range {part} has to go from the smaller to the larger seed")
+            parsed_seeds.extend(range(int(first), int(last) + 1))
+        else:
+            parsed_seeds.append(int(part))
+    return parsed_seeds
+
+
+def load_scenario(scenario_path, seed):
+    scenario = Scenario.from_file(scenario_path)
+    scenario.seed = seed
+    return scenario
+
+
+def run_configuration(configuration):
+    """Runs in a worker process, configuration is (scenario path, seed, ticks, cache directory, cache max bytes)"""
+    scenario_path, seed, ticks, cache_directory, cache_max_bytes = configuration
+    result = run_scenario(load_scenario(scenario_path, seed), ticks=ticks, cache=ResultCache(cache_directory, cache_max_bytes))
+    return scenario_path, seed, result
+
+
+def sweep(scenario_paths, seeds, ticks=None, processes=None, cache=None):
+    """Yields (scenario path, seed, outcome) for every configuration, the cached ones first and the others as they finish"""
+    if cache is None:
+        cache = ResultCache()
+    configurations = []
+    for scenario_path in scenario_paths:
+        for seed in seeds:
+            scenario = load_scenario(scenario_path, seed)
+            outcome = cache.get(cache.get_key(scenario, ticks))
+            if outcome is not None:
+                yield scenario_path, seed, dict(outcome, scenario=scenario.name, seed=seed, cached=True, ticks_per_second=None)
+            else:
+                configurations.append((scenario_path, seed, ticks, cache.directory, cache.max_bytes))
+    if not configurations:
+        return
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1:
+        for configuration in configurations:
+            yield run_configuration(configuration)
+        return
+    with multiprocessing.Pool(processes=processes) as pool:
+        for result in pool.imap_unordered(run_configuration, configurations):
+            yield result
+
+
+if __name__ == "__main__":
+    import argparse
+    import globals
+    parser = argparse.ArgumentParser(description="Run scenario files with many seeds, resuming from the result cache")
+    parser.add_argument("scenarios", nargs="+", help="scenario files (.json or .toml)")
+    parser.add_argument("--seeds", default="0-9", help="seeds to run every scenario with, like 0-99,200 (default: 0-9)")
+    parser.add_argument("--ticks", type=int, default=None, help="number of ticks to run (default: every scenario's ticks)")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--cache", default=globals.RESULT_CACHE_DIRECTORY, help="result cache directory")
+    parser.add_argument("--output", default=None, help="append one JSON line per outcome to this file instead of stdout")
+    args = parser.parse_args()
+    output = open(args.output, "a") if args.output is not None else None
+    try:
+        for path, run_seed, run_outcome in sweep(args.scenarios, parse_seeds(args.seeds), ticks=args.ticks, processes=args.processes,
+                                                 cache=ResultCache(args.cache)):
+            line = json.dumps(dict(run_outcome, path=path))
+            if output is not None:
+                output.write(line + "\n")
+                output.flush()
+            else:
+                print(line, flush=True)
+    finally:
+        if output is not None:
+            output.close()
@@ -0,0 +1,170 @@
+"""Battle telemetry recorded into columnar NumPy buffers and written out in large compressed .npz chunks.
+Like the profiler, recording code only runs while globals.telemetry is set"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import globals
+from shot_buffer import FACTION_CODES
+
+
+# Format: {table name: ((column name, dtype), ...)}
+TABLES = {"capture_counts": (("tick", np.int64), ("capture_point_id", np.int32), ("TR", np.int32), ("NC", np.int32), ("VS", np.int32)),
+          "ownership": (("tick", np.int64), ("capture_point_id", np.int32), ("faction", np.int8)),
+          "shots": (("tick", np.int64), ("shooter_id", np.int32), ("target_id", np.int32), ("shooter_faction", np.int8),
+                    ("distance", np.float32), ("hit", np.bool_), ("damage", np.float32), ("killed", np.bool_)),
+          "positions": (("tick", np.int64), ("soldier_id", np.int32), ("x", np.float32), ("y", np.float32),
+                        ("health", np.float32), ("alive", np.bool_))}
+
+
+class ColumnarBuffer:
+
+    def __init__(self, columns, capacity):
+        self.columns = columns
+        self.capacity = capacity
+        self.arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in columns}
+        self.size = 0
+
+    def is_full(self, extra_rows=1):
+        return self.size + extra_rows > self.capacity
+
+    def append_row(self, values):
+        for (name, dtype), value in zip(self.columns, values):
+            self.arrays[name][self.size] = value
+        self.size += 1
+
+    def append_rows(self, column_values, number_of_rows):
+        """column_values has one sequence per column, which is much faster than appending rows one at a time"""
+        for (name, dtype), values in zip(self.columns, column_values):
+            self.arrays[name][self.size:self.size + number_of_rows] = values
+        self.size += number_of_rows
+
+    def take(self):
+        """Returns the filled part of the columns and starts over with new arrays, the old ones are handed to the writer"""
+        filled = {name: array[:self.size] for name, array in self.arrays.items()}
+        self.arrays = {name: np.empty(self.capacity, dtype=dtype) for name, dtype in self.columns}
+        self.size = 0
+        return filled
+
+
+class TelemetryRecorder:
+
+    def __init__(self, output_directory, position_sample_interval=None, chunk_rows=None):
+        if position_sample_interval is None:
+            position_sample_interval = globals.TELEMETRY_POSITION_SAMPLE_INTERVAL
+        if chunk_rows is None:
+            chunk_rows = globals.TELEMETRY_CHUNK_ROWS
+        if not isinstance(position_sample_interval, int) or position_sample_interval <= 0: raise ValueError("position_sample_interval has to be a positive int")
+        self.output_directory = output_directory
+        os.makedirs(output_directory, exist_ok=True)
+        self.position_sample_interval = position_sample_interval
+        self.buffers = {table: ColumnarBuffer(columns, chunk_rows) for table, columns in TABLES.items()}
+        self.next_chunk_number = dict.fromkeys(TABLES, 0)
+        # Format: {capture point id: faction}, so only ownership changes are recorded
+        self.last_capture_point_factions = {}
+        # Compressing and writing happens on another thread so the simulation doesn't wait for it
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.pending_writes = []
+
+    def record_shots(self, shot_buffer):
+        """Copies the shots that landed this tick out of the simulation's shot buffer"""
+        shots = shot_buffer.get_resolved_shots()
+        number_of_shots = len(shots["tick"])
+        if number_of_shots == 0:
+            return
+        columns = {"tick": shots["tick"], "shooter_id": shots["shooter_id"], "target_id": shots["target_id"],
+                   "shooter_faction": shots["faction"], "distance": shots["distance"], "hit": shots["hit"],
+                   "damage": shots["damage"], "killed": shots["killed"]}
+        buffer = self.buffers["shots"]
+        if buffer.is_full(number_of_shots):
+            self.flush_table("shots")
+        if buffer.is_full(number_of_shots):
+            self.write_chunk("shots", columns)
+            return
+        buffer.append_rows([columns[name] for name, dtype in TABLES["shots"]], number_of_shots)
+
+    def record_tick(self, tick):
+        """Called at the end of every simulation tick"""
+        if globals.shot_buffer is not None:
+            self.record_shots(globals.shot_buffer)
+        capture_points = list(globals.capture_point_dict.values())
+        if capture_points:
+            buffer = self.buffers["capture_counts"]
+            if buffer.is_full(len(capture_points)):
+                self.flush_table("capture_counts")
+            counts = [capture_point.faction_counter for capture_point in capture_points]
+            buffer.append_rows(([tick] * len(capture_points), [capture_point.id for capture_point in capture_points],
+                                [count["TR"] for count in counts], [count["NC"] for count in counts], [count["VS"] for count in counts]),
+                               len(capture_points))
+            for capture_point in capture_points:
+                if self.last_capture_point_factions.get(capture_point.id) != capture_point.current_faction:
+                    self.last_capture_point_factions[capture_point.id] = capture_point.current_faction
+                    if self.buffers["ownership"].is_full():
+                        self.flush_table("ownership")
+                    self.buffers["ownership"].append_row((tick, capture_point.id, FACTION_CODES[capture_point.current_faction]))
+        if tick % self.position_sample_interval == 0:
+            self.record_positions(tick)
+
+    def record_positions(self, tick):
+        soldiers = [soldier for soldier in globals.soldiers_dict.values() if soldier.coordinates_center is not None]
+        if not soldiers:
+            return
+        buffer = self.buffers["positions"]
+        if buffer.is_full(len(soldiers)):
+            self.flush_table("positions")
+        if buffer.is_full(len(soldiers)):
+            # More soldiers than fit in one chunk, so this sample becomes a chunk of its own
+            self.write_chunk("positions", self.build_positions_columns(tick, soldiers))
+            return
+        buffer.append_rows(list(self.build_positions_columns(tick, soldiers).values()), len(soldiers))
+
+    def build_positions_columns(self, tick, soldiers):
+        return {"tick": np.full(len(soldiers), tick, dtype=np.int64),
+                "soldier_id": [soldier.id for soldier in soldiers],
+                "x": [soldier.coordinates_center.x for soldier in soldiers],
+                "y": [soldier.coordinates_center.y for soldier in soldiers],
+                "health": [soldier.health for soldier in soldiers],
+                "alive": [soldier.alive for soldier in soldiers]}
+
+    def flush_table(self, table):
+        if self.buffers[table].size == 0:
+            return
+        self.write_chunk(table, self.buffers[table].take())
+
+    def write_chunk(self, table, columns):
+        path = os.path.join(self.output_directory, f"{table}_{self.next_chunk_number[table]:05d}.npz")
+        self.next_chunk_number[table] += 1
+        self.pending_writes = [write for write in self.pending_writes if not write.done()]
+        self.pending_writes.append(self.writer.submit(np.savez_compressed, path, **columns))
+
+    def close(self):
+        for table in TABLES:
+            self.flush_table(table)
+        self.writer.shutdown(wait=True)
+        for write in self.pending_writes:
+            # Raises any error from the writer thread
+            write.result()
+        self.pending_writes = []
+
+
+def load_table(output_directory, table):
+    """Concatenates every chunk of a table back into one array per column"""
+    if table not in TABLES: raise ValueError(f"table has to be one of {tuple(TABLES.keys())}")
+    chunk_files = sorted(file for file in os.listdir(output_directory) if file.startswith(f"{table}_") and file.endswith(".npz"))
+    columns = {name: [] for name, dtype in TABLES[table]}
+    for chunk_file in chunk_files:
+        with np.load(os.path.join(output_directory, chunk_file)) as chunk:
+            for name in columns:
+                columns[name].append(chunk[name])
+    return {name: np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+            for (name, dtype), arrays in zip(TABLES[table], columns.values())}
+
+
+def enable_telemetry(output_directory, position_sample_interval=None, chunk_rows=None):
+    globals.telemetry = TelemetryRecorder(output_directory, position_sample_interval, chunk_rows)
+    return globals.telemetry
+
+
+def disable_telemetry():
+    if globals.telemetry is not None:
+        globals.telemetry.close()
+        globals.telemetry = None
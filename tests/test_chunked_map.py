@@ -0,0 +1,55 @@
+"""Regression tests for the chunked map storage LRU"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunked_map import write_tiled_map, ChunkedMapStorage
+
+
+class ChunkedMapStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "map.tiles")
+        write_tiled_map(self.path, [[0] * 8 for row in range(0, 8)], chunk_size=4)
+
+    def open_storage(self, max_resident_chunks):
+        storage = ChunkedMapStorage(self.path, max_resident_chunks=max_resident_chunks)
+        self.addCleanup(storage.file.close)
+        return storage
+
+    def test_set_cell_with_only_pinned_chunks_resident(self):
+        # Pinned chunks fill the cache, so the chunk loaded for the write is the only one that can be evicted
+        storage = self.open_storage(max_resident_chunks=1)
+        storage.get_cell(0, 0)
+        storage.set_pinned_grid_positions([(0, 0)])
+        storage.set_cell(5, 5, 1)
+        self.assertEqual(storage.get_cell(5, 5), 1)
+        storage.flush()
+        self.assertEqual(self.open_storage(max_resident_chunks=4).get_cell(5, 5), 1)
+
+    def test_dirty_chunk_is_written_when_evicted(self):
+        storage = self.open_storage(max_resident_chunks=1)
+        storage.set_cell(1, 2, 1)
+        storage.get_cell(7, 7)
+        self.assertNotIn((0, 0), storage.resident_chunks)
+        self.assertNotIn((0, 0), storage.dirty_chunks)
+        storage.file.flush()
+        self.assertEqual(self.open_storage(max_resident_chunks=4).get_cell(1, 2), 1)
+        self.assertEqual(storage.get_cell(1, 2), 1)
+
+    def test_pinned_chunks_are_not_evicted(self):
+        storage = self.open_storage(max_resident_chunks=2)
+        storage.set_cell(0, 0, 1)
+        storage.set_pinned_grid_positions([(0, 0)])
+        for row, col in ((0, 4), (4, 0), (4, 4)):
+            storage.get_cell(row, col)
+        self.assertIn((0, 0), storage.resident_chunks)
+        self.assertLessEqual(len(storage.resident_chunks), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+"""Runs a battle in this process and draws it in a separate viewer process, so drawing never slows the simulation
+down and a slow tick never freezes the window. The two only share the latest snapshot.SnapshotBuffer and a queue of
+the walls added or removed during the battle.
+
+Usage: python viewer.py CHECKPOINT [--dt DT] [--ticks-per-second N] [--ticks N]"""
+import multiprocessing
+import time
+import globals
+from utility import *
+from simulation import Simulation
+from snapshot import SnapshotBuffer, SQUARE
+
+
+def get_map_source(map):
+    """What the viewer needs to rebuild the map as it is when the viewer starts, later wall edits are sent as they happen"""
+    if map.is_chunked:
+        return "tiled", map.map_array.storage.path
+    return "array", [list(map_row) for map_row in map.map_array]
+
+
+def viewer_main(snapshot_name, entity_capacity, ray_capacity, map_source, cell_size, wall_color, fps, map_changes):
+    """Entry point of the viewer process, map_changes is a queue of (row, col, value) wall edits made in the battle"""
+    import queue
+    import pygame
+    from map import Map
+    from camera import Camera
+    pygame.init()
+    win = pygame.display.set_mode(globals.WIN_SIZE)
+    pygame.display.set_caption("Planetside Battle Simulator Viewer")
+    clock = pygame.time.Clock()
+    source_type, source = map_source
+    if source_type == "tiled":
+        map = Map.from_tiled_file(win=win, path=source, wall_color=wall_color, cell_size=cell_size)
+    else:
+        map = Map(win=win, map_array=source, wall_color=wall_color, cell_size=cell_size)
+    camera = Camera(globals.WIN_WIDTH, globals.WIN_HEIGHT, map)
+    snapshot_buffer = SnapshotBuffer(name=snapshot_name, entity_capacity=entity_capacity, ray_capacity=ray_capacity)
+    last_tick = None
+    try:
+        while not snapshot_buffer.is_stop_requested():
+            dt = clock.tick(fps)
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    snapshot_buffer.request_stop()
+                camera.handle_event(event)
+            camera.update(dt)
+            while True:
+                try:
+                    row, col, value = map_changes.get_nowait()
+                except queue.Empty:
+                    break
+                map.set_cell(row, col, value)
+            snapshot = snapshot_buffer.read_latest()
+            win.fill(globals.BLACK)
+            if map.show_gridlines:
+                map.draw_gridlines(camera)
+            if snapshot is not None:
+                last_tick, entities, rays = snapshot
+                draw_snapshot(win, camera, entities, rays)
+            map.draw(camera)
+            pygame.display.set_caption(f"Planetside Battle Simulator Viewer - tick {last_tick}")
+            pygame.display.update()
+    finally:
+        snapshot_buffer.close()
+        pygame.quit()
+
+
+def draw_snapshot(win, camera, entities, rays):
+    from pygame import draw
+    for ray in rays:
+        if not camera.is_point_visible(ray["x0"], ray["y0"]) and not camera.is_point_visible(ray["x1"], ray["y1"]):
+            continue
+        draw.line(win, tuple(ray["color"]), camera.world_to_screen(ray["x0"], ray["y0"]), camera.world_to_screen(ray["x1"], ray["y1"]), width=1)
+    for entity in entities:
+        x, y, size = float(entity["x"]), float(entity["y"]), float(entity["size"])
+        if entity["ring_radius"] > 0 and camera.is_point_visible(x, y, margin=entity["ring_radius"]):
+            draw.circle(win, globals.WHITE, camera.world_to_screen(x, y), camera.scale(entity["ring_radius"]), width=1)
+        if entity["shape"] == SQUARE:
+            if camera.is_rect_visible(x, y, size, size):
+                screen_x, screen_y = camera.world_to_screen(x, y)
+                draw.rect(win, tuple(entity["color"]), (screen_x, screen_y, max(camera.scale(size), 1), max(camera.scale(size), 1)))
+        elif camera.is_point_visible(x, y, margin=size):
+            draw.circle(win, tuple(entity["color"]), camera.world_to_screen(x, y), max(camera.scale(size), 1))
+
+
+def run_with_viewer(simulation, dt, ticks_per_second=None, number_of_ticks=None):
+    """Advances the simulation and publishes every tick until the viewer window is closed or number_of_ticks is reached.
+    ticks_per_second limits the simulation speed, None runs it as fast as it goes"""
+    if not isinstance(simulation, Simulation): raise TypeError("simulation has to be a Simulation object")
+    snapshot_buffer = SnapshotBuffer()
+    map_changes = multiprocessing.Queue()
+
+    def send_map_change(row, col, old_value, new_value):
+        map_changes.put((row, col, new_value))
+
+    viewer = multiprocessing.Process(target=viewer_main, daemon=True,
+                                     args=(snapshot_buffer.name, snapshot_buffer.entity_capacity, snapshot_buffer.ray_capacity,
+                                           get_map_source(simulation.map), simulation.map.grid_width, simulation.map.wall_color, globals.FPS,
+                                           map_changes))
+    viewer.start()
+    simulation.map.add_change_listener(send_map_change)
+    try:
+        next_tick_time = time.perf_counter()
+        while not snapshot_buffer.is_stop_requested() and viewer.is_alive():
+            if number_of_ticks is not None and simulation.tick >= number_of_ticks:
+                break
+            simulation.step(dt)
+            snapshot_buffer.publish(simulation.tick, globals.entity_list, globals.shot_buffer)
+            if ticks_per_second is not None:
+                next_tick_time += 1 / ticks_per_second
+                sleep_time = next_tick_time - time.perf_counter()
+                if sleep_time > 0:
+                    time.sleep(sleep_time)
+                else:
+                    # Running behind, don't try to catch up with a burst of ticks
+                    next_tick_time = time.perf_counter()
+    finally:
+        simulation.map.remove_change_listener(send_map_change)
+        snapshot_buffer.request_stop()
+        viewer.join(timeout=5)
+        if viewer.is_alive():
+            viewer.terminate()
+        snapshot_buffer.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    from pygame import Surface
+    from checkpoint import load_checkpoint
+    parser = argparse.ArgumentParser(description="Run a checkpointed battle with the window in a separate process")
+    parser.add_argument("checkpoint", help="checkpoint file saved with F5 or checkpoint.save_checkpoint")
+    parser.add_argument("--dt", type=float, default=1000 / globals.FPS, help="simulated milliseconds per tick")
+    parser.add_argument("--ticks-per-second", type=float, default=globals.FPS, help="simulation speed limit, 0 for no limit")
+    parser.add_argument("--ticks", type=int, default=None, help="stop after this tick")
+    args = parser.parse_args()
+    # The simulation process never opens a window, a plain Surface is enough for the entities
+    loaded_simulation = load_checkpoint(args.checkpoint, Surface(globals.WIN_SIZE))
+    run_with_viewer(loaded_simulation, args.dt, ticks_per_second=args.ticks_per_second or None, number_of_ticks=args.ticks)